@@ -1,5 +1,8 @@
 """Provides a command-line interface to interact with the automation"""
 
+from typing import Literal, Optional
+import datetime
+import os
 import sys
 import time
 import click
@@ -60,5 +63,167 @@ def restart() -> None:
     src.utils.MainloopToggle.start_mainloop()
 
 
+@cli.command(
+    name="archive-stats",
+    help="Show statistics about each day of the message archive. "
+    + "Uses the index of each day, so only new lines have to be read.",
+)
+@click.option(
+    "--date",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=None,
+    help="Only show the statistics of this (UTC) date.",
+)
+def archive_stats(date: Optional[datetime.datetime]) -> None:
+    dates = sorted(
+        set(
+            d
+            for d, _ in src.utils.ArchiveRotation.list_archive_files(
+                src.utils.messaging_agent.MESSAGE_ARCHIVE_DIR, ".csv"
+            )
+        )
+    )
+    if date is not None:
+        dates = [d for d in dates if d == date.date()]
+    if len(dates) == 0:
+        click.echo("No message archive files found")
+    for d in dates:
+        index = src.utils.MessageArchiveIndexer.get_index(
+            os.path.join(src.utils.messaging_agent.MESSAGE_ARCHIVE_DIR, d.strftime("%Y-%m-%d.csv"))
+        )
+        if (index is None) or (len(index.blocks) == 0):
+            click.echo(f"{d}: no messages")
+            continue
+        variants: dict[str, int] = {}
+        data_keys: set[str] = set()
+        for block in index.blocks:
+            for variant, count in block.variants.items():
+                variants[variant] = variants.get(variant, 0) + count
+            data_keys.update(block.data_keys)
+        first = datetime.datetime.fromtimestamp(
+            min([b.min_timestamp for b in index.blocks]), datetime.timezone.utc
+        )
+        last = datetime.datetime.fromtimestamp(
+            max([b.max_timestamp for b in index.blocks]), datetime.timezone.utc
+        )
+        click.echo(
+            f"{d}: {sum(variants.values())} messages ("
+            + ", ".join([f"{v}: {c}" for v, c in sorted(variants.items())])
+            + f"), {len(data_keys)} data keys, "
+            + f"{first.strftime('%H:%M:%S')} - {last.strftime('%H:%M:%S')} UTC"
+        )
+
+
+@cli.command(
+    name="logs",
+    help="Search the structured log archive (`config.logging_verbosity.structured_archive`). "
+    + "Uses the index of each day, so only the matching parts of the archive are read. "
+    + "With `--follow`, the last records of the current log file are shown instead and new "
+    + "records are shown as they are written.",
+)
+@click.option(
+    "--start",
+    type=click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"]),
+    default=None,
+    help="The start of the time range in UTC (default: start of today).",
+)
+@click.option(
+    "--end",
+    type=click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"]),
+    default=None,
+    help="The end of the time range in UTC (default: now).",
+)
+@click.option(
+    "--level",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"]),
+    default=None,
+    help="Only show records of this level or more important ones.",
+)
+@click.option(
+    "--origin",
+    multiple=True,
+    help="Only show records of this origin. Can be given multiple times.",
+)
+@click.option(
+    "--details",
+    is_flag=True,
+    default=False,
+    help="Also show the details and tracebacks of the records.",
+)
+@click.option(
+    "--follow",
+    is_flag=True,
+    default=False,
+    help="Show the last records of the current log file and then follow it like `tail -f`.",
+)
+@click.option(
+    "--lines",
+    type=click.IntRange(min=0),
+    default=10,
+    help="How many existing records of the current log file to show with `--follow`, "
+    + "before filtering by level and origin (default: 10).",
+)
+def logs(
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime],
+    level: Optional[Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"]],
+    origin: tuple[str, ...],
+    details: bool,
+    follow: bool,
+    lines: int,
+) -> None:
+    if follow:
+        levels = src.utils.logger.LOG_LEVELS[src.utils.logger.LOG_LEVELS.index(level or "DEBUG") :]
+        for text_record in src.utils.Logger.follow_log_file(n=lines):
+            # log line: "<timestamp> UTC+<offset> - <origin> - <level> - <subject>"
+            log_line = text_record.split("\n", 1)[0]
+            header = log_line.split(" - ", 3)
+            if (len(header) == 4) and (
+                (header[2].strip() not in levels)
+                or ((len(origin) > 0) and (header[1].strip() not in origin))
+            ):
+                continue
+            click.echo(text_record if details else log_line + "\n", nl=False)
+        return
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for record in src.utils.Logger.iterate_log_archive(
+        start=start or now.replace(hour=0, minute=0, second=0, microsecond=0),
+        end=end or (now + datetime.timedelta(seconds=1)),
+        min_level=level,
+        origins=list(origin) if len(origin) > 0 else None,
+    ):
+        timestamp = datetime.datetime.fromtimestamp(record.timestamp, datetime.timezone.utc)
+        click.echo(
+            f"{timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]} UTC "
+            + f"- {record.origin} - {record.level} - {record.subject}"
+        )
+        if details:
+            for key, value in record.details.items():
+                click.echo(f"--- {key} ".ljust(40, "-") + f"\n{value}")
+
+
+@cli.command(
+    name="recent-logs",
+    help="Print the last records of the in-memory ring buffer of an origin "
+    + "(`config.logging_verbosity.ring_buffer`) without reading the log files. "
+    + "Lists the available origins if no origin is given.",
+)
+@click.argument("origin", required=False, default=None)
+@click.option(
+    "--lines",
+    type=click.IntRange(min=1),
+    default=200,
+    help="How many records to print (default: 200).",
+)
+def recent_logs(origin: Optional[str], lines: int) -> None:
+    if origin is None:
+        for o in src.utils.LogRingBuffer.list_origins():
+            click.echo(o)
+        return
+    for record in src.utils.LogRingBuffer.read(origin, n=lines):
+        click.echo(record, nl=False)
+
+
 if __name__ == "__main__":
     cli.main(prog_name=f"{src.constants.NAME}-cli")
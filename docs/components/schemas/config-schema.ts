@@ -71,6 +71,32 @@ const CONFIG_SCHEMA: any = {
                         null
                     ],
                     "title": "Message Sending"
+                },
+                "structured_archive": {
+                    "default": null,
+                    "description": "The minimum log level for the structured archive in `data/logs/YYYY-MM-DD.jsonl` with one JSON object per record. It can be searched with `cli.py logs`.",
+                    "enum": [
+                        "DEBUG",
+                        "INFO",
+                        "WARNING",
+                        "ERROR",
+                        "EXCEPTION",
+                        null
+                    ],
+                    "title": "Structured Archive"
+                },
+                "ring_buffer": {
+                    "default": null,
+                    "description": "The minimum log level for the in-memory ring buffer of the last records of each origin in `data/log-buffers/`. The buffers can be read with `cli.py recent-logs` and the records of a procedure that died unexpectedly are attached to the error message of its lifecycle manager.",
+                    "enum": [
+                        "DEBUG",
+                        "INFO",
+                        "WARNING",
+                        "ERROR",
+                        "EXCEPTION",
+                        null
+                    ],
+                    "title": "Ring Buffer"
                 }
             },
             "required": [
@@ -81,6 +107,93 @@ const CONFIG_SCHEMA: any = {
             "title": "_LoggingVerbosityConfig",
             "type": "object"
         },
+        "log_suppression": {
+            "anyOf": [
+                {
+                    "properties": {
+                        "deduplication_window": {
+                            "anyOf": [
+                                {
+                                    "exclusiveMinimum": 0,
+                                    "maximum": 86400,
+                                    "type": "number"
+                                },
+                                {
+                                    "type": "null"
+                                }
+                            ],
+                            "default": 60,
+                            "description": "Log records with the same origin, level and subject that follow each other within this many seconds are collapsed: only the first one is written, and once the window has passed, one record with the number of repetitions is written. If this is `null`, records are not deduplicated.",
+                            "title": "Deduplication Window"
+                        },
+                        "message_rate_limit": {
+                            "anyOf": [
+                                {
+                                    "exclusiveMinimum": 0,
+                                    "maximum": 60000,
+                                    "type": "number"
+                                },
+                                {
+                                    "type": "null"
+                                }
+                            ],
+                            "default": 30,
+                            "description": "How many log messages per minute each origin can send to the backend on average (token bucket). Records above this limit are still written to the console and the file archive. If this is `null`, log messages are not rate limited.",
+                            "title": "Message Rate Limit"
+                        },
+                        "message_burst": {
+                            "default": 10,
+                            "description": "How many log messages each origin can send to the backend at once before the rate limit applies",
+                            "maximum": 10000,
+                            "minimum": 1,
+                            "title": "Message Burst",
+                            "type": "integer"
+                        }
+                    },
+                    "title": "_LogSuppressionConfig",
+                    "type": "object"
+                },
+                {
+                    "type": "null"
+                }
+            ],
+            "default": null,
+            "description": "If this is set, repeated log records are collapsed and the log messages sent to the backend are rate limited, so that a procedure failing in a tight loop cannot flood the message queue."
+        },
+        "async_logging": {
+            "anyOf": [
+                {
+                    "properties": {
+                        "max_queue_size": {
+                            "default": 10000,
+                            "description": "How many log records can wait in memory to be written by the background writer thread",
+                            "maximum": 1000000,
+                            "minimum": 1,
+                            "title": "Max Queue Size",
+                            "type": "integer"
+                        },
+                        "overflow_policy": {
+                            "default": "block",
+                            "description": "What to do when the log queue is full. `block` waits until the writer has made space. `drop_new` discards the new record. `drop_debug` discards new DEBUG and INFO records and waits for space for all other levels. The number of discarded records is logged as a warning.",
+                            "enum": [
+                                "block",
+                                "drop_new",
+                                "drop_debug"
+                            ],
+                            "title": "Overflow Policy",
+                            "type": "string"
+                        }
+                    },
+                    "title": "_AsyncLoggingConfig",
+                    "type": "object"
+                },
+                {
+                    "type": "null"
+                }
+            ],
+            "default": null,
+            "description": "If this is set, log records are written to the console, the file archive and the message queue by a background thread, so logging never blocks the calling procedure. If this is not set, log records are written on the calling thread."
+        },
         "updater": {
             "anyOf": [
                 {
@@ -228,6 +341,45 @@ const CONFIG_SCHEMA: any = {
                             "minimum": 0,
                             "title": "Max Drain Time",
                             "type": "integer"
+                        },
+                        "max_queued_messages": {
+                            "anyOf": [
+                                {
+                                    "minimum": 1,
+                                    "type": "integer"
+                                },
+                                {
+                                    "type": "null"
+                                }
+                            ],
+                            "default": null,
+                            "description": "The maximum number of messages in the active message queue. When the queue grows beyond this (e.g. during a long network outage), messages are dropped from the queue according to `queue_overflow_policy`. Dropped messages remain in the local message archive. If this is not set, the number of messages is not limited.",
+                            "title": "Max Queued Messages"
+                        },
+                        "max_queued_bytes": {
+                            "anyOf": [
+                                {
+                                    "minimum": 1,
+                                    "type": "integer"
+                                },
+                                {
+                                    "type": "null"
+                                }
+                            ],
+                            "default": null,
+                            "description": "The maximum total size of all messages in the active message queue in bytes. If this is not set, the size is not limited.",
+                            "title": "Max Queued Bytes"
+                        },
+                        "queue_overflow_policy": {
+                            "default": "drop_oldest",
+                            "description": "Which messages to drop when the active message queue exceeds its limits. \"drop_oldest\" drops the oldest messages first. \"drop_by_category\" drops the least important messages first (DEBUG logs, then INFO/WARNING logs, then data, then ERROR/EXCEPTION logs, then config messages). \"downsample_data\" removes every second message of the oldest data messages.",
+                            "enum": [
+                                "drop_oldest",
+                                "drop_by_category",
+                                "downsample_data"
+                            ],
+                            "title": "Queue Overflow Policy",
+                            "type": "string"
                         }
                     },
                     "required": [
@@ -244,6 +396,298 @@ const CONFIG_SCHEMA: any = {
             "default": null,
             "description": "If this is not set, the backend will not be used."
         },
+        "message_archive": {
+            "properties": {
+                "columnar": {
+                    "default": false,
+                    "description": "Whether to additionally store the numeric values of data messages in the columnar message archive in `data/messages-columnar/`. This is much faster to query for single data keys over long time ranges than the CSV message archive.",
+                    "title": "Columnar",
+                    "type": "boolean"
+                },
+                "flush_interval": {
+                    "default": 0,
+                    "description": "How many seconds lines may be buffered in memory before they are written to the CSV message archive. Buffered lines are written by a timer after this interval and when the process exits. With `0`, every message is written right away. If a process is killed, at most the messages of this interval are missing in the archive, but they are still sent by the backend.",
+                    "maximum": 300,
+                    "minimum": 0,
+                    "title": "Flush Interval",
+                    "type": "number"
+                },
+                "fsync": {
+                    "default": false,
+                    "description": "Whether to wait until the written lines of the CSV message archive have been written to the disk (`fsync`). This prevents losing the latest lines on a power loss but slows down writing messages.",
+                    "title": "Fsync",
+                    "type": "boolean"
+                }
+            },
+            "title": "_MessageArchiveConfig",
+            "type": "object"
+        },
+        "message_queue": {
+            "properties": {
+                "synchronous": {
+                    "default": "NORMAL",
+                    "description": "The SQLite `synchronous` level of the active message queue. `NORMAL` survives crashes of the software but the last messages might be lost on a power loss. `FULL` and `EXTRA` prevent this at the cost of one `fsync` per write. `OFF` is the fastest but the queue can be corrupted by a power loss.",
+                    "enum": [
+                        "OFF",
+                        "NORMAL",
+                        "FULL",
+                        "EXTRA"
+                    ],
+                    "title": "Synchronous",
+                    "type": "string"
+                }
+            },
+            "title": "_MessageQueueConfig",
+            "type": "object"
+        },
+        "archive_rotation": {
+            "anyOf": [
+                {
+                    "properties": {
+                        "compression": {
+                            "anyOf": [
+                                {
+                                    "enum": [
+                                        "gzip",
+                                        "xz",
+                                        "zstd"
+                                    ],
+                                    "type": "string"
+                                },
+                                {
+                                    "type": "null"
+                                }
+                            ],
+                            "default": "gzip",
+                            "description": "How to compress the message and log archive files of completed days. `zstd` requires the optional dependency `zstandard`. If this is `null`, the files are not compressed.",
+                            "title": "Compression"
+                        },
+                        "retention_days": {
+                            "anyOf": [
+                                {
+                                    "minimum": 1,
+                                    "type": "integer"
+                                },
+                                {
+                                    "type": "null"
+                                }
+                            ],
+                            "default": null,
+                            "description": "Delete archive files (including the days of the columnar message archive) that are older than this many days. If this is `null`, files are not deleted because of their age.",
+                            "title": "Retention Days"
+                        },
+                        "retention_bytes": {
+                            "anyOf": [
+                                {
+                                    "minimum": 1,
+                                    "type": "integer"
+                                },
+                                {
+                                    "type": "null"
+                                }
+                            ],
+                            "default": null,
+                            "description": "Delete the oldest archive files until the message archive, the columnar message archive and the log archive each take up less than this many bytes. The files of the current day are never deleted. If this is `null`, files are not deleted because of their size.",
+                            "title": "Retention Bytes"
+                        }
+                    },
+                    "title": "_ArchiveRotationConfig",
+                    "type": "object"
+                },
+                {
+                    "type": "null"
+                }
+            ],
+            "default": null,
+            "description": "If this is set, the system checks procedure compresses the message and log archive files of completed days and deletes old files. If this is not set, the archives are kept as plain text forever."
+        },
+        "state_history": {
+            "anyOf": [
+                {
+                    "properties": {
+                        "fields": {
+                            "default": [
+                                "system.last_5_min_load"
+                            ],
+                            "description": "The paths of the numeric state fields whose values are recorded, e.g. `system.last_5_min_load`.",
+                            "examples": [
+                                [
+                                    "system.last_5_min_load"
+                                ]
+                            ],
+                            "items": {
+                                "type": "string"
+                            },
+                            "title": "Fields",
+                            "type": "array"
+                        }
+                    },
+                    "title": "_StateHistoryConfig",
+                    "type": "object"
+                },
+                {
+                    "type": "null"
+                }
+            ],
+            "default": null,
+            "description": "If this is set, every update of the selected numeric state fields is recorded in `data/state-history/`, together with per-minute and per-hour aggregates. The history can be queried with `StateInterface.get_history` and `StateInterface.get_history_statistics`."
+        },
+        "resource_accounting": {
+            "anyOf": [
+                {
+                    "properties": {
+                        "seconds_between_samples": {
+                            "default": 60,
+                            "description": "How many seconds should be between two samples of the resource usage of each procedure and backend",
+                            "maximum": 7200,
+                            "minimum": 1,
+                            "title": "Seconds Between Samples",
+                            "type": "integer"
+                        },
+                        "limits": {
+                            "additionalProperties": {
+                                "properties": {
+                                    "soft_max_rss_mb": {
+                                        "anyOf": [
+                                            {
+                                                "exclusiveMinimum": 0,
+                                                "type": "number"
+                                            },
+                                            {
+                                                "type": "null"
+                                            }
+                                        ],
+                                        "default": null,
+                                        "description": "If the resident memory of the process exceeds this many megabytes, a warning is logged.",
+                                        "title": "Soft Max Rss Mb"
+                                    },
+                                    "max_rss_mb": {
+                                        "anyOf": [
+                                            {
+                                                "exclusiveMinimum": 0,
+                                                "type": "number"
+                                            },
+                                            {
+                                                "type": "null"
+                                            }
+                                        ],
+                                        "default": null,
+                                        "description": "If the resident memory of the process exceeds this many megabytes, the process is killed and restarted (subject to the restart backoff).",
+                                        "title": "Max Rss Mb"
+                                    },
+                                    "max_open_files": {
+                                        "anyOf": [
+                                            {
+                                                "minimum": 16,
+                                                "type": "integer"
+                                            },
+                                            {
+                                                "type": "null"
+                                            }
+                                        ],
+                                        "default": null,
+                                        "description": "The maximum number of open file descriptors of the process. This is set as the `RLIMIT_NOFILE` of the process, so opening more files fails.",
+                                        "title": "Max Open Files"
+                                    },
+                                    "nice": {
+                                        "anyOf": [
+                                            {
+                                                "maximum": 19,
+                                                "minimum": 0,
+                                                "type": "integer"
+                                            },
+                                            {
+                                                "type": "null"
+                                            }
+                                        ],
+                                        "default": null,
+                                        "description": "The niceness of the process. Higher values give the process a smaller share of the CPU when the system is busy.",
+                                        "title": "Nice"
+                                    },
+                                    "cpu_affinity": {
+                                        "anyOf": [
+                                            {
+                                                "items": {
+                                                    "type": "integer"
+                                                },
+                                                "minItems": 1,
+                                                "type": "array"
+                                            },
+                                            {
+                                                "type": "null"
+                                            }
+                                        ],
+                                        "default": null,
+                                        "description": "The CPU cores the process is allowed to run on.",
+                                        "examples": [
+                                            [
+                                                0
+                                            ],
+                                            [
+                                                2,
+                                                3
+                                            ]
+                                        ],
+                                        "title": "Cpu Affinity"
+                                    }
+                                },
+                                "title": "_ResourceLimitsConfig",
+                                "type": "object"
+                            },
+                            "default": {},
+                            "description": "The resource limits of each procedure and backend by its name, e.g. `dummy-procedure` or `tenta-backend`. Processes without an entry have no limits.",
+                            "examples": [
+                                {
+                                    "dummy-procedure": {
+                                        "max_rss_mb": 500,
+                                        "nice": 10
+                                    }
+                                }
+                            ],
+                            "title": "Limits",
+                            "type": "object"
+                        }
+                    },
+                    "title": "_ResourceAccountingConfig",
+                    "type": "object"
+                },
+                {
+                    "type": "null"
+                }
+            ],
+            "default": null,
+            "description": "If this is set, the main loop samples the CPU, memory, file descriptor and thread usage of each procedure and backend with `psutil`, sends it as data messages and enforces the configured limits. If this is not set, the resource usage is not monitored."
+        },
+        "heartbeats": {
+            "anyOf": [
+                {
+                    "properties": {
+                        "timeouts": {
+                            "additionalProperties": {
+                                "type": "integer"
+                            },
+                            "default": {},
+                            "description": "The maximum number of seconds between two heartbeats (`src.utils.Heartbeat.beat`) of each procedure and backend by its name, e.g. `dummy-procedure`. A process that exceeds it is considered to be stalled and is killed and restarted. The timeout has to be longer than the longest regular loop iteration, including sleeps. Processes without an entry are not checked.",
+                            "examples": [
+                                {
+                                    "dummy-procedure": 300,
+                                    "system-checks": 300
+                                }
+                            ],
+                            "title": "Timeouts",
+                            "type": "object"
+                        }
+                    },
+                    "title": "_HeartbeatConfig",
+                    "type": "object"
+                },
+                {
+                    "type": "null"
+                }
+            ],
+            "default": null,
+            "description": "If this is set, the main loop kills and restarts procedures and backends that have not sent a heartbeat for longer than their timeout. If this is not set, only processes that have died are restarted."
+        },
         "dummy_procedure": {
             "properties": {
                 "seconds_between_datapoints": {
@@ -26,7 +26,7 @@ def run(
     assert config.backend is not None
     assert config.backend.provider == "tenta"
     logger = src.utils.Logger(config=config, origin=name)
-    messaging_agent = src.utils.MessagingAgent()
+    messaging_agent = src.utils.MessagingAgent.get_shared(config=config)
 
     # parse incoming config messages
 
@@ -116,7 +116,12 @@ def run(
             f"The Tenta backend did not finish one loop within {MAX_LOOP_TIME} seconds",
         )
 
+        # messages are claimed for longer than one loop takes at most, so
+        # they are only sent again if this process dies while sending them
+        MESSAGE_LEASE_DURATION = MAX_LOOP_TIME + 60
+
         while True:
+            src.utils.Heartbeat.beat()
             signal.alarm(MAX_LOOP_TIME)
             try:
                 if teardown_receipt_time is None:
@@ -142,9 +147,8 @@ def run(
                 # send new messages
                 open_message_slots = config.backend.max_parallel_messages - len(active_messages)
                 if open_message_slots > 0:
-                    new_messages = messaging_agent.get_n_latest_messages(
-                        open_message_slots,
-                        excluded_message_ids={m[1].identifier for m in active_messages},
+                    new_messages = messaging_agent.claim_prioritized_messages(
+                        open_message_slots, lease_duration=MESSAGE_LEASE_DURATION
                     )
                     for message in new_messages:
                         mqtt_message_id: Optional[int] = None
@@ -157,6 +161,7 @@ def run(
                                 tenta.types.MeasurementMessage(
                                     value=numeric_data_only,
                                     revision=config.general.config_revision,
+                                    timestamp=message.timestamp,
                                 )
                             )
                         if message.message_body.variant == "log":
@@ -175,6 +180,7 @@ def run(
                                         + message.message_body.body
                                     ),
                                     revision=config.general.config_revision,
+                                    timestamp=message.timestamp,
                                 )
                             )
                         if message.message_body.variant == "config":
@@ -183,6 +189,7 @@ def run(
                                     tenta.types.AcknowledgmentMessage(
                                         revision=message.message_body.config.general.config_revision,
                                         success=(message.message_body.status == "accepted"),
+                                        timestamp=message.timestamp,
                                     )
                                 )
                             # received and startup not implemented in Tenta yet
@@ -206,6 +213,12 @@ def run(
                     )
                 )
 
+                # keep the messages that are still being sent claimed
+                messaging_agent.renew_message_leases(
+                    {m[1].identifier for m in active_messages},
+                    lease_duration=MESSAGE_LEASE_DURATION,
+                )
+
                 # exit the procedure if teardown has been issued and all messages have been sent
                 if (teardown_receipt_time is not None) and (len(active_messages) == 0):
                     logger.debug("Send out all messages, exiting the procedure")
@@ -236,6 +249,7 @@ def run(
                 tum_esm_utils.timing.set_alarm(
                     20, "Could not reconnect to Tenta backend within 20 seconds"
                 )
+                messaging_agent.release_messages({m[1].identifier for m in active_messages})
                 tenta_client, active_messages = connect()
                 tum_esm_utils.timing.clear_alarm()
 
@@ -28,7 +28,7 @@ def run(
     assert config.backend is not None
     assert config.backend.provider == "thingsboard"
     logger = src.utils.Logger(config=config, origin=name)
-    messaging_agent = src.utils.MessagingAgent()
+    messaging_agent = src.utils.MessagingAgent.get_shared(config=config)
 
     # parse incoming config messages
 
@@ -142,6 +142,10 @@ def run(
             f"The ThingsBoard backend did not finish one loop within {MAX_LOOP_TIME} seconds",
         )
 
+        # messages are claimed for longer than one loop takes at most, so
+        # they are only sent again if this process dies while sending them
+        MESSAGE_LEASE_DURATION = MAX_LOOP_TIME + 60
+
         def send_data(
             timestamp: float,
             data: dict[str, Any],
@@ -153,6 +157,7 @@ def run(
             )
 
         while True:
+            src.utils.Heartbeat.beat()
             signal.alarm(MAX_LOOP_TIME)
             try:
                 if teardown_receipt_time is None:
@@ -176,9 +181,8 @@ def run(
                 # send new messages
                 open_message_slots = config.backend.max_parallel_messages - len(active_messages)
                 if open_message_slots > 0:
-                    new_messages = messaging_agent.get_n_latest_messages(
-                        open_message_slots,
-                        excluded_message_ids={m[1].identifier for m in active_messages},
+                    new_messages = messaging_agent.claim_prioritized_messages(
+                        open_message_slots, lease_duration=MESSAGE_LEASE_DURATION
                     )
                     for message in new_messages:
                         message_info: Optional[paho.mqtt.client.MQTTMessageInfo] = None
@@ -225,6 +229,12 @@ def run(
                     )
                 )
 
+                # keep the messages that are still being sent claimed
+                messaging_agent.renew_message_leases(
+                    {m[1].identifier for m in active_messages},
+                    lease_duration=MESSAGE_LEASE_DURATION,
+                )
+
                 # exit the procedure if teardown has been issued and all messages have been sent
                 if (teardown_receipt_time is not None) and (len(active_messages) == 0):
                     logger.debug("Send out all messages, exiting the procedure")
@@ -255,6 +265,7 @@ def run(
                 tum_esm_utils.timing.set_alarm(
                     20, "Could not reconnect to ThingsBoard backend within 20 seconds"
                 )
+                messaging_agent.release_messages({m[1].identifier for m in active_messages})
                 thingsboard_client, active_messages = connect()
                 tum_esm_utils.timing.clear_alarm()
 
@@ -39,3 +39,13 @@ SECONDS_PER_GRACEFUL_PROCEDURE_TEARDOWN: Annotated[
     int,
     "Number of seconds to wait for a procedure process to tear down gracefully before killing it",
 ] = 30
+
+SECONDS_PER_PROCEDURE_RESTART_BACKOFF: Annotated[
+    list[int],
+    "How many seconds to wait before restarting a procedure after its 1st, 2nd, ... consecutive crash. The last value is used for all further crashes.",
+] = [0, 5, 30, 120, 300]
+
+SECONDS_UNTIL_PROCEDURE_IS_STABLE: Annotated[
+    int,
+    "If a procedure crashes after running for at least this many seconds, its restart backoff starts from the beginning again",
+] = 60
@@ -2,7 +2,6 @@ import sys
 from typing import Any
 import os
 import signal
-import time
 import atexit
 
 import tum_esm_utils
@@ -18,14 +17,15 @@ def run() -> None:
     4. Initialize the updater
     5. Remove old virtual environments
     6. Initialize the lifecycle managers
-    7. Establish graceful shutdown logic (run teardown for every lifecycle manager)
+    7. Establish graceful shutdown logic (tear down all lifecycle managers concurrently)
     8. Start the main loop
 
     Inside the mainloop the following steps are performed until termination:
 
     1. Start each procedure/backend if it is not running
-    2. Check the status of each procedure/backend
-    3. Perform any pending updates
+    2. Perform any pending updates
+    3. Wait until a procedure/backend dies or 10 seconds have passed (see
+       `src.utils.Supervisor`)
 
     If an exception is raised in the main loop, it is logged and the main loop
     sleeps for an exponentially increasing amount of time before it tries to
@@ -33,14 +33,16 @@ def run() -> None:
 
     config = src.types.Config.load()
     logger = src.utils.Logger(config=config, origin="main")
-    messaging_agent = src.utils.MessagingAgent()
+    messaging_agent = src.utils.MessagingAgent.get_shared(config=config)
     updater = src.utils.Updater(config=config)
+    if config.state_history is not None:
+        src.utils.StateInterface.enable_history(config.state_history.fields)
 
     # log that automation is starting up
 
     logger.info(
         f"Starting automation with PID {os.getpid()}",
-        details=f"config = {config.model_dump_json(indent=4)}",
+        details=lambda: f"config = {config.model_dump_json(indent=4)}",
     )
     messaging_agent.add_message(
         src.types.ConfigMessageBody(status="startup", config=config.to_foreign_config())
@@ -96,11 +98,11 @@ def run() -> None:
 
     # establish graceful shutdown logic
 
+    supervisor = src.utils.Supervisor(lifecycle_managers)
+
     def teardown_handler(*args: Any) -> None:
         logger.debug("Starting teardown of the main loop")
-        for lm in lifecycle_managers:
-            if lm.procedure_is_running():
-                lm.teardown()
+        supervisor.teardown()
         logger.debug("Finished teardown of the main loop")
         atexit.unregister(teardown_handler)
         sys.exit(0)
@@ -115,10 +117,7 @@ def run() -> None:
     )
     while True:
         try:
-            for lm in lifecycle_managers:
-                if not lm.procedure_is_running():
-                    lm.start_procedure()
-                lm.check_procedure_status()
+            supervisor.start_procedures()
 
             pending_configs = src.utils.StateInterface.load().pending_configs
             for pending_config in pending_configs:
@@ -127,7 +126,7 @@ def run() -> None:
                 state.pending_configs = state.pending_configs[len(pending_configs) :]
 
             exponential_backoff.reset()
-            time.sleep(10)
+            supervisor.wait(timeout=10)
         except Exception as e:
             logger.exception(e, label="Exception in main loop")
             exponential_backoff.sleep()
@@ -21,7 +21,7 @@ def run(config: src.types.Config, name: str) -> None:
     """
 
     logger = src.utils.Logger(config=config, origin=name)
-    messaging_agent = src.utils.MessagingAgent()
+    messaging_agent = src.utils.MessagingAgent.get_shared(config=config)
     random.seed(time.time())
     current_positions: tuple[int, int] = (0, 0)
 
@@ -38,6 +38,7 @@ def run(config: src.types.Config, name: str) -> None:
 
     exponential_backoff = tum_esm_utils.timing.ExponentialBackoff(log_info=logger.info)
     while True:
+        src.utils.Heartbeat.beat()
         try:
             t = src.utils.functions.get_time_to_next_datapoint(
                 seconds_between_datapoints=config.dummy_procedure.seconds_between_datapoints,
@@ -45,9 +46,9 @@ def run(config: src.types.Config, name: str) -> None:
             logger.debug(f"Sleeping for {t:.2f} seconds")
             time.sleep(t)
 
-            state = src.utils.StateInterface.load()
+            last_5_min_load = src.utils.StateInterface.get("system.last_5_min_load")
             assert (
-                state.system.last_5_min_load or 0
+                last_5_min_load or 0
             ) < 75, "can't perform this procedure while system load is above 75%"
 
             # do a random walk
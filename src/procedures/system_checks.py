@@ -10,7 +10,9 @@ import src
 
 
 def run(config: src.types.Config, name: str) -> None:
-    """Logs the system load and last boot time.
+    """Logs the system load and last boot time, keeps the active message
+    queue within the limits configured in `config.backend`, and rotates
+    the message and log archives if `config.archive_rotation` is set.
 
     Args:
         config: The configuration object.
@@ -18,7 +20,9 @@ def run(config: src.types.Config, name: str) -> None:
     """
 
     logger = src.utils.Logger(config=config, origin=name)
-    messaging_agent = src.utils.MessagingAgent()
+    messaging_agent = src.utils.MessagingAgent.get_shared(config=config)
+    if config.state_history is not None:
+        src.utils.StateInterface.enable_history(config.state_history.fields)
 
     # register a teardown procedure
 
@@ -32,6 +36,7 @@ def run(config: src.types.Config, name: str) -> None:
 
     exponential_backoff = tum_esm_utils.timing.ExponentialBackoff(log_info=logger.info)
     while True:
+        src.utils.Heartbeat.beat()
         try:
             t = src.utils.functions.get_time_to_next_datapoint(
                 seconds_between_datapoints=config.system_checks.seconds_between_checks
@@ -68,12 +73,65 @@ def run(config: src.types.Config, name: str) -> None:
                 state.system.last_boot_time = last_boot_time
                 state.system.last_5_min_load = load_last_5_min
 
+            # keep the active message queue within its configured limits
+            if config.backend is not None:
+                dropped_messages = messaging_agent.enforce_queue_limits(
+                    max_messages=config.backend.max_queued_messages,
+                    max_bytes=config.backend.max_queued_bytes,
+                    policy=config.backend.queue_overflow_policy,
+                )
+                if len(dropped_messages) > 0:
+                    logger.warning(
+                        f"Dropped {sum(dropped_messages.values())} messages from the active "
+                        + "message queue because it exceeded its size limits",
+                        details=f"dropped messages per category: {dropped_messages}",
+                    )
+            # compress the archives of completed days and delete old ones
+            if config.archive_rotation is not None:
+                for directory, extension, lock_path in [
+                    (
+                        src.utils.messaging_agent.MESSAGE_ARCHIVE_DIR,
+                        ".csv",
+                        src.utils.messaging_agent.MESSAGE_ARCHIVE_DIR_LOCK,
+                    ),
+                    (src.utils.logger.LOGS_ARCHIVE_DIR, ".log", src.utils.logger.FILELOCK_PATH),
+                    (src.utils.logger.LOGS_ARCHIVE_DIR, ".jsonl", src.utils.logger.FILELOCK_PATH),
+                ]:
+                    compressed_files, deleted_files = src.utils.ArchiveRotation.rotate(
+                        directory,
+                        extension,
+                        compression=config.archive_rotation.compression,
+                        retention_days=config.archive_rotation.retention_days,
+                        retention_bytes=config.archive_rotation.retention_bytes,
+                        lock_path=lock_path,
+                    )
+                    if len(compressed_files) > 0:
+                        logger.info(f"Compressed archive files: {compressed_files}")
+                    if len(deleted_files) > 0:
+                        logger.info(f"Deleted archive files: {deleted_files}")
+                deleted_directories = src.utils.ArchiveRotation.prune_day_directories(
+                    src.utils.columnar_archive.COLUMNAR_ARCHIVE_DIR,
+                    retention_days=config.archive_rotation.retention_days,
+                    retention_bytes=config.archive_rotation.retention_bytes,
+                )
+                if len(deleted_directories) > 0:
+                    logger.info(f"Deleted columnar archive days: {deleted_directories}")
+
+            queue_statistics = messaging_agent.get_queue_statistics()
+            logger.debug(
+                f"Active message queue contains {queue_statistics.message_count} messages "
+                + f"({queue_statistics.message_bytes} bytes)"
+            )
+
             # send out system data
             messaging_agent.add_message(
                 src.types.DataMessageBody(
                     data={
                         "last_boot_time": last_boot_time.timestamp(),
                         "last_5_min_load": load_last_5_min,
+                        "message_queue_size": queue_statistics.message_count,
+                        "message_queue_bytes": queue_statistics.message_bytes,
+                        "message_queue_dropped": sum(queue_statistics.dropped_messages.values()),
                     }
                 )
             )
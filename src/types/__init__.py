@@ -8,5 +8,10 @@ from .messages import (
     ConfigMessageBody,
     MessageQueueItem,
     MessageArchiveItem,
+    MessageQueueStatistics,
+    MessageArchiveIndexBlock,
+    MessageArchiveIndex,
 )
-from .state import State
+from .logs import LogArchiveItem, LogArchiveIndexBlock, LogArchiveIndex
+from .state import State, StateHistoryStatistics
+from .procedures import HeartbeatStatistics
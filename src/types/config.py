@@ -53,6 +53,16 @@ class _LoggingVerbosityConfig(pydantic.BaseModel):
     message_sending: Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION", None] = (
         pydantic.Field(default=..., description="The minimum log level for the message sending")
     )
+    structured_archive: Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION", None] = (
+        pydantic.Field(
+            default=None,
+            description="The minimum log level for the structured archive in `data/logs/YYYY-MM-DD.jsonl` with one JSON object per record. It can be searched with `cli.py logs`.",
+        )
+    )
+    ring_buffer: Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION", None] = pydantic.Field(
+        default=None,
+        description="The minimum log level for the in-memory ring buffer of the last records of each origin in `data/log-buffers/`. The buffers can be read with `cli.py recent-logs` and the records of a procedure that died unexpectedly are attached to the error message of its lifecycle manager.",
+    )
 
 
 class UpdaterConfig(pydantic.BaseModel):
@@ -130,6 +140,157 @@ class BackendConfig(pydantic.BaseModel):
         le=7200,
         description="When the mainloop wants to shut down (after a config change, or an update), how many seconds should the backend be allowed to continue sending out unsent messages.",
     )
+    max_queued_messages: Optional[int] = pydantic.Field(
+        None,
+        ge=1,
+        description="The maximum number of messages in the active message queue. When the queue grows beyond this (e.g. during a long network outage), messages are dropped from the queue according to `queue_overflow_policy`. Dropped messages remain in the local message archive. If this is not set, the number of messages is not limited.",
+    )
+    max_queued_bytes: Optional[int] = pydantic.Field(
+        None,
+        ge=1,
+        description="The maximum total size of all messages in the active message queue in bytes. If this is not set, the size is not limited.",
+    )
+    queue_overflow_policy: Literal["drop_oldest", "drop_by_category", "downsample_data"] = (
+        pydantic.Field(
+            "drop_oldest",
+            description='Which messages to drop when the active message queue exceeds its limits. "drop_oldest" drops the oldest messages first. "drop_by_category" drops the least important messages first (DEBUG logs, then INFO/WARNING logs, then data, then ERROR/EXCEPTION logs, then config messages). "downsample_data" removes every second message of the oldest data messages.',
+        )
+    )
+
+
+class _AsyncLoggingConfig(pydantic.BaseModel):
+    max_queue_size: int = pydantic.Field(
+        10_000,
+        ge=1,
+        le=1_000_000,
+        description="How many log records can wait in memory to be written by the background writer thread",
+    )
+    overflow_policy: Literal["block", "drop_new", "drop_debug"] = pydantic.Field(
+        "block",
+        description="What to do when the log queue is full. `block` waits until the writer has made space. `drop_new` discards the new record. `drop_debug` discards new DEBUG and INFO records and waits for space for all other levels. The number of discarded records is logged as a warning.",
+    )
+
+
+class _LogSuppressionConfig(pydantic.BaseModel):
+    deduplication_window: Optional[float] = pydantic.Field(
+        60,
+        gt=0,
+        le=86400,
+        description="Log records with the same origin, level and subject that follow each other within this many seconds are collapsed: only the first one is written, and once the window has passed, one record with the number of repetitions is written. If this is `null`, records are not deduplicated.",
+    )
+    message_rate_limit: Optional[float] = pydantic.Field(
+        30,
+        gt=0,
+        le=60_000,
+        description="How many log messages per minute each origin can send to the backend on average (token bucket). Records above this limit are still written to the console and the file archive. If this is `null`, log messages are not rate limited.",
+    )
+    message_burst: int = pydantic.Field(
+        10,
+        ge=1,
+        le=10_000,
+        description="How many log messages each origin can send to the backend at once before the rate limit applies",
+    )
+
+
+class _MessageArchiveConfig(pydantic.BaseModel):
+    columnar: bool = pydantic.Field(
+        False,
+        description="Whether to additionally store the numeric values of data messages in the columnar message archive in `data/messages-columnar/`. This is much faster to query for single data keys over long time ranges than the CSV message archive.",
+    )
+    flush_interval: float = pydantic.Field(
+        0,
+        ge=0,
+        le=300,
+        description="How many seconds lines may be buffered in memory before they are written to the CSV message archive. Buffered lines are written by a timer after this interval and when the process exits. With `0`, every message is written right away. If a process is killed, at most the messages of this interval are missing in the archive, but they are still sent by the backend.",
+    )
+    fsync: bool = pydantic.Field(
+        False,
+        description="Whether to wait until the written lines of the CSV message archive have been written to the disk (`fsync`). This prevents losing the latest lines on a power loss but slows down writing messages.",
+    )
+
+
+class _MessageQueueConfig(pydantic.BaseModel):
+    synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = pydantic.Field(
+        "NORMAL",
+        description="The SQLite `synchronous` level of the active message queue. `NORMAL` survives crashes of the software but the last messages might be lost on a power loss. `FULL` and `EXTRA` prevent this at the cost of one `fsync` per write. `OFF` is the fastest but the queue can be corrupted by a power loss.",
+    )
+
+
+class _ArchiveRotationConfig(pydantic.BaseModel):
+    compression: Optional[Literal["gzip", "xz", "zstd"]] = pydantic.Field(
+        "gzip",
+        description="How to compress the message and log archive files of completed days. `zstd` requires the optional dependency `zstandard`. If this is `null`, the files are not compressed.",
+    )
+    retention_days: Optional[int] = pydantic.Field(
+        None,
+        ge=1,
+        description="Delete archive files (including the days of the columnar message archive) that are older than this many days. If this is `null`, files are not deleted because of their age.",
+    )
+    retention_bytes: Optional[int] = pydantic.Field(
+        None,
+        ge=1,
+        description="Delete the oldest archive files until the message archive, the columnar message archive and the log archive each take up less than this many bytes. The files of the current day are never deleted. If this is `null`, files are not deleted because of their size.",
+    )
+
+
+class _StateHistoryConfig(pydantic.BaseModel):
+    fields: list[str] = pydantic.Field(
+        ["system.last_5_min_load"],
+        description="The paths of the numeric state fields whose values are recorded, e.g. `system.last_5_min_load`.",
+        examples=[["system.last_5_min_load"]],
+    )
+
+
+class _ResourceLimitsConfig(pydantic.BaseModel):
+    soft_max_rss_mb: Optional[float] = pydantic.Field(
+        None,
+        gt=0,
+        description="If the resident memory of the process exceeds this many megabytes, a warning is logged.",
+    )
+    max_rss_mb: Optional[float] = pydantic.Field(
+        None,
+        gt=0,
+        description="If the resident memory of the process exceeds this many megabytes, the process is killed and restarted (subject to the restart backoff).",
+    )
+    max_open_files: Optional[int] = pydantic.Field(
+        None,
+        ge=16,
+        description="The maximum number of open file descriptors of the process. This is set as the `RLIMIT_NOFILE` of the process, so opening more files fails.",
+    )
+    nice: Optional[int] = pydantic.Field(
+        None,
+        ge=0,
+        le=19,
+        description="The niceness of the process. Higher values give the process a smaller share of the CPU when the system is busy.",
+    )
+    cpu_affinity: Optional[list[int]] = pydantic.Field(
+        None,
+        min_length=1,
+        description="The CPU cores the process is allowed to run on.",
+        examples=[[0], [2, 3]],
+    )
+
+
+class _ResourceAccountingConfig(pydantic.BaseModel):
+    seconds_between_samples: int = pydantic.Field(
+        60,
+        ge=1,
+        le=7200,
+        description="How many seconds should be between two samples of the resource usage of each procedure and backend",
+    )
+    limits: dict[str, _ResourceLimitsConfig] = pydantic.Field(
+        {},
+        description="The resource limits of each procedure and backend by its name, e.g. `dummy-procedure` or `tenta-backend`. Processes without an entry have no limits.",
+        examples=[{"dummy-procedure": {"max_rss_mb": 500, "nice": 10}}],
+    )
+
+
+class _HeartbeatConfig(pydantic.BaseModel):
+    timeouts: dict[str, int] = pydantic.Field(
+        {},
+        description="The maximum number of seconds between two heartbeats (`src.utils.Heartbeat.beat`) of each procedure and backend by its name, e.g. `dummy-procedure`. A process that exceeds it is considered to be stalled and is killed and restarted. The timeout has to be longer than the longest regular loop iteration, including sleeps. Processes without an entry are not checked.",
+        examples=[{"dummy-procedure": 300, "system-checks": 300}],
+    )
 
 
 class _DummyProcedureConfig(pydantic.BaseModel):
@@ -158,6 +319,14 @@ class Config(pydantic.BaseModel):
     model_config = pydantic.ConfigDict(extra="forbid")
     general: _GeneralConfig = pydantic.Field(...)
     logging_verbosity: _LoggingVerbosityConfig = pydantic.Field(...)
+    log_suppression: Optional[_LogSuppressionConfig] = pydantic.Field(
+        default=None,
+        description="If this is set, repeated log records are collapsed and the log messages sent to the backend are rate limited, so that a procedure failing in a tight loop cannot flood the message queue.",
+    )
+    async_logging: Optional[_AsyncLoggingConfig] = pydantic.Field(
+        default=None,
+        description="If this is set, log records are written to the console, the file archive and the message queue by a background thread, so logging never blocks the calling procedure. If this is not set, log records are written on the calling thread.",
+    )
     updater: Optional[UpdaterConfig] = pydantic.Field(
         default=None,
         description="If this is not set, the updater will not be used.",
@@ -166,6 +335,30 @@ class Config(pydantic.BaseModel):
         default=None,
         description="If this is not set, the backend will not be used.",
     )
+    message_archive: _MessageArchiveConfig = pydantic.Field(
+        default_factory=_MessageArchiveConfig,
+        description="Settings for the local message archive.",
+    )
+    message_queue: _MessageQueueConfig = pydantic.Field(
+        default_factory=_MessageQueueConfig,
+        description="Settings for the active message queue.",
+    )
+    archive_rotation: Optional[_ArchiveRotationConfig] = pydantic.Field(
+        default=None,
+        description="If this is set, the system checks procedure compresses the message and log archive files of completed days and deletes old files. If this is not set, the archives are kept as plain text forever.",
+    )
+    state_history: Optional[_StateHistoryConfig] = pydantic.Field(
+        default=None,
+        description="If this is set, every update of the selected numeric state fields is recorded in `data/state-history/`, together with per-minute and per-hour aggregates. The history can be queried with `StateInterface.get_history` and `StateInterface.get_history_statistics`.",
+    )
+    resource_accounting: Optional[_ResourceAccountingConfig] = pydantic.Field(
+        default=None,
+        description="If this is set, the main loop samples the CPU, memory, file descriptor and thread usage of each procedure and backend with `psutil`, sends it as data messages and enforces the configured limits. If this is not set, the resource usage is not monitored.",
+    )
+    heartbeats: Optional[_HeartbeatConfig] = pydantic.Field(
+        default=None,
+        description="If this is set, the main loop kills and restarts procedures and backends that have not sent a heartbeat for longer than their timeout. If this is not set, only processes that have died are restarted.",
+    )
     dummy_procedure: _DummyProcedureConfig = pydantic.Field(
         default=...,
         description="Settings for the dummy procedure.",
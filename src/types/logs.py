@@ -0,0 +1,64 @@
+from typing import Literal
+import pydantic
+
+
+class LogArchiveItem(pydantic.BaseModel):
+    """One record of the structured log archive `data/logs/YYYY-MM-DD.jsonl`."""
+
+    timestamp: float = pydantic.Field(
+        ...,
+        description="Unix timestamp on the system when this record was created",
+    )
+    origin: str = pydantic.Field(..., description="The origin of the record, e.g. a procedure")
+    level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"]
+    subject: str = pydantic.Field(..., description="The subject of the record")
+    details: dict[str, str] = pydantic.Field(
+        default={},
+        description="The detail blocks of the record, e.g. `details` or `traceback`",
+    )
+
+
+class LogArchiveIndexBlock(pydantic.BaseModel):
+    offset: int = pydantic.Field(
+        ...,
+        description="The byte offset of the first line of this block in the uncompressed archive file",
+    )
+    length: int = pydantic.Field(..., description="The number of bytes of this block")
+    rows: int = pydantic.Field(..., description="The number of records in this block")
+    min_timestamp: float = pydantic.Field(
+        ..., description="The smallest timestamp of the records in this block"
+    )
+    max_timestamp: float = pydantic.Field(
+        ..., description="The largest timestamp of the records in this block"
+    )
+    levels: dict[str, int] = pydantic.Field(
+        ..., description="The number of records per log level in this block"
+    )
+    origins: list[str] = pydantic.Field(
+        ..., description="The sorted origins of all records in this block"
+    )
+
+
+class LogArchiveIndex(pydantic.BaseModel):
+    block_size: int = pydantic.Field(..., description="The maximum number of records per block")
+    indexed_bytes: int = pydantic.Field(
+        ...,
+        description="Up to which byte offset the uncompressed archive file has been indexed",
+    )
+    source_file: str = pydantic.Field(
+        ...,
+        description="The name of the plain or compressed archive file that has been indexed. "
+        + "If another file stores the content of the day now, the index is rebuilt",
+    )
+    source_inode: int = pydantic.Field(
+        ...,
+        description="The inode of the indexed archive file. If the file has been replaced, "
+        + "e.g. by the `ArchiveRotation`, the index is rebuilt",
+    )
+    source_size: int = pydantic.Field(
+        ...,
+        description="The size of the plain or compressed archive file when it was indexed. "
+        + "If the file has grown, the index is extended starting at `indexed_bytes`, if it "
+        + "has shrunk, the index is rebuilt",
+    )
+    blocks: list[LogArchiveIndexBlock] = pydantic.Field(..., description="The indexed blocks")
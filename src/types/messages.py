@@ -83,3 +83,65 @@ class MessageQueueItem(MessageArchiveItem):
 
     def __hash__(self) -> int:
         return self.identifier
+
+
+class MessageQueueStatistics(pydantic.BaseModel):
+    message_count: int = pydantic.Field(
+        ...,
+        description="The number of messages in the active message queue",
+    )
+    message_bytes: int = pydantic.Field(
+        ...,
+        description="The total size of all message bodies in the active message queue",
+    )
+    dropped_messages: dict[str, int] = pydantic.Field(
+        ...,
+        description="The number of messages per category that have been dropped from the "
+        + "active message queue because it exceeded its size limits",
+    )
+
+
+class MessageArchiveIndexBlock(pydantic.BaseModel):
+    offset: int = pydantic.Field(
+        ...,
+        description="The byte offset of the first line of this block in the uncompressed archive file",
+    )
+    length: int = pydantic.Field(..., description="The number of bytes of this block")
+    rows: int = pydantic.Field(..., description="The number of messages in this block")
+    min_timestamp: float = pydantic.Field(
+        ..., description="The smallest timestamp of the messages in this block"
+    )
+    max_timestamp: float = pydantic.Field(
+        ..., description="The largest timestamp of the messages in this block"
+    )
+    variants: dict[str, int] = pydantic.Field(
+        ..., description="The number of messages per message variant in this block"
+    )
+    data_keys: list[str] = pydantic.Field(
+        ..., description="The sorted keys of all data messages in this block"
+    )
+
+
+class MessageArchiveIndex(pydantic.BaseModel):
+    block_size: int = pydantic.Field(..., description="The maximum number of messages per block")
+    indexed_bytes: int = pydantic.Field(
+        ...,
+        description="Up to which byte offset the uncompressed archive file has been indexed",
+    )
+    source_file: str = pydantic.Field(
+        ...,
+        description="The name of the plain or compressed archive file that has been indexed. "
+        + "If another file stores the content of the day now, the index is rebuilt",
+    )
+    source_inode: int = pydantic.Field(
+        ...,
+        description="The inode of the indexed archive file. If the file has been replaced, "
+        + "e.g. by the `ArchiveRotation`, the index is rebuilt",
+    )
+    source_size: int = pydantic.Field(
+        ...,
+        description="The size of the plain or compressed archive file when it was indexed. "
+        + "If the file has grown, the index is extended starting at `indexed_bytes`, if it "
+        + "has shrunk, the index is rebuilt",
+    )
+    blocks: list[MessageArchiveIndexBlock] = pydantic.Field(..., description="The indexed blocks")
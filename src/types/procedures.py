@@ -0,0 +1,27 @@
+from typing import Optional
+import pydantic
+
+
+class HeartbeatStatistics(pydantic.BaseModel):
+    """Statistics of the loop iterations of a procedure or backend since
+    its start, measured as the time between two heartbeats."""
+
+    iteration_count: int = pydantic.Field(
+        ..., description="The number of completed loop iterations"
+    )
+    mean_seconds: Optional[float] = pydantic.Field(
+        ...,
+        description="The mean duration of a loop iteration. `None` if no iteration has completed.",
+    )
+    max_seconds: Optional[float] = pydantic.Field(
+        ...,
+        description="The longest duration of a loop iteration. `None` if no iteration has completed.",
+    )
+    last_seconds: Optional[float] = pydantic.Field(
+        ...,
+        description="The duration of the last loop iteration. `None` if no iteration has completed.",
+    )
+    seconds_since_last_heartbeat: float = pydantic.Field(
+        ...,
+        description="The number of seconds since the last heartbeat or since the start of the process if it has not sent a heartbeat yet",
+    )
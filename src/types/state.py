@@ -32,3 +32,16 @@ class State(pydantic.BaseModel):
     )
 
     # store all variables that need to be accessed by more than one procedure
+
+
+class StateHistoryStatistics(pydantic.BaseModel):
+    """Statistics of the recorded values of a state field in a time range."""
+
+    count: int = pydantic.Field(..., description="The number of recorded values")
+    mean: float = pydantic.Field(..., description="The mean of the recorded values")
+    min: float = pydantic.Field(..., description="The smallest recorded value")
+    max: float = pydantic.Field(..., description="The largest recorded value")
+    resolution: Optional[int] = pydantic.Field(
+        ...,
+        description="The bucket size in seconds of the tier the statistics have been computed from. `None` means that the individual values have been used, otherwise the time range has been rounded to whole buckets.",
+    )
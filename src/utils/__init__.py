@@ -4,12 +4,32 @@ Some of the functions have been used from https://github.com/tum-esm/utils
 but this library has not been added as a dependency to reduce the number of
 third party libaries this software depends on."""
 
-from . import functions, messaging_agent, logger, updater
+from . import (
+    functions,
+    archive_rotation,
+    archive_writer,
+    columnar_archive,
+    log_ring_buffer,
+    heartbeat,
+    state_history,
+    state_store,
+    messaging_agent,
+    logger,
+    updater,
+)
 
 # direct import for less verbose access
 from .logger import Logger
+from .log_ring_buffer import LogRingBuffer
 from .updater import Updater
 from .messaging_agent import MessagingAgent
+from .columnar_archive import ColumnarMessageArchive
+from .archive_rotation import ArchiveRotation
+from .archive_index import MessageArchiveIndexer, LogArchiveIndexer
+from .heartbeat import Heartbeat
 from .lifecycle_manager import LifecycleManager
+from .supervisor import Supervisor
 from .state_interface import StateInterface
+from .state_history import StateHistory
+from .state_store import StateStore
 from .mainloop_toggle import MainloopToggle
@@ -0,0 +1,384 @@
+from typing import Annotated, Callable, Generator, Optional, TypeVar
+import json
+import os
+import pydantic
+import src
+from .archive_rotation import ARCHIVE_INDEX_SUFFIX, get_archive_file_path, open_binary_archive_file
+
+ARCHIVE_INDEX_BLOCK_SIZE: Annotated[
+    int,
+    "How many messages or log records are grouped into one block of an archive index",
+] = 1000
+
+_IndexType = TypeVar("_IndexType", src.types.MessageArchiveIndex, src.types.LogArchiveIndex)
+
+
+def _get_index(
+    path: str,
+    index_type: type[_IndexType],
+    empty_index: _IndexType,
+    extend_index: Callable[[str, _IndexType], None],
+) -> Optional[_IndexType]:
+    """Load the index sidecar of an archive file, extend it if the archive
+    file has grown since it was last indexed, and store it again. The
+    index is rebuilt if it has been built from another file, e.g. before
+    the file was compressed, or if the file has shrunk."""
+
+    try:
+        source_path = get_archive_file_path(path)
+        source_stat = os.stat(source_path)
+    except FileNotFoundError:
+        return None
+    source_file = os.path.basename(source_path)
+
+    index_path = path + ARCHIVE_INDEX_SUFFIX
+    index: Optional[_IndexType] = None
+    try:
+        with open(index_path, "r") as f:
+            index = index_type.model_validate_json(f.read())
+    except (FileNotFoundError, pydantic.ValidationError):
+        pass
+    if (index is not None) and (
+        (index.source_file != source_file)
+        or (index.source_inode != source_stat.st_ino)
+        or (index.source_size > source_stat.st_size)
+    ):
+        index = None
+    if (index is not None) and (index.source_size == source_stat.st_size):
+        return index
+
+    if index is None:
+        index = empty_index
+    extend_index(path, index)
+    index.source_file = source_file
+    index.source_inode = source_stat.st_ino
+    index.source_size = source_stat.st_size
+
+    # the index is only a cache, so failing to store it is not an error
+    try:
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(index.model_dump_json())
+        os.replace(tmp_path, index_path)
+    except OSError:
+        pass
+    return index
+
+
+class MessageArchiveIndexer:
+    """Maintains an index sidecar `YYYY-MM-DD.csv.index.json` next to each
+    file of the message archive. The index splits the file into blocks of
+    `ARCHIVE_INDEX_BLOCK_SIZE` messages and stores the byte offset, the
+    timestamp range, the number of messages per variant and the data keys
+    of each block (see `src.types.MessageArchiveIndex`).
+
+    Queries use the index to only read the blocks that can contain matching
+    messages, and per-day statistics can be read from the index without
+    touching the archive file at all.
+
+    The index is built lazily when it is requested for the first time. When
+    the archive file has grown since then, only the new lines are indexed.
+    Offsets refer to the uncompressed content. The index is rebuilt when
+    another file stores the content of the day, e.g. after the file has
+    been compressed by the `ArchiveRotation`."""
+
+    @staticmethod
+    def get_index(path: str) -> Optional[src.types.MessageArchiveIndex]:
+        """Get the index of a message archive file. Builds or extends the
+        index if the archive file has changed since it was last indexed.
+
+        Args:
+            path:  The path of the uncompressed archive file.
+
+        Returns:
+            The index or `None` if there is no archive file at this path.
+        """
+
+        return _get_index(
+            path,
+            src.types.MessageArchiveIndex,
+            src.types.MessageArchiveIndex(
+                block_size=ARCHIVE_INDEX_BLOCK_SIZE,
+                indexed_bytes=0,
+                source_file="",
+                source_inode=0,
+                source_size=0,
+                blocks=[],
+            ),
+            MessageArchiveIndexer._extend_index,
+        )
+
+    @staticmethod
+    def _extend_index(path: str, index: src.types.MessageArchiveIndex) -> None:
+        """Index all complete lines after `index.indexed_bytes`. The last
+        block is continued if it is not full yet."""
+
+        block: Optional[src.types.MessageArchiveIndexBlock] = None
+        data_keys: set[str] = set()
+        if (len(index.blocks) > 0) and (index.blocks[-1].rows < index.block_size):
+            block = index.blocks[-1]
+            data_keys = set(block.data_keys)
+
+        offset = index.indexed_bytes
+        with open_binary_archive_file(path) as f:
+            f.seek(offset)
+            for line in f:
+                # the last line might still be written by another process
+                if not line.endswith(b"\n"):
+                    break
+                line_offset = offset
+                offset += len(line)
+                line = line.strip(b" \n")
+                if (len(line) == 0) or line.startswith(b"timestamp,"):
+                    if block is not None:
+                        block.length = offset - block.offset
+                    continue
+
+                timestamp_string, message_body_string = line.split(b",", 1)
+                timestamp = float(timestamp_string)
+                message_body = json.loads(message_body_string[1:-1].replace(b'""', b'"'))
+
+                if (block is None) or (block.rows >= index.block_size):
+                    if block is not None:
+                        block.data_keys = sorted(data_keys)
+                    block = src.types.MessageArchiveIndexBlock(
+                        offset=line_offset,
+                        length=0,
+                        rows=0,
+                        min_timestamp=timestamp,
+                        max_timestamp=timestamp,
+                        variants={},
+                        data_keys=[],
+                    )
+                    data_keys = set()
+                    index.blocks.append(block)
+
+                block.length = offset - block.offset
+                block.rows += 1
+                block.min_timestamp = min(block.min_timestamp, timestamp)
+                block.max_timestamp = max(block.max_timestamp, timestamp)
+                variant = message_body["variant"]
+                block.variants[variant] = block.variants.get(variant, 0) + 1
+                if variant == "data":
+                    data_keys.update(message_body["data"].keys())
+
+        if block is not None:
+            block.data_keys = sorted(data_keys)
+        index.indexed_bytes = offset
+
+    @staticmethod
+    def select_blocks(
+        index: src.types.MessageArchiveIndex,
+        start_timestamp: Optional[float] = None,
+        end_timestamp: Optional[float] = None,
+        variants: Optional[list[str]] = None,
+        data_keys: Optional[list[str]] = None,
+    ) -> list[src.types.MessageArchiveIndexBlock]:
+        """Select the blocks of an index that can contain matching messages.
+
+        Args:
+            index:            The index of the archive file.
+            start_timestamp:  The start of the time range (inclusive).
+            end_timestamp:    The end of the time range (exclusive).
+            variants:         Only select blocks that contain messages of these
+                              variants. If this is `None`, all variants match.
+            data_keys:        Only select blocks that contain data messages with
+                              at least one of these keys or messages of other
+                              variants. If this is `None`, all data messages match.
+
+        Returns:
+            The matching blocks in the order of the archive file.
+        """
+
+        selected_blocks: list[src.types.MessageArchiveIndexBlock] = []
+        for block in index.blocks:
+            if (start_timestamp is not None) and (block.max_timestamp < start_timestamp):
+                continue
+            if (end_timestamp is not None) and (block.min_timestamp >= end_timestamp):
+                continue
+            matching_variants = [
+                variant
+                for variant, count in block.variants.items()
+                if (count > 0) and ((variants is None) or (variant in variants))
+            ]
+            if (data_keys is not None) and ("data" in matching_variants):
+                if len(set(block.data_keys).intersection(data_keys)) == 0:
+                    matching_variants.remove("data")
+            if len(matching_variants) > 0:
+                selected_blocks.append(block)
+        return selected_blocks
+
+    @staticmethod
+    def iterate_blocks(
+        path: str,
+        blocks: list[src.types.MessageArchiveIndexBlock],
+    ) -> Generator[tuple[float, str], None, None]:
+        """Read the messages of some blocks of an archive file by seeking
+        directly to their offsets.
+
+        Args:
+            path:    The path of the uncompressed archive file.
+            blocks:  The blocks to read, in the order of the archive file.
+
+        Returns:
+            A generator of `(timestamp, message_body_json_string)` tuples.
+        """
+
+        if len(blocks) == 0:
+            return
+        with open_binary_archive_file(path) as f:
+            for block in blocks:
+                f.seek(block.offset)
+                for line in f.read(block.length).split(b"\n"):
+                    line = line.strip(b" ")
+                    if (len(line) == 0) or line.startswith(b"timestamp,"):
+                        continue
+                    timestamp, message_body = line.split(b",", 1)
+                    yield float(timestamp), message_body[1:-1].replace(b'""', b'"').decode()
+
+
+class LogArchiveIndexer:
+    """Maintains an index sidecar `YYYY-MM-DD.jsonl.index.json` next to each
+    file of the structured log archive, like the `MessageArchiveIndexer` does
+    for the message archive. Each block of the index stores the byte offset,
+    the timestamp range, the number of records per log level and the origins
+    of its records (see `src.types.LogArchiveIndex`)."""
+
+    @staticmethod
+    def get_index(path: str) -> Optional[src.types.LogArchiveIndex]:
+        """Get the index of a structured log archive file. Builds or extends
+        the index if the archive file has changed since it was last indexed.
+
+        Args:
+            path:  The path of the uncompressed archive file.
+
+        Returns:
+            The index or `None` if there is no archive file at this path.
+        """
+
+        return _get_index(
+            path,
+            src.types.LogArchiveIndex,
+            src.types.LogArchiveIndex(
+                block_size=ARCHIVE_INDEX_BLOCK_SIZE,
+                indexed_bytes=0,
+                source_file="",
+                source_inode=0,
+                source_size=0,
+                blocks=[],
+            ),
+            LogArchiveIndexer._extend_index,
+        )
+
+    @staticmethod
+    def _extend_index(path: str, index: src.types.LogArchiveIndex) -> None:
+        """Index all complete lines after `index.indexed_bytes`. The last
+        block is continued if it is not full yet."""
+
+        block: Optional[src.types.LogArchiveIndexBlock] = None
+        origins: set[str] = set()
+        if (len(index.blocks) > 0) and (index.blocks[-1].rows < index.block_size):
+            block = index.blocks[-1]
+            origins = set(block.origins)
+
+        offset = index.indexed_bytes
+        with open_binary_archive_file(path) as f:
+            f.seek(offset)
+            for line in f:
+                # the last line might still be written by another process
+                if not line.endswith(b"\n"):
+                    break
+                line_offset = offset
+                offset += len(line)
+                if len(line.strip()) == 0:
+                    if block is not None:
+                        block.length = offset - block.offset
+                    continue
+                record = json.loads(line)
+
+                if (block is None) or (block.rows >= index.block_size):
+                    if block is not None:
+                        block.origins = sorted(origins)
+                    block = src.types.LogArchiveIndexBlock(
+                        offset=line_offset,
+                        length=0,
+                        rows=0,
+                        min_timestamp=record["timestamp"],
+                        max_timestamp=record["timestamp"],
+                        levels={},
+                        origins=[],
+                    )
+                    origins = set()
+                    index.blocks.append(block)
+
+                block.length = offset - block.offset
+                block.rows += 1
+                block.min_timestamp = min(block.min_timestamp, record["timestamp"])
+                block.max_timestamp = max(block.max_timestamp, record["timestamp"])
+                block.levels[record["level"]] = block.levels.get(record["level"], 0) + 1
+                origins.add(record["origin"])
+
+        if block is not None:
+            block.origins = sorted(origins)
+        index.indexed_bytes = offset
+
+    @staticmethod
+    def select_blocks(
+        index: src.types.LogArchiveIndex,
+        start_timestamp: Optional[float] = None,
+        end_timestamp: Optional[float] = None,
+        levels: Optional[list[str]] = None,
+        origins: Optional[list[str]] = None,
+    ) -> list[src.types.LogArchiveIndexBlock]:
+        """Select the blocks of an index that can contain matching records.
+
+        Args:
+            index:            The index of the archive file.
+            start_timestamp:  The start of the time range (inclusive).
+            end_timestamp:    The end of the time range (exclusive).
+            levels:           Only select blocks that contain records of these
+                              levels. If this is `None`, all levels match.
+            origins:          Only select blocks that contain records of these
+                              origins. If this is `None`, all origins match.
+
+        Returns:
+            The matching blocks in the order of the archive file.
+        """
+
+        selected_blocks: list[src.types.LogArchiveIndexBlock] = []
+        for block in index.blocks:
+            if (start_timestamp is not None) and (block.max_timestamp < start_timestamp):
+                continue
+            if (end_timestamp is not None) and (block.min_timestamp >= end_timestamp):
+                continue
+            if (levels is not None) and all(block.levels.get(level, 0) == 0 for level in levels):
+                continue
+            if (origins is not None) and len(set(block.origins).intersection(origins)) == 0:
+                continue
+            selected_blocks.append(block)
+        return selected_blocks
+
+    @staticmethod
+    def iterate_blocks(
+        path: str,
+        blocks: list[src.types.LogArchiveIndexBlock],
+    ) -> Generator[src.types.LogArchiveItem, None, None]:
+        """Read the records of some blocks of an archive file by seeking
+        directly to their offsets.
+
+        Args:
+            path:    The path of the uncompressed archive file.
+            blocks:  The blocks to read, in the order of the archive file.
+
+        Returns:
+            A generator of log records.
+        """
+
+        if len(blocks) == 0:
+            return
+        with open_binary_archive_file(path) as f:
+            for block in blocks:
+                f.seek(block.offset)
+                for line in f.read(block.length).split(b"\n"):
+                    if len(line.strip()) > 0:
+                        yield src.types.LogArchiveItem.model_validate_json(line)
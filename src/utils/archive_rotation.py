@@ -0,0 +1,403 @@
+from typing import IO, Annotated, Any, Literal, Optional
+import contextlib
+import datetime
+import gzip
+import io
+import lzma
+import os
+import re
+import shutil
+import filelock
+
+ARCHIVE_COMPRESSION_SUFFIXES: Annotated[
+    dict[Literal["gzip", "xz", "zstd"], str],
+    "The file name suffixes of the compressed archive files per compression algorithm",
+] = {"gzip": ".gz", "xz": ".xz", "zstd": ".zst"}
+
+ARCHIVE_INDEX_SUFFIX: Annotated[
+    str,
+    "The file name suffix of the index sidecar of an archive file (see `MessageArchiveIndexer`)",
+] = ".index.json"
+
+ARCHIVE_ROTATION_GRACE_PERIOD: Annotated[
+    int,
+    "How many seconds after the end of a UTC day its archive files are considered complete. "
+    + "Processes may still append lines of the previous day shortly after midnight.",
+] = 3600
+
+
+def _import_zstandard() -> Any:
+    try:
+        import zstandard  # type: ignore
+    except ImportError:
+        raise ImportError("Compressing archive files with zstd requires zstandard")
+    return zstandard
+
+
+def open_archive_file(path: str) -> IO[str]:
+    """Open a plain or compressed archive file for reading in text mode.
+
+    If there is no file at `path`, the compressed variants `path.gz`,
+    `path.xz` and `path.zst` are tried. Compressed files are decompressed
+    while reading, so the memory usage does not depend on the file size.
+    Reading zstd files requires the optional dependency `zstandard`.
+
+    Args:
+        path:  The path of the uncompressed archive file.
+
+    Returns:
+        A file object that yields the lines of the uncompressed file.
+
+    Raises:
+        FileNotFoundError: If neither the file nor a compressed variant exists.
+    """
+
+    return io.TextIOWrapper(open_binary_archive_file(path))  # type: ignore[type-var]
+
+
+def open_binary_archive_file(path: str) -> io.BufferedIOBase:
+    """Open a plain or compressed archive file for reading in binary mode.
+    Same as `open_archive_file`, but the returned file object yields bytes
+    and supports `seek` to offsets in the uncompressed file.
+
+    Args:
+        path:  The path of the uncompressed archive file.
+
+    Returns:
+        A file object that yields the bytes of the uncompressed file.
+
+    Raises:
+        FileNotFoundError: If neither the file nor a compressed variant exists.
+    """
+
+    archive_file_path = get_archive_file_path(path)
+    if archive_file_path == path:
+        return open(path, "rb")
+    return _open_compressed(archive_file_path)
+
+
+def get_archive_file_path(path: str) -> str:
+    """Get the path of the file that stores the content of an archive file,
+    i.e. `path` itself or one of its compressed variants.
+
+    Args:
+        path:  The path of the uncompressed archive file.
+
+    Returns:
+        The path of the existing plain or compressed file.
+
+    Raises:
+        FileNotFoundError: If neither the file nor a compressed variant exists.
+    """
+
+    for suffix in ["", *ARCHIVE_COMPRESSION_SUFFIXES.values()]:
+        if os.path.isfile(path + suffix):
+            return path + suffix
+    raise FileNotFoundError(f"Archive file {path} does not exist")
+
+
+def append_to_archive_file(
+    path: str,
+    content: bytes,
+    header: bytes = b"",
+    fsync: bool = False,
+) -> None:
+    """Append to the file of a day in a daily archive. If the day has
+    already been compressed by the `ArchiveRotation`, the content is
+    appended to the compressed file as an additional stream instead of
+    creating the plain file again - readers would otherwise only see the
+    plain file. The caller has to hold the lock of the archive, which the
+    rotation holds while it replaces the plain file.
+
+    Args:
+        path:     The path of the uncompressed archive file.
+        content:  The bytes to append.
+        header:   Written in front of the content when the file is created.
+        fsync:    Whether to wait until the content has been written to the disk.
+    """
+
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+    except FileNotFoundError:
+        for compression, suffix in ARCHIVE_COMPRESSION_SUFFIXES.items():
+            if os.path.isfile(path + suffix):
+                fd = os.open(path + suffix, os.O_WRONLY | os.O_APPEND)
+                content = _compress_bytes(content, compression)
+                break
+        else:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            if os.fstat(fd).st_size == 0:
+                content = header + content
+    try:
+        os.write(fd, content)
+        if fsync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _compress_bytes(content: bytes, compression: Literal["gzip", "xz", "zstd"]) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(content)
+    if compression == "xz":
+        return lzma.compress(content)
+    compressed: bytes = _import_zstandard().ZstdCompressor().compress(content)
+    return compressed
+
+
+def _open_compressed(path: str) -> io.BufferedIOBase:
+    if path.endswith(ARCHIVE_COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.open(path, "rb")
+    if path.endswith(ARCHIVE_COMPRESSION_SUFFIXES["xz"]):
+        return lzma.open(path, "rb")
+    zstandard = _import_zstandard()
+    reader: io.BufferedIOBase = zstandard.ZstdDecompressor().stream_reader(
+        open(path, "rb"), read_across_frames=True, closefd=True
+    )
+    return reader
+
+
+class ArchiveRotation:
+    """Compresses the completed days of a daily archive directory (e.g.
+    `data/messages/YYYY-MM-DD.csv` or `data/logs/YYYY-MM-DD.log`) and
+    deletes old days according to a retention policy.
+
+    A day is complete `ARCHIVE_ROTATION_GRACE_PERIOD` seconds after its end
+    in UTC. The file of a completed day is compressed to `<file>.gz`,
+    `<file>.xz` or `<file>.zst` and the plain file is removed. If a process
+    still appends to the plain file afterwards, the next rotation appends
+    it to the compressed file as an additional stream - all three formats
+    decompress concatenated streams as one file. Writers append lines of
+    an already compressed day to the compressed file directly (see
+    `append_to_archive_file`). Use `open_archive_file` to read plain and
+    compressed files alike. Index sidecars are rebuilt from the compressed
+    file when they are used again and are deleted together with their day.
+
+    The columnar message archive stores one directory per day, which is
+    not compressed but deleted with the same retention policy (see
+    `ArchiveRotation.prune_day_directories`)."""
+
+    @staticmethod
+    def list_archive_files(directory: str, extension: str) -> list[tuple[datetime.date, str]]:
+        """List all plain and compressed files of a daily archive directory and their index sidecars.
+
+        Args:
+            directory:  The archive directory.
+            extension:  The extension of the uncompressed files, e.g. `.csv`.
+
+        Returns:
+            A list of `(date, path)` tuples sorted by date.
+        """
+
+        if not os.path.isdir(directory):
+            return []
+        pattern = re.compile(
+            r"^(\d{4}-\d{2}-\d{2})"
+            + re.escape(extension)
+            + r"("
+            + "|".join(
+                re.escape(s) for s in [*ARCHIVE_COMPRESSION_SUFFIXES.values(), ARCHIVE_INDEX_SUFFIX]
+            )
+            + r")?$"
+        )
+        files: list[tuple[datetime.date, str]] = []
+        for filename in os.listdir(directory):
+            match = pattern.match(filename)
+            if match is not None:
+                date = datetime.date.fromisoformat(match.group(1))
+                files.append((date, os.path.join(directory, filename)))
+        return sorted(files)
+
+    @staticmethod
+    def compress_file(
+        path: str,
+        compression: Literal["gzip", "xz", "zstd"],
+        lock_path: Optional[str] = None,
+    ) -> str:
+        """Compress a file and remove the uncompressed file. If the compressed
+        file already exists, the file is appended to it as a new stream. The
+        data is written to a temporary file first so that an interrupted
+        compression never leaves a truncated file behind.
+
+        The file is compressed without holding the lock, so writers are not
+        blocked during the compression. Afterwards, the lines that have been
+        appended in the meantime are compressed and the plain file is removed
+        while holding the lock. Writers of completed days have to append
+        under the same lock (see `append_to_archive_file`), so none of their
+        lines is lost. The file of the current day is never compressed, so
+        its writers do not need the lock.
+
+        Args:
+            path:         The path of the file to compress.
+            compression:  The compression algorithm.
+            lock_path:    The lock file that the writers of completed days of
+                          this archive hold while appending, e.g. `data/messages.lock`.
+
+        Returns:
+            The path of the compressed file.
+        """
+
+        compressed_path = path + ARCHIVE_COMPRESSION_SUFFIXES[compression]
+        tmp_path = compressed_path + ".tmp"
+        if os.path.isfile(compressed_path):
+            shutil.copyfile(compressed_path, tmp_path)
+        with open(path, "rb") as plain_file, open(tmp_path, "ab") as compressed_file:
+            ArchiveRotation._compress_stream(plain_file, compressed_file, compression)
+            with (
+                filelock.FileLock(lock_path, timeout=10)
+                if lock_path is not None
+                else contextlib.nullcontext()
+            ):
+                if os.fstat(plain_file.fileno()).st_size > plain_file.tell():
+                    ArchiveRotation._compress_stream(plain_file, compressed_file, compression)
+                compressed_file.flush()
+                os.fsync(compressed_file.fileno())
+                os.replace(tmp_path, compressed_path)
+                os.remove(path)
+        return compressed_path
+
+    @staticmethod
+    def _compress_stream(
+        plain_file: IO[bytes],
+        compressed_file: IO[bytes],
+        compression: Literal["gzip", "xz", "zstd"],
+    ) -> None:
+        """Compress the rest of `plain_file` and append it to `compressed_file` as a new stream."""
+
+        if compression == "gzip":
+            with gzip.GzipFile(fileobj=compressed_file, mode="wb") as f:
+                shutil.copyfileobj(plain_file, f)
+        elif compression == "xz":
+            with lzma.LZMAFile(compressed_file, mode="wb") as f:
+                shutil.copyfileobj(plain_file, f)
+        else:
+            zstandard = _import_zstandard()
+            zstandard.ZstdCompressor().copy_stream(plain_file, compressed_file)
+
+    @staticmethod
+    def rotate(
+        directory: str,
+        extension: str,
+        compression: Optional[Literal["gzip", "xz", "zstd"]],
+        retention_days: Optional[int] = None,
+        retention_bytes: Optional[int] = None,
+        lock_path: Optional[str] = None,
+    ) -> tuple[list[str], list[str]]:
+        """Compress all completed days of an archive directory and apply
+        the retention policy. The files of the current day are never
+        compressed or deleted. A day is deleted as a whole, i.e. its data
+        file together with its index sidecar.
+
+        Args:
+            directory:        The archive directory.
+            extension:        The extension of the uncompressed files, e.g. `.csv`.
+            compression:      The compression algorithm. If this is `None`,
+                              files are not compressed.
+            retention_days:   Delete days older than this many days.
+            retention_bytes:  Delete the oldest days until the directory
+                              is smaller than this many bytes.
+            lock_path:        The lock file of the writers of this archive
+                              (see `ArchiveRotation.compress_file`).
+
+        Returns:
+            The paths of the compressed files and the paths of the deleted files.
+        """
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        completed_before = (now - datetime.timedelta(seconds=ARCHIVE_ROTATION_GRACE_PERIOD)).date()
+        compressed_files: list[str] = []
+        deleted_files: list[str] = []
+
+        if compression is not None:
+            for date, path in ArchiveRotation.list_archive_files(directory, extension):
+                if (date < completed_before) and path.endswith(extension):
+                    compressed_files.append(
+                        ArchiveRotation.compress_file(path, compression, lock_path)
+                    )
+
+        # date -> paths of the data file and the index sidecar of that day
+        days: dict[datetime.date, list[str]] = {}
+        for date, path in ArchiveRotation.list_archive_files(directory, extension):
+            days.setdefault(date, []).append(path)
+        for date in ArchiveRotation._select_expired_days(
+            {date: sum([os.path.getsize(p) for p in paths]) for date, paths in days.items()},
+            completed_before,
+            retention_days,
+            retention_bytes,
+        ):
+            for path in days[date]:
+                os.remove(path)
+                deleted_files.append(path)
+
+        return compressed_files, deleted_files
+
+    @staticmethod
+    def prune_day_directories(
+        directory: str,
+        retention_days: Optional[int] = None,
+        retention_bytes: Optional[int] = None,
+    ) -> list[str]:
+        """Apply the retention policy to an archive that stores one
+        directory `YYYY-MM-DD/` per day, e.g. the columnar message archive.
+        The directory of the current day is never deleted.
+
+        Args:
+            directory:        The archive directory.
+            retention_days:   Delete days older than this many days.
+            retention_bytes:  Delete the oldest days until the archive
+                              is smaller than this many bytes.
+
+        Returns:
+            The paths of the deleted day directories.
+        """
+
+        if not os.path.isdir(directory):
+            return []
+        now = datetime.datetime.now(datetime.timezone.utc)
+        completed_before = (now - datetime.timedelta(seconds=ARCHIVE_ROTATION_GRACE_PERIOD)).date()
+        day_directories: dict[datetime.date, str] = {}
+        for dirname in os.listdir(directory):
+            path = os.path.join(directory, dirname)
+            if re.match(r"^\d{4}-\d{2}-\d{2}$", dirname) and os.path.isdir(path):
+                day_directories[datetime.date.fromisoformat(dirname)] = path
+
+        deleted_directories: list[str] = []
+        for date in ArchiveRotation._select_expired_days(
+            {
+                date: sum([entry.stat().st_size for entry in os.scandir(path) if entry.is_file()])
+                for date, path in day_directories.items()
+            },
+            completed_before,
+            retention_days,
+            retention_bytes,
+        ):
+            shutil.rmtree(day_directories[date])
+            deleted_directories.append(day_directories[date])
+        return deleted_directories
+
+    @staticmethod
+    def _select_expired_days(
+        day_sizes: dict[datetime.date, int],
+        completed_before: datetime.date,
+        retention_days: Optional[int],
+        retention_bytes: Optional[int],
+    ) -> list[datetime.date]:
+        """Select the days to delete according to the retention policy,
+        starting with the oldest day. Days from `completed_before` on are
+        never selected."""
+
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        total_bytes = sum(day_sizes.values())
+        expired_days: list[datetime.date] = []
+        for date in sorted(day_sizes.keys()):
+            if date >= completed_before:
+                break
+            too_old = (retention_days is not None) and (
+                date < today - datetime.timedelta(days=retention_days)
+            )
+            too_large = (retention_bytes is not None) and (total_bytes > retention_bytes)
+            if not (too_old or too_large):
+                continue
+            expired_days.append(date)
+            total_bytes -= day_sizes[date]
+        return expired_days
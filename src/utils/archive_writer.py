@@ -0,0 +1,193 @@
+from typing import Optional
+import atexit
+import datetime
+import multiprocessing.util
+import os
+import threading
+import time
+import filelock
+from .archive_rotation import append_to_archive_file
+
+
+class MessageArchiveWriter:
+    """A long-lived writer for the daily CSV files of the message archive.
+
+    The writer keeps the file of the current UTC day open in append mode
+    instead of opening and closing it for every message. Lines are
+    collected in memory and written with a single `write` call per file
+    at the latest `flush_interval` seconds after they have been passed to
+    `write`, by the next call to `write` or by a timer thread. Since
+    the files are opened with `O_APPEND`, the writes of multiple processes
+    never overwrite each other, so the archive lock is only needed when a
+    file is created and its header is written. Lines of other days than
+    the current UTC day are appended while holding the lock, because the
+    `ArchiveRotation` might compress that day at the same time.
+
+    Durability: lines that have been passed to `write` reach the archive
+    file after at most `flush_interval` seconds, on `flush`/`close`, or
+    when the process exits normally - also in processes started by
+    `multiprocessing`, which do not run `atexit` handlers. If the process
+    is killed, at most the lines of the last `flush_interval` seconds are
+    missing in the archive - they are still in the active message queue.
+    With `fsync`, every flush also waits until the data has been written
+    to the disk so it survives a power loss.
+
+    The file of the current day is kept open until the day changes. It
+    is not checked whether the file has been moved in the meantime,
+    which would cost a system call per flush - the rotation never moves
+    the file of the current day. It can be used from multiple threads and
+    after a `fork`."""
+
+    def __init__(
+        self,
+        directory: str,
+        lock_path: str,
+        flush_interval: float = 0,
+        fsync: bool = False,
+    ) -> None:
+        """Create a new archive writer. The file is only opened on the first write.
+
+        Args:
+            directory:       The directory of the daily archive files.
+            lock_path:       The lock file used when creating a new archive file.
+            flush_interval:  How many seconds lines may be buffered in memory
+                             before they are written. With `0`, every call to
+                             `write` writes to the file right away.
+            fsync:           Whether to call `fsync` after every flush.
+        """
+
+        self.directory = directory
+        self.lock_path = lock_path
+        self.lock = filelock.FileLock(lock_path, timeout=5)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffered_lines: dict[str, list[str]] = {}
+        self.last_flush_time = time.time()
+        self.file_path: Optional[str] = None
+        self.file_descriptor: Optional[int] = None
+        self.pid = os.getpid()
+        self.lines_lock = threading.Lock()
+        self.flush_timer: Optional[threading.Timer] = None
+        self.finalizer: Optional[multiprocessing.util.Finalize] = None
+        if flush_interval > 0:
+            atexit.register(self.flush)
+            # atexit handlers are not run in processes started by multiprocessing;
+            # runs after the exit flush of the messaging agent (priority 100)
+            self.finalizer = multiprocessing.util.Finalize(None, self.flush, exitpriority=50)
+
+    def get_file_path(self, timestamp: float) -> str:
+        """Get the path of the archive file a message with this timestamp belongs to."""
+
+        return os.path.join(
+            self.directory,
+            datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime(
+                "%Y-%m-%d.csv"
+            ),
+        )
+
+    def write(self, lines: list[tuple[float, str]]) -> None:
+        """Append lines to the archive.
+
+        Args:
+            lines: A list of `(timestamp, message_body_json)` tuples.
+        """
+
+        self._check_fork()
+        with self.lines_lock:
+            for timestamp, message_body_string in lines:
+                csv_message_body_string = message_body_string.replace('"', '""')
+                self.buffered_lines.setdefault(self.get_file_path(timestamp), []).append(
+                    f'{timestamp},"{csv_message_body_string}"\n'
+                )
+            seconds_since_last_flush = time.time() - self.last_flush_time
+            if seconds_since_last_flush >= self.flush_interval:
+                self._flush()
+            elif self.flush_timer is None:
+                self.flush_timer = threading.Timer(
+                    self.flush_interval - seconds_since_last_flush, self.flush
+                )
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def flush(self) -> None:
+        """Write all buffered lines to the archive files."""
+
+        self._check_fork()
+        with self.lines_lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        self.last_flush_time = time.time()
+        buffered_lines = self.buffered_lines
+        self.buffered_lines = {}
+        current_file_path = self.get_file_path(time.time())
+        for file_path, file_lines in buffered_lines.items():
+            content = "".join(file_lines).encode()
+            if file_path != current_file_path:
+                with self.lock:
+                    append_to_archive_file(
+                        file_path, content, b"timestamp,message_body\n", self.fsync
+                    )
+                continue
+            file_descriptor = self._open(file_path)
+            os.write(file_descriptor, content)
+            if self.fsync:
+                os.fsync(file_descriptor)
+
+    def close(self) -> None:
+        """Write all buffered lines and close the open archive file."""
+
+        self._check_fork()
+        with self.lines_lock:
+            self._flush()
+            if self.flush_interval > 0:
+                atexit.unregister(self.flush)
+            if self.finalizer is not None:
+                self.finalizer.cancel()
+                self.finalizer = None
+            self._close()
+
+    def _check_fork(self) -> None:
+        """Reset the writer in a process created by `fork`. The lines
+        buffered in the parent are left to the parent to write, and the
+        inherited file descriptor, locks and timer are replaced. Finalizers
+        of the parent are not run in the child, so the exit flush is
+        registered again."""
+
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.lock = filelock.FileLock(self.lock_path, timeout=5)
+            self.lines_lock = threading.Lock()
+            self.buffered_lines = {}
+            self.flush_timer = None
+            self._close()
+            if self.flush_interval > 0:
+                self.finalizer = multiprocessing.util.Finalize(None, self.flush, exitpriority=50)
+
+    def _open(self, file_path: str) -> int:
+        """Return a file descriptor for the archive file of the current day.
+        Reuses the open file if it belongs to the same day, otherwise opens
+        the file and writes the CSV header if the file is new."""
+
+        if (self.file_descriptor is not None) and (self.file_path == file_path):
+            return self.file_descriptor
+        self._close()
+
+        with self.lock:
+            file_descriptor = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            if os.fstat(file_descriptor).st_size == 0:
+                os.write(file_descriptor, b"timestamp,message_body\n")
+        self.file_path = file_path
+        self.file_descriptor = file_descriptor
+        return file_descriptor
+
+    def _close(self) -> None:
+        """Close the open archive file if there is one."""
+
+        if self.file_descriptor is not None:
+            os.close(self.file_descriptor)
+        self.file_path = None
+        self.file_descriptor = None
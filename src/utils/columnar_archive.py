@@ -0,0 +1,189 @@
+from __future__ import annotations
+from typing import Annotated, Any, Optional
+import array
+import datetime
+import os
+import sys
+import urllib.parse
+import src
+
+COLUMNAR_ARCHIVE_DIR: Annotated[
+    str,
+    "The absolute path of the directory that stores the columnar archive of data messages "
+    + "(`data/messages-columnar/`)",
+] = os.path.join(
+    src.constants.DATA_DIR,
+    "messages-columnar",
+)
+
+
+class ColumnarMessageArchive:
+    """An archive of data messages that stores each data key in a separate
+    column file. It is an alternative to the CSV message archive for
+    analysing large amounts of data: loading one key over a time range only
+    reads the files of that key on the respective days and does not parse
+    any JSON.
+
+    There is one directory `data/messages-columnar/YYYY-MM-DD/` per UTC day
+    and one file `<url-encoded key>.f64` per data key in it. Each file is a
+    sequence of fixed-width records of two little-endian 64 bit floats: the
+    timestamp of the message and the value of the key. New records are
+    appended in chunks with a single `write` call, so multiple processes
+    can append to the same file without a lock. Only numeric values are
+    stored, string values are only kept in the CSV archive.
+
+    The files can be loaded with NumPy directly:
+
+    ```python
+    np.fromfile(path, dtype=[("timestamp", "<f8"), ("value", "<f8")])
+    ```
+    """
+
+    @staticmethod
+    def get_day_directory(date: datetime.date) -> str:
+        """Get the directory of the columnar archive for a specific date."""
+
+        return os.path.join(COLUMNAR_ARCHIVE_DIR, date.strftime("%Y-%m-%d"))
+
+    @staticmethod
+    def get_column_file(date: datetime.date, key: str) -> str:
+        """Get the file path of the column of a data key for a specific date."""
+
+        return os.path.join(
+            ColumnarMessageArchive.get_day_directory(date),
+            urllib.parse.quote(key, safe="") + ".f64",
+        )
+
+    @staticmethod
+    def append(messages: list[tuple[float, src.types.DataMessageBody]]) -> None:
+        """Append data messages to the columnar archive.
+
+        Args:
+            messages: A list of `(timestamp, message_body)` tuples.
+        """
+
+        # group the records by the files they are appended to
+        chunks: dict[str, array.array[float]] = {}
+        for timestamp, message_body in messages:
+            date = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).date()
+            for key, value in message_body.data.items():
+                if isinstance(value, str):
+                    continue
+                path = ColumnarMessageArchive.get_column_file(date, key)
+                if path not in chunks:
+                    chunks[path] = array.array("d")
+                chunks[path].extend((timestamp, float(value)))
+
+        for path, chunk in chunks.items():
+            if sys.byteorder == "big":
+                chunk.byteswap()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, chunk.tobytes())
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def list_keys(date: datetime.date) -> list[str]:
+        """List all data keys that have been archived on a specific date."""
+
+        directory = ColumnarMessageArchive.get_day_directory(date)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            [
+                urllib.parse.unquote(filename[:-4])
+                for filename in os.listdir(directory)
+                if filename.endswith(".f64")
+            ]
+        )
+
+    @staticmethod
+    def load(
+        start: datetime.datetime,
+        end: datetime.datetime,
+        keys: Optional[list[str]] = None,
+    ) -> dict[str, tuple[list[float], list[float]]]:
+        """Load the values of some data keys in a time range.
+
+        Args:
+            start:  The start of the time range (inclusive). Naive datetimes
+                    are interpreted as UTC.
+            end:    The end of the time range (exclusive). Naive datetimes
+                    are interpreted as UTC.
+            keys:   The data keys to load. If this is `None`, all keys are loaded.
+
+        Returns:
+            A dictionary mapping each key to a tuple of two lists, the
+            timestamps and the values, sorted by timestamp. Keys without
+            any values in the time range are omitted.
+        """
+
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=datetime.timezone.utc)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=datetime.timezone.utc)
+        start_timestamp, end_timestamp = start.timestamp(), end.timestamp()
+
+        records: dict[str, list[tuple[float, float]]] = {}
+        date = start.astimezone(datetime.timezone.utc).date()
+        while date <= end.astimezone(datetime.timezone.utc).date():
+            for key in ColumnarMessageArchive.list_keys(date) if keys is None else keys:
+                path = ColumnarMessageArchive.get_column_file(date, key)
+                if not os.path.isfile(path):
+                    continue
+                column = array.array("d")
+                with open(path, "rb") as f:
+                    content = f.read()
+                column.frombytes(content[: len(content) - (len(content) % 16)])
+                if sys.byteorder == "big":
+                    column.byteswap()
+                records.setdefault(key, []).extend(
+                    [
+                        (timestamp, value)
+                        for timestamp, value in zip(column[0::2], column[1::2])
+                        if start_timestamp <= timestamp < end_timestamp
+                    ]
+                )
+            date += datetime.timedelta(days=1)
+
+        result: dict[str, tuple[list[float], list[float]]] = {}
+        for key, key_records in records.items():
+            if len(key_records) == 0:
+                continue
+            key_records.sort()
+            result[key] = ([r[0] for r in key_records], [r[1] for r in key_records])
+        return result
+
+    @staticmethod
+    def load_as_arrow_table(
+        start: datetime.datetime,
+        end: datetime.datetime,
+        key: str,
+    ) -> Any:
+        """Load the values of one data key in a time range as a `pyarrow.Table`
+        with the columns `timestamp` and `value`. This can be written to a
+        Parquet file using `pyarrow.parquet.write_table`.
+
+        Requires the optional dependency `pyarrow`.
+
+        Args:
+            start:  The start of the time range (inclusive).
+            end:    The end of the time range (exclusive).
+            key:    The data key to load.
+
+        Returns:
+            A `pyarrow.Table`.
+
+        Raises:
+            ImportError: If `pyarrow` is not installed.
+        """
+
+        try:
+            import pyarrow  # type: ignore
+        except ImportError:
+            raise ImportError("Loading the columnar archive as an Arrow table requires pyarrow")
+
+        timestamps, values = ColumnarMessageArchive.load(start, end, [key]).get(key, ([], []))
+        return pyarrow.table({"timestamp": timestamps, "value": values})
@@ -0,0 +1,112 @@
+from __future__ import annotations
+from typing import Any, Callable, Optional
+import ctypes
+import multiprocessing.sharedctypes
+import time
+import src
+
+# indices of the values in the shared array of a heartbeat
+_LAST_BEAT = 0
+_ITERATION_COUNT = 1
+_SUM_SECONDS = 2
+_MAX_SECONDS = 3
+_LAST_SECONDS = 4
+
+
+class Heartbeat:
+    """The heartbeat of a procedure or backend process, used by its
+    `LifecycleManager` to detect a process that is still alive but
+    stalled, e.g. on a blocking sensor read or on a lock.
+
+    The lifecycle manager creates a small array of doubles in shared
+    memory for each process it starts. The process calls `Heartbeat.beat`
+    once per loop iteration, which only writes the current time and the
+    duration of the iteration into that array: no system call, no pipe
+    and no lock. The lifecycle manager reads the array without involving
+    the process. The values are written by one process only, so a reader
+    may at most see the statistics of the previous iteration.
+
+    ```python
+    while True:
+        src.utils.Heartbeat.beat()
+        ...
+    ```"""
+
+    # the shared array of the current process, set when it is started by a lifecycle manager
+    values: Optional[ctypes.Array[ctypes.c_double]] = None
+
+    @staticmethod
+    def create() -> ctypes.Array[ctypes.c_double]:
+        """Create the shared array for a new process."""
+
+        return multiprocessing.sharedctypes.RawArray(ctypes.c_double, 5)
+
+    @staticmethod
+    def run_entrypoint(
+        values: ctypes.Array[ctypes.c_double],
+        entrypoint: Callable[..., None],
+        *args: Any,
+    ) -> None:
+        """Run the entrypoint of a procedure or backend in a new process
+        with the given shared array as its heartbeat.
+
+        Args:
+            values:      The shared array created with `Heartbeat.create`.
+            entrypoint:  The entrypoint of the procedure or backend.
+            args:        The arguments of the entrypoint.
+        """
+
+        Heartbeat.values = values
+        entrypoint(*args)
+
+    @staticmethod
+    def beat() -> None:
+        """Signal that the current process is making progress. Call this
+        once per loop iteration. Does nothing if the process has not been
+        started by a lifecycle manager."""
+
+        values = Heartbeat.values
+        if values is None:
+            return
+        now = time.monotonic()
+        if values[_LAST_BEAT] > 0:
+            seconds = now - values[_LAST_BEAT]
+            values[_ITERATION_COUNT] += 1
+            values[_SUM_SECONDS] += seconds
+            values[_MAX_SECONDS] = max(values[_MAX_SECONDS], seconds)
+            values[_LAST_SECONDS] = seconds
+        values[_LAST_BEAT] = now
+
+    @staticmethod
+    def get_seconds_since_last_beat(
+        values: ctypes.Array[ctypes.c_double], start_time: float
+    ) -> float:
+        """Get the number of seconds since the last heartbeat of a process.
+
+        Args:
+            values:      The shared array of the process.
+            start_time:  The `time.monotonic()` value of the start of the
+                         process, used if it has not sent a heartbeat yet.
+        """
+
+        return time.monotonic() - max(values[_LAST_BEAT], start_time)
+
+    @staticmethod
+    def get_statistics(
+        values: ctypes.Array[ctypes.c_double], start_time: float
+    ) -> src.types.HeartbeatStatistics:
+        """Get the loop iteration statistics of a process.
+
+        Args:
+            values:      The shared array of the process.
+            start_time:  The `time.monotonic()` value of the start of the process.
+        """
+
+        iteration_count = int(values[_ITERATION_COUNT])
+        return src.types.HeartbeatStatistics(
+            iteration_count=iteration_count,
+            mean_seconds=(None if iteration_count == 0 else values[_SUM_SECONDS] / iteration_count),
+            max_seconds=None if iteration_count == 0 else values[_MAX_SECONDS],
+            last_seconds=None if iteration_count == 0 else values[_LAST_SECONDS],
+            seconds_since_last_heartbeat=Heartbeat.get_seconds_since_last_beat(values, start_time),
+        )
@@ -1,10 +1,16 @@
 from __future__ import annotations
 from typing import Any, Literal, Union, Callable, Optional
+import ctypes
 import signal
+import time
 import multiprocessing
 import multiprocessing.synchronize
+import psutil
 import pydantic
 from .logger import Logger
+from .heartbeat import Heartbeat
+from .log_ring_buffer import LogRingBuffer
+from .messaging_agent import MessagingAgent
 import src
 
 
@@ -16,7 +22,17 @@ class LifecycleManager:
     stopping and checking the status of the procedure.
 
     Each procedure/backend is wrapped in one instance of the lifecycle
-    manager."""
+    manager. When a process crashes repeatedly, its restart is delayed
+    according to `src.constants.SECONDS_PER_PROCEDURE_RESTART_BACKOFF`.
+
+    If `config.resource_accounting` is set, the resource usage of the
+    process is sampled regularly (see `LifecycleManager.check_resources`)
+    and the limits configured for its name are enforced.
+
+    Each process gets a `Heartbeat`. If `config.heartbeats` configures a
+    timeout for its name, a process that has not sent a heartbeat for
+    longer than that is considered stalled, killed and restarted (see
+    `LifecycleManager.check_heartbeat`)."""
 
     def __init__(
         self,
@@ -46,6 +62,25 @@ class LifecycleManager:
         self.config = config
         self.process: Optional[multiprocessing.Process] = None
 
+        # monotonic time of the last start, number of consecutive crashes and
+        # the monotonic time before which the process must not be started again
+        self.start_time: Optional[float] = None
+        self.consecutive_crashes: int = 0
+        self.restart_time: float = 0
+
+        # monotonic times at which the teardown has been initiated and after
+        # which the process is killed, set by `initiate_teardown`
+        self.teardown_start_time: float = 0
+        self.teardown_deadline: Optional[float] = None
+
+        # the process used to sample the resource usage and the monotonic
+        # time of the next sample, only used with `config.resource_accounting`
+        self.psutil_process: Optional[psutil.Process] = None
+        self.next_sample_time: float = 0
+
+        # the shared heartbeat array of the current process
+        self.heartbeat: Optional[ctypes.Array[ctypes.c_double]] = None
+
         self.entrypoint: Union[
             Callable[[src.types.Config, str], None],
             Callable[[src.types.Config, str, multiprocessing.synchronize.Event], None],
@@ -97,22 +132,146 @@ class LifecycleManager:
 
         if self.procedure_is_running():
             raise RuntimeError("procedure is already running")
+        self.heartbeat = Heartbeat.create()
         self.process = multiprocessing.Process(
-            target=self.entrypoint,
+            target=Heartbeat.run_entrypoint,
             args=(
-                (self.config, self.name)
+                (self.heartbeat, self.entrypoint, self.config, self.name)
                 if (self.variant == "procedure")
-                else (self.config, self.name, self.teardown_indicator)
+                else (
+                    self.heartbeat,
+                    self.entrypoint,
+                    self.config,
+                    self.name,
+                    self.teardown_indicator,
+                )
             ),
             name=f"{src.constants.NAME}-procedure-{self.name}",
             daemon=True,
         )
         self.process.start()
+        self.start_time = time.monotonic()
         self.logger.info(f"Starting process with PID {self.process.pid}")
 
+        if self.config.resource_accounting is not None:
+            self.next_sample_time = (
+                self.start_time + self.config.resource_accounting.seconds_between_samples
+            )
+            try:
+                self.psutil_process = psutil.Process(self.process.pid)
+                self.psutil_process.cpu_percent()
+            except psutil.Error:
+                self.psutil_process = None
+            self.apply_resource_limits()
+
+    def apply_resource_limits(self) -> None:
+        """Sets the niceness, the CPU affinity and the maximum number of
+        open files of the process as configured for its name in
+        `config.resource_accounting.limits`. Limits that cannot be applied
+        on this system are logged as a warning."""
+
+        if (self.psutil_process is None) or (self.config.resource_accounting is None):
+            return
+        limits = self.config.resource_accounting.limits.get(self.name)
+        if limits is None:
+            return
+        try:
+            if limits.nice is not None:
+                self.psutil_process.nice(limits.nice)
+            if limits.cpu_affinity is not None:
+                self.psutil_process.cpu_affinity(limits.cpu_affinity)
+            if limits.max_open_files is not None:
+                self.psutil_process.rlimit(
+                    psutil.RLIMIT_NOFILE, (limits.max_open_files, limits.max_open_files)
+                )
+        except (psutil.Error, OSError, ValueError, AttributeError) as e:
+            self.logger.warning(
+                "Could not apply the resource limits of the process", details=repr(e)
+            )
+
+    def get_seconds_until_resource_sample(self) -> Optional[float]:
+        """Returns how many seconds are left until the resource usage of
+        the process should be sampled again, or `None` if the process is
+        not running or `config.resource_accounting` is not set."""
+
+        if (self.process is None) or (self.psutil_process is None):
+            return None
+        return max(self.next_sample_time - time.monotonic(), 0)
+
+    def check_resources(self) -> None:
+        """Samples the CPU usage, resident memory, number of open file
+        descriptors and threads of the process and sends them as a data
+        message with keys prefixed by the procedure name, e.g.
+        `dummy-procedure_rss_mb`. Logs a warning if the resident memory exceeds its soft
+        limit, and kills the process if it exceeds its hard limit. The
+        killed process is then restarted like a crashed one."""
+
+        if (
+            (self.process is None)
+            or (self.psutil_process is None)
+            or (self.config.resource_accounting is None)
+        ):
+            return
+        self.next_sample_time = (
+            time.monotonic() + self.config.resource_accounting.seconds_between_samples
+        )
+        try:
+            with self.psutil_process.oneshot():
+                cpu_percent = self.psutil_process.cpu_percent()
+                rss_mb = self.psutil_process.memory_info().rss / 1_000_000
+                open_files = self.psutil_process.num_fds()
+                threads = self.psutil_process.num_threads()
+        except psutil.Error:
+            # the process has just died, the supervisor will notice it
+            return
+
+        self.logger.debug(
+            f"Resource usage: {cpu_percent:.1f} % CPU, {rss_mb:.1f} MB memory, "
+            + f"{open_files} open files, {threads} threads"
+        )
+        data: dict[str, float | int] = {
+            f"{self.name}_cpu_percent": round(cpu_percent, 2),
+            f"{self.name}_rss_mb": round(rss_mb, 2),
+            f"{self.name}_open_files": open_files,
+            f"{self.name}_threads": threads,
+        }
+        heartbeat_statistics = self.get_heartbeat_statistics()
+        if (heartbeat_statistics is not None) and (heartbeat_statistics.iteration_count > 0):
+            data[f"{self.name}_loop_iterations"] = heartbeat_statistics.iteration_count
+            data[f"{self.name}_mean_loop_seconds"] = round(
+                heartbeat_statistics.mean_seconds or 0, 3
+            )
+            data[f"{self.name}_max_loop_seconds"] = round(heartbeat_statistics.max_seconds or 0, 3)
+        MessagingAgent.get_shared(self.config).add_message(src.types.DataMessageBody(data=data))
+
+        limits = self.config.resource_accounting.limits.get(self.name)
+        if limits is None:
+            return
+        if (limits.max_rss_mb is not None) and (rss_mb > limits.max_rss_mb):
+            self.logger.error(
+                f"Process uses {rss_mb:.1f} MB of memory (limit: {limits.max_rss_mb} MB), "
+                + "killing it"
+            )
+            self.process.kill()
+        elif (limits.soft_max_rss_mb is not None) and (rss_mb > limits.soft_max_rss_mb):
+            self.logger.warning(
+                f"Process uses {rss_mb:.1f} MB of memory (soft limit: {limits.soft_max_rss_mb} MB)"
+            )
+
+    def get_seconds_until_restart(self) -> float:
+        """Returns how many seconds the restart of a crashed procedure is
+        still delayed by its restart backoff. `0` means that it can be
+        started right away."""
+
+        return max(self.restart_time - time.monotonic(), 0)
+
     def check_procedure_status(self) -> None:
         """Checks if the procedure is still running. Logs an error if
-        the procedure has died unexpectedly.
+        the procedure has died unexpectedly. The last records of its ring
+        buffer (see `LogRingBuffer`) are attached to the error.
+
+        If the procedure has crashed shortly after its start, its next
+        start is delayed (see `LifecycleManager.get_seconds_until_restart`).
 
         Raises:
             RuntimeError: If the procedure has not been started yet. This
@@ -125,9 +284,89 @@ class LifecycleManager:
         if self.process.is_alive():
             self.logger.debug("Process is alive")
         else:
-            self.logger.error("Process died unexpectedly")
+            recent_records = LogRingBuffer.read(self.name, n=200)
+            self.logger.error(
+                f"Process died unexpectedly (exit code {self.process.exitcode})",
+                details=(
+                    None
+                    if len(recent_records) == 0
+                    else "Last log records of the process:\n\n" + "".join(recent_records)
+                ),
+            )
             self.process = None
 
+            now = time.monotonic()
+            if (self.start_time is not None) and (
+                now - self.start_time >= src.constants.SECONDS_UNTIL_PROCEDURE_IS_STABLE
+            ):
+                self.consecutive_crashes = 0
+            self.consecutive_crashes += 1
+            backoff = src.constants.SECONDS_PER_PROCEDURE_RESTART_BACKOFF
+            delay = backoff[min(self.consecutive_crashes, len(backoff)) - 1]
+            self.restart_time = now + delay
+            if delay > 0:
+                self.logger.info(
+                    f"Process crashed {self.consecutive_crashes} times in a row, "
+                    + f"delaying its restart by {delay} seconds"
+                )
+
+    def get_heartbeat_statistics(self) -> Optional[src.types.HeartbeatStatistics]:
+        """Returns the loop iteration statistics of the running process
+        (see `Heartbeat`), or `None` if the process is not running."""
+
+        if (self.process is None) or (self.heartbeat is None) or (self.start_time is None):
+            return None
+        return Heartbeat.get_statistics(self.heartbeat, self.start_time)
+
+    def get_seconds_until_heartbeat_deadline(self) -> Optional[float]:
+        """Returns how many seconds the process has left to send its next
+        heartbeat, or `None` if the process is not running or no heartbeat
+        timeout is configured for it in `config.heartbeats`."""
+
+        if (
+            (self.process is None)
+            or (self.heartbeat is None)
+            or (self.start_time is None)
+            or (self.config.heartbeats is None)
+        ):
+            return None
+        timeout = self.config.heartbeats.timeouts.get(self.name)
+        if timeout is None:
+            return None
+        seconds_since_last_beat = Heartbeat.get_seconds_since_last_beat(
+            self.heartbeat, self.start_time
+        )
+        return max(timeout - seconds_since_last_beat, 0)
+
+    def check_heartbeat(self) -> None:
+        """Kills the process if it has not sent a heartbeat within its
+        timeout. The loop iteration statistics and the last records of its
+        ring buffer are attached to the error. The killed process is then
+        restarted like a crashed one. Until then, it has no heartbeat
+        deadline, so it is not killed and reported a second time while it
+        is being reaped."""
+
+        if self.get_seconds_until_heartbeat_deadline() != 0:
+            return
+        assert self.process is not None
+        statistics = self.get_heartbeat_statistics()
+        assert statistics is not None
+        recent_records = LogRingBuffer.read(self.name, n=200)
+        self.logger.error(
+            "Process has not sent a heartbeat for "
+            + f"{statistics.seconds_since_last_heartbeat:.1f} seconds, killing it",
+            details=lambda: (
+                f"loop statistics = {statistics.model_dump_json(indent=4)}"
+                + (
+                    ""
+                    if len(recent_records) == 0
+                    else "\n\nLast log records of the process:\n\n" + "".join(recent_records)
+                )
+            ),
+        )
+        self.process.kill()
+        self.heartbeat = None
+
     def teardown(self) -> None:
         """Tears down the procedures.
 
@@ -142,39 +381,71 @@ class LifecycleManager:
         For procedures, the SIGKILL is sent after
         `src.constants.SECONDS_PER_GRACEFUL_PROCEDURE_TEARDOWN` seconds. For
         backends, the SIGKILL is sent after `config.backend.max_drain_time + 15`
-        seconds."""
+        seconds.
+
+        This is `initiate_teardown` followed by `await_teardown`. Use
+        `Supervisor.teardown` to tear down several processes concurrently."""
+
+        self.initiate_teardown()
+        self.await_teardown()
+
+    def initiate_teardown(self) -> None:
+        """Signals the process to tear down without waiting for it (see
+        `LifecycleManager.teardown`). The time until which the process may
+        tear down on its own is stored in `teardown_deadline`."""
 
         self.logger.info(f"Starting teardown of {self.variant}")
-        if self.process is not None:
-            if not self.process.is_alive():
-                self.logger.debug("Nothing to tear down, process is already stopped")
-                self.process = None
-                return
-
-            graceful_shutdown_time: int
-            if self.variant == "procedure":
-                graceful_shutdown_time = src.constants.SECONDS_PER_GRACEFUL_PROCEDURE_TEARDOWN
-            else:
-                if self.config.backend is not None:
-                    graceful_shutdown_time = self.config.backend.max_drain_time + 15
-                else:
-                    graceful_shutdown_time = 10
+        if self.process is None:
+            self.logger.info("No process to tear down")
+            return
+        if not self.process.is_alive():
+            self.logger.debug("Nothing to tear down, process is already stopped")
+            self.process = None
+            return
 
-            if self.variant == "procedure":
-                self.process.terminate()
+        graceful_shutdown_time: int
+        if self.variant == "procedure":
+            graceful_shutdown_time = src.constants.SECONDS_PER_GRACEFUL_PROCEDURE_TEARDOWN
+        else:
+            if self.config.backend is not None:
+                graceful_shutdown_time = self.config.backend.max_drain_time + 15
             else:
-                self.teardown_indicator.set()
-            self.logger.info(
-                f"Waiting up to {graceful_shutdown_time} seconds for process to tear down on its own"
-            )
-            self.process.join(graceful_shutdown_time)
-            if self.process.is_alive():
-                self.logger.error(
-                    f"Process did not gracefully tear down in "
-                    + f"{graceful_shutdown_time} seconds, killing it forcefully"
-                )
-                self.process.kill()
-            self.process = None
-            self.logger.info("Teardown complete")
+                graceful_shutdown_time = 10
+
+        if self.variant == "procedure":
+            self.process.terminate()
         else:
-            self.logger.info("No process to tear down")
+            self.teardown_indicator.set()
+        self.teardown_start_time = time.monotonic()
+        self.teardown_deadline = self.teardown_start_time + graceful_shutdown_time
+        self.logger.info(
+            f"Waiting up to {graceful_shutdown_time} seconds for process to tear down on its own"
+        )
+
+    def await_teardown(self, deadline: Optional[float] = None) -> None:
+        """Waits for a process that has been signaled by `initiate_teardown`
+        to stop. If it is still running at its own teardown deadline or at
+        `deadline`, whichever is earlier, it is killed with a SIGKILL.
+
+        Args:
+            deadline:  An additional deadline as a `time.monotonic()` value,
+                       e.g. for the teardown of all processes together.
+        """
+
+        if (self.process is None) or (self.teardown_deadline is None):
+            return
+
+        effective_deadline = self.teardown_deadline
+        if deadline is not None:
+            effective_deadline = min(effective_deadline, deadline)
+        self.process.join(max(effective_deadline - time.monotonic(), 0))
+        if self.process.is_alive():
+            self.logger.error(
+                "Process did not gracefully tear down in "
+                + f"{time.monotonic() - self.teardown_start_time:.1f} seconds, "
+                + "killing it forcefully"
+            )
+            self.process.kill()
+        self.process = None
+        self.teardown_deadline = None
+        self.logger.info("Teardown complete")
@@ -0,0 +1,191 @@
+from __future__ import annotations
+from typing import Annotated
+import mmap
+import os
+import re
+import struct
+import threading
+import src
+
+LOG_RING_BUFFER_DIR: Annotated[
+    str,
+    "The absolute path of the directory that stores the ring buffers of recent log records "
+    + "(`data/log-buffers/`)",
+] = os.path.join(src.constants.DATA_DIR, "log-buffers")
+
+LOG_RING_BUFFER_SLOTS: Annotated[
+    int,
+    "How many records the ring buffer of each origin holds",
+] = 1000
+
+LOG_RING_BUFFER_SLOT_SIZE: Annotated[
+    int,
+    "The size of one slot of a ring buffer in bytes. Longer records are truncated.",
+] = 1024
+
+# magic, version, number of slots, slot size, number of written records
+_HEADER = struct.Struct("<8sIIIxxxxQ")
+_MAGIC = b"IVYLOGRB"
+_VERSION = 1
+
+# sequence number (0 while the slot is being written), payload length
+_SLOT_HEADER = struct.Struct("<QI")
+
+
+class LogRingBuffer:
+    """A fixed-size ring buffer of the recent log records of one origin,
+    stored in a memory-mapped file `data/log-buffers/<origin>.buffer`.
+
+    The `Logger` appends every record to the buffer of its origin if
+    `config.logging_verbosity.ring_buffer` is set. Appending only copies
+    the record into a preallocated slot of the shared mapping, there is
+    no file I/O and no allocation apart from encoding the record. Other
+    processes (the CLI, the main loop) read the buffer by mapping the same
+    file, so the last records of a procedure can be queried without
+    reading the log files. The buffer outlives its process, so the records
+    leading up to a crash are still available afterwards.
+
+    The buffer is lock-free for readers: a writer invalidates the sequence
+    number of a slot before overwriting it, and readers discard slots whose
+    sequence number changed while they were read. Each origin should only
+    be written by one process at a time."""
+
+    instances: dict[str, LogRingBuffer] = {}
+    instances_lock = threading.Lock()
+    instances_pid = os.getpid()
+
+    def __init__(
+        self,
+        path: str,
+        slots: int = LOG_RING_BUFFER_SLOTS,
+        slot_size: int = LOG_RING_BUFFER_SLOT_SIZE,
+    ) -> None:
+        """Open the ring buffer file at `path` for writing. The file is
+        (re)created if it does not exist or has a different layout,
+        otherwise writing continues after its last record.
+
+        Args:
+            path:       The path of the ring buffer file.
+            slots:      The number of records the buffer holds.
+            slot_size:  The size of one slot in bytes.
+        """
+
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.lock = threading.Lock()
+        file_size = _HEADER.size + slots * slot_size
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, _HEADER.size, 0)
+            if (
+                (len(header) != _HEADER.size)
+                or (_HEADER.unpack(header)[:4] != (_MAGIC, _VERSION, slots, slot_size))
+                or (os.fstat(fd).st_size != file_size)
+            ):
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, file_size)
+                os.pwrite(fd, _HEADER.pack(_MAGIC, _VERSION, slots, slot_size, 0), 0)
+            self.buffer = mmap.mmap(fd, file_size)
+        finally:
+            os.close(fd)
+        self.write_count: int = _HEADER.unpack_from(self.buffer, 0)[4]
+
+    @staticmethod
+    def get_path(origin: str) -> str:
+        """Get the path of the ring buffer file of an origin."""
+
+        return os.path.join(
+            LOG_RING_BUFFER_DIR, re.sub(r"[^a-zA-Z0-9_.-]", "_", origin) + ".buffer"
+        )
+
+    @staticmethod
+    def get(origin: str) -> LogRingBuffer:
+        """Get the ring buffer of an origin for writing. There is one
+        instance per origin and process."""
+
+        with LogRingBuffer.instances_lock:
+            if LogRingBuffer.instances_pid != os.getpid():
+                LogRingBuffer.instances_pid = os.getpid()
+                LogRingBuffer.instances = {}
+            if origin not in LogRingBuffer.instances:
+                LogRingBuffer.instances[origin] = LogRingBuffer(LogRingBuffer.get_path(origin))
+            return LogRingBuffer.instances[origin]
+
+    def append(self, record: str) -> None:
+        """Append a record to the buffer, overwriting the oldest record
+        when the buffer is full.
+
+        Args:
+            record:  The formatted record including its details block.
+        """
+
+        payload = record.encode(errors="replace")[: self.slot_size - _SLOT_HEADER.size]
+        with self.lock:
+            offset = _HEADER.size + (self.write_count % self.slots) * self.slot_size
+            _SLOT_HEADER.pack_into(self.buffer, offset, 0, 0)
+            start = offset + _SLOT_HEADER.size
+            self.buffer[start : start + len(payload)] = payload
+            self.write_count += 1
+            _SLOT_HEADER.pack_into(self.buffer, offset, self.write_count, len(payload))
+            _HEADER.pack_into(
+                self.buffer, 0, _MAGIC, _VERSION, self.slots, self.slot_size, self.write_count
+            )
+
+    @staticmethod
+    def read(origin: str, n: int = 200) -> list[str]:
+        """Read the last `n` records of an origin without acquiring any
+        lock. Records that are overwritten while they are read are skipped.
+
+        Args:
+            origin:  The origin of the records.
+            n:       The maximum number of records to return.
+
+        Returns:
+            The records, oldest first. Records longer than a slot are truncated.
+        """
+
+        try:
+            with open(LogRingBuffer.get_path(origin), "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return []
+        with buffer:
+            if len(buffer) < _HEADER.size:
+                return []
+            magic, version, slots, slot_size, write_count = _HEADER.unpack_from(buffer, 0)
+            if (magic != _MAGIC) or (version != _VERSION):
+                return []
+            if len(buffer) < _HEADER.size + slots * slot_size:
+                return []
+
+            records: list[str] = []
+            for sequence_number in range(max(write_count - min(n, slots), 0) + 1, write_count + 1):
+                offset = _HEADER.size + ((sequence_number - 1) % slots) * slot_size
+                slot_sequence_number, length = _SLOT_HEADER.unpack_from(buffer, offset)
+                if (slot_sequence_number != sequence_number) or (
+                    length > slot_size - _SLOT_HEADER.size
+                ):
+                    continue
+                start = offset + _SLOT_HEADER.size
+                payload = buffer[start : start + length]
+                if _SLOT_HEADER.unpack_from(buffer, offset)[0] != sequence_number:
+                    continue
+                records.append(payload.decode(errors="replace"))
+            return records
+
+    @staticmethod
+    def list_origins() -> list[str]:
+        """List the origins that have a ring buffer file."""
+
+        if not os.path.isdir(LOG_RING_BUFFER_DIR):
+            return []
+        return sorted(
+            [
+                filename[: -len(".buffer")]
+                for filename in os.listdir(LOG_RING_BUFFER_DIR)
+                if filename.endswith(".buffer")
+            ]
+        )
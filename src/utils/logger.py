@@ -1,6 +1,12 @@
+from __future__ import annotations
+import atexit
 import time
-from typing import Literal, Optional
+from typing import Callable, Generator, Literal, NamedTuple, Optional, Union
+import multiprocessing.util
 import os
+import queue
+import re
+import threading
 import traceback
 import filelock
 import datetime
@@ -8,11 +14,30 @@ import tum_esm_utils
 
 import src
 from .functions import log_level_is_visible
+from .archive_index import LogArchiveIndexer
+from .log_ring_buffer import LogRingBuffer
+from .archive_rotation import (
+    append_to_archive_file,
+    get_archive_file_path,
+    open_archive_file,
+    open_binary_archive_file,
+)
 from .messaging_agent import MessagingAgent
 
 LOGS_ARCHIVE_DIR = os.path.join(src.constants.DATA_DIR, "logs")
+LOG_LEVELS: list[Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"]] = [
+    "DEBUG",
+    "INFO",
+    "WARNING",
+    "ERROR",
+    "EXCEPTION",
+]
 FILELOCK_PATH = os.path.join(src.constants.DATA_DIR, "logs.lock")
 
+# details can be passed as a callable that is only evaluated when the record is written
+_Details = Optional[Union[str, Callable[[], Optional[str]]]]
+_LOG_RECORD_START = re.compile(rb"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}", re.MULTILINE)
+
 
 def _pad_str_right(
     text: str,
@@ -37,6 +62,41 @@ def _pad_str_right(
         return text + (fill_char * (min_width - len(text)))
 
 
+def _split_log_records(content: bytes) -> list[str]:
+    """Splits the content of a log file into records. Each record starts
+    with its log line and includes its details block. Text in front of
+    the first log line is dropped.
+
+    Args:
+        content:  A part of a log file.
+
+    Returns:
+        The records in the order of the file.
+    """
+
+    starts = [match.start() for match in _LOG_RECORD_START.finditer(content)]
+    return [
+        content[start:end].decode(errors="replace")
+        for start, end in zip(starts, [*starts[1:], len(content)])
+    ]
+
+
+class _LogRecord(NamedTuple):
+    """A formatted log record and the output channels it is written to."""
+
+    timestamp: datetime.datetime
+    origin: str
+    level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"]
+    subject: str
+    log_string: str
+    body: str
+    details: list[tuple[str, str]]
+    console: bool
+    file: bool
+    message: bool
+    structured: bool
+
+
 class Logger:
     """A custom logger class that optionally sends out the logs via
     MQTT and writes them to a file. One can add details to log messages
@@ -46,6 +106,29 @@ class Logger:
     You can give each instance a custom origin to distinguish between
     the sources of the log messages.
 
+    If `config.log_suppression` is set, records with the same origin, level
+    and subject that follow each other within the deduplication window are
+    only written once, followed by one record with the number of repetitions.
+    Like the rate limit below, this is shared by all loggers of an origin in
+    a process. The record is written when the window has passed, on `flush`,
+    or when the process exits. The log messages sent to the backend are limited
+    per origin by a token bucket that all loggers of the origin in a
+    process share, so log storms cannot crowd out measurement data.
+
+    If `config.async_logging` is set, the log records are written by a
+    background thread, so a burst of log messages does not block the
+    calling procedure. Call `flush` to wait until all records have been
+    written; this is done automatically when the process exits.
+
+    The log levels of the output channels are read from the config when
+    the logger is created. Records of levels that no channel writes are
+    dropped without being formatted, and details can be passed as a
+    function so that expensive details are only built when needed:
+
+    ```python
+    logger.debug("new config", details=lambda: config.model_dump_json(indent=4))
+    ```
+
     A simple log message will look like this:
 
     ```
@@ -76,6 +159,33 @@ class Logger:
     ```
     """
 
+    # (second, formatted date and time, formatted UTC offset) of the last record
+    timestamp_cache: tuple[int, str, str] = (-1, "", "")
+
+    # origin -> (tokens, time of the last refill, number of rate limited messages)
+    message_token_buckets: dict[str, tuple[float, float, int]] = {}
+    message_token_lock = threading.Lock()
+    message_token_pid = os.getpid()
+
+    # origin -> (level, subject) -> (start time of the window, number of suppressed
+    # repetitions), in the order of the start times, so expired windows are always
+    # at the front
+    repeated_records: dict[
+        str,
+        dict[
+            tuple[Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"], str],
+            tuple[float, int],
+        ],
+    ] = {}
+    # reentrant because writing a summary may log through another logger
+    repeated_records_lock = threading.RLock()
+    repeated_records_pid = os.getpid()
+    # origin -> logger that writes the pending repetition summaries of this origin
+    loggers_with_repetitions: dict[str, Logger] = {}
+    # origin -> timer that writes the repetition summaries when their window has passed
+    repetitions_timers: dict[str, threading.Timer] = {}
+    repetitions_exit_hook_pid: Optional[int] = None
+
     def __init__(
         self,
         config: src.types.Config,
@@ -90,8 +200,22 @@ class Logger:
 
         self.origin: str = origin
         self.config = config
-        self.filelock = filelock.FileLock(FILELOCK_PATH, timeout=3)
-        self.messaging_agent = MessagingAgent()
+
+        # the levels that at least one output channel writes, records of
+        # all other levels are dropped before they are formatted
+        verbosity = config.logging_verbosity
+        self.visible_levels: set[Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"]] = {
+            level
+            for level in LOG_LEVELS
+            for min_log_level in [
+                verbosity.console_prints,
+                verbosity.file_archive,
+                verbosity.message_sending if (config.backend is not None) else None,
+                verbosity.structured_archive,
+                verbosity.ring_buffer,
+            ]
+            if log_level_is_visible(min_log_level=min_log_level, log_level=level)
+        }
 
     def horizontal_line(
         self,
@@ -108,13 +232,15 @@ class Logger:
     def debug(
         self,
         message: str,
-        details: Optional[str] = None,
+        details: _Details = None,
     ) -> None:
         """Writes a INFO log line.
 
         Args:
             message:  The message to log.
             details:  Additional details to log, useful for verbose output.
+                      Can be a function that returns the details, which is
+                      only called if the record is written to any output.
         """
 
         self._write_log_line("DEBUG", message, details=[("details", details)])
@@ -122,13 +248,15 @@ class Logger:
     def info(
         self,
         message: str,
-        details: Optional[str] = None,
+        details: _Details = None,
     ) -> None:
         """Writes a INFO log line.
 
         Args:
             message:  The message to log.
             details:  Additional details to log, useful for verbose output.
+                      Can be a function that returns the details, which is
+                      only called if the record is written to any output.
         """
 
         self._write_log_line("INFO", message, details=[("details", details)])
@@ -136,23 +264,27 @@ class Logger:
     def warning(
         self,
         message: str,
-        details: Optional[str] = None,
+        details: _Details = None,
     ) -> None:
         """Writes a WARNING log line.
 
         Args:
             message:  The message to log.
             details:  Additional details to log, useful for verbose output.
+                      Can be a function that returns the details, which is
+                      only called if the record is written to any output.
         """
 
         self._write_log_line("WARNING", message, details=[("details", details)])
 
-    def error(self, message: str, details: Optional[str] = None) -> None:
+    def error(self, message: str, details: _Details = None) -> None:
         """Writes an error log line.
 
         Args:
             message:  The message to log.
             details:  Additional details to log, useful for verbose output.
+                      Can be a function that returns the details, which is
+                      only called if the record is written to any output.
         """
 
         self._write_log_line("ERROR", message, details=[("details", details)])
@@ -161,7 +293,7 @@ class Logger:
         self,
         e: Exception,
         label: Optional[str] = None,
-        details: Optional[str] = None,
+        details: _Details = None,
     ) -> None:
         """logs the traceback of an exception, sends the message via
         MQTT when config is passed (required for revision number).
@@ -174,12 +306,13 @@ class Logger:
             label:   A label to prepend to the exception name.
             details: Additional details to log, useful for verbose output
                      like full log of a failed pytest on a new config.
+                     Can be a function like in `Logger.info`.
         """
 
+        if "EXCEPTION" not in self.visible_levels:
+            return
+
         exception_name = traceback.format_exception_only(type(e), e)[0].strip()
-        exception_traceback = "\n".join(
-            traceback.format_exception(type(e), e, e.__traceback__)
-        ).strip()
         exception_details = None
         if isinstance(e, tum_esm_utils.shell.CommandLineException) and (e.details is not None):
             exception_details = e.details.strip()
@@ -193,7 +326,12 @@ class Logger:
             subject,
             details=[
                 ("exception details", exception_details),
-                ("traceback", exception_traceback),
+                (
+                    "traceback",
+                    lambda: "\n".join(
+                        traceback.format_exception(type(e), e, e.__traceback__)
+                    ).strip(),
+                ),
                 ("details", details),
             ],
         )
@@ -202,7 +340,7 @@ class Logger:
         self,
         level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"],
         subject: str,
-        details: list[tuple[str, Optional[str]]] = [],
+        details: list[tuple[str, _Details]] = [],
     ) -> None:
         """Formats the log line string and writes it out to the selected
         output channels.
@@ -211,59 +349,367 @@ class Logger:
         You can set the level of detail you want to see in the console, the
         file archive and the MQTT message stream.
 
+        If `config.log_suppression` is set, repeated records are collapsed
+        and log messages are rate limited before they reach the message
+        queue. If `config.async_logging` is set, the record is only put into
+        the queue of the background writer thread (see `Logger.flush`).
+
+        Records of levels that no output channel writes are dropped right
+        away, and details given as functions are only called when the
+        record is formatted.
+
         Args:
             level:    The log level of the message.
             subject:  The subject of the message.
             details:  Additional details to log, useful for verbose output.
         """
 
+        if level not in self.visible_levels:
+            return
+        if self.config.log_suppression is not None:
+            if self.config.log_suppression.deduplication_window is not None:
+                if self._deduplicate(
+                    level, subject, self.config.log_suppression.deduplication_window
+                ):
+                    return
+        self._emit(level, subject, details)
+
+    def _emit(
+        self,
+        level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"],
+        subject: str,
+        details: list[tuple[str, _Details]] = [],
+    ) -> None:
+        """Writes a log record to the output channels after the deduplication."""
+
+        console = log_level_is_visible(
+            min_log_level=self.config.logging_verbosity.console_prints, log_level=level
+        )
+        file = log_level_is_visible(
+            min_log_level=self.config.logging_verbosity.file_archive, log_level=level
+        )
+        message = log_level_is_visible(
+            min_log_level=self.config.logging_verbosity.message_sending, log_level=level
+        ) and (self.config.backend is not None)
+        if message and (self.config.log_suppression is not None):
+            if self.config.log_suppression.message_rate_limit is not None:
+                message, rate_limited_messages = Logger._take_message_token(
+                    self.origin,
+                    self.config.log_suppression.message_rate_limit,
+                    self.config.log_suppression.message_burst,
+                )
+                if rate_limited_messages > 0:
+                    details = [
+                        *details,
+                        (
+                            "rate limit",
+                            f"{rate_limited_messages} earlier log messages of this "
+                            + "origin were not sent because of the rate limit",
+                        ),
+                    ]
+        structured = log_level_is_visible(
+            min_log_level=self.config.logging_verbosity.structured_archive, log_level=level
+        )
+        ring_buffer = log_level_is_visible(
+            min_log_level=self.config.logging_verbosity.ring_buffer, log_level=level
+        )
+        if not (console or file or message or structured or ring_buffer):
+            return
+
+        record = Logger._format_record(self.origin, level, subject, details)._replace(
+            console=console, file=file, message=message, structured=structured
+        )
+
+        # the ring buffer is written right away so that it is complete when the process dies
+        if ring_buffer:
+            LogRingBuffer.get(self.origin).append(record.log_string + record.body)
+        if not (console or file or message or structured):
+            return
+        if self.config.async_logging is not None:
+            _AsyncLogWriter.get(self.config).enqueue(
+                record, self.config.async_logging.overflow_policy
+            )
+        else:
+            Logger._write_records(
+                [record], MessagingAgent.get_shared(self.config) if record.message else None
+            )
+
+    def _deduplicate(
+        self,
+        level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"],
+        subject: str,
+        window: float,
+    ) -> bool:
+        """Returns whether a record repeats a record of this origin written
+        less than `window` seconds ago and should be suppressed. Writes a
+        record with the number of repetitions for every deduplication window
+        that has passed, and starts a timer that writes it if no other record
+        follows."""
+
+        Logger._check_fork()
+        now = time.time()
+        with Logger.repeated_records_lock:
+            self._write_repetition_summaries(now, window)
+            records = Logger.repeated_records.setdefault(self.origin, {})
+            if (level, subject) in records:
+                window_start, repetitions = records[(level, subject)]
+                records[(level, subject)] = (window_start, repetitions + 1)
+                if repetitions == 0:
+                    self._schedule_repetition_summaries(window_start + window - now)
+                return True
+            records[(level, subject)] = (now, 0)
+            return False
+
+    def _write_repetition_summaries(self, now: float, window: Optional[float]) -> None:
+        """Writes the number of repetitions of the records of this origin
+        whose deduplication window has passed, or of all its records if
+        `window` is `None`. Only the expired windows at the front of
+        `repeated_records` are visited. Must be called while holding
+        `repeated_records_lock`."""
+
+        records = Logger.repeated_records.get(self.origin, {})
+        while len(records) > 0:
+            (level, subject), (window_start, repetitions) = next(iter(records.items()))
+            if (window is not None) and ((now - window_start) < window):
+                break
+            del records[(level, subject)]
+            if repetitions > 0:
+                self._emit(
+                    level,
+                    f"{subject} (repeated {repetitions} times in the last "
+                    + f"{round(now - window_start)} seconds)",
+                )
+        if len(records) == 0:
+            Logger.repeated_records.pop(self.origin, None)
+        if all(repetitions == 0 for _, repetitions in records.values()):
+            Logger.loggers_with_repetitions.pop(self.origin, None)
+
+    def _schedule_repetition_summaries(self, seconds: float) -> None:
+        """Starts a timer that writes the repetition summaries of this origin
+        after `seconds` if none is running, and makes sure that they are
+        written when the process exits. Must be called while holding
+        `repeated_records_lock`."""
+
+        Logger.loggers_with_repetitions[self.origin] = self
+        if Logger.repetitions_exit_hook_pid != os.getpid():
+            Logger.repetitions_exit_hook_pid = os.getpid()
+            # atexit handlers are not run in processes started by multiprocessing;
+            # runs before the log writer and the messaging agent are flushed (priority 100)
+            atexit.register(Logger._write_all_repetition_summaries)
+            multiprocessing.util.Finalize(
+                None, Logger._write_all_repetition_summaries, exitpriority=110
+            )
+        if self.origin not in Logger.repetitions_timers:
+            timer = threading.Timer(max(seconds, 0), self._write_expired_repetition_summaries)
+            timer.daemon = True
+            timer.start()
+            Logger.repetitions_timers[self.origin] = timer
+
+    def _write_expired_repetition_summaries(self) -> None:
+        """Called by the timer of `_schedule_repetition_summaries`."""
+
+        assert self.config.log_suppression is not None
+        window = self.config.log_suppression.deduplication_window
+        assert window is not None
+        now = time.time()
+        with Logger.repeated_records_lock:
+            # the timer may have been replaced while waiting for the lock
+            if Logger.repetitions_timers.get(self.origin) is not threading.current_thread():
+                return
+            del Logger.repetitions_timers[self.origin]
+            self._write_repetition_summaries(now, window)
+            window_starts = [
+                window_start
+                for window_start, repetitions in Logger.repeated_records.get(
+                    self.origin, {}
+                ).values()
+                if repetitions > 0
+            ]
+            if len(window_starts) > 0:
+                self._schedule_repetition_summaries(min(window_starts) + window - now)
+
+    def flush_repetition_summaries(self) -> None:
+        """Writes the number of repetitions of all records of this origin that
+        are currently suppressed, without waiting for their deduplication
+        window to pass."""
+
+        Logger._check_fork()
+        with Logger.repeated_records_lock:
+            timer = Logger.repetitions_timers.pop(self.origin, None)
+            if timer is not None:
+                timer.cancel()
+            self._write_repetition_summaries(time.time(), None)
+
+    @staticmethod
+    def _write_all_repetition_summaries() -> None:
+        """Writes the pending repetition summaries of all origins of this process."""
+
+        for logger in list(Logger.loggers_with_repetitions.values()):
+            logger.flush_repetition_summaries()
+
+    @staticmethod
+    def _check_fork() -> None:
+        """Reset the deduplication state in a process created by `fork`.
+        The repetitions counted in the parent are left to the parent."""
+
+        if Logger.repeated_records_pid != os.getpid():
+            Logger.repeated_records_pid = os.getpid()
+            Logger.repeated_records = {}
+            Logger.repeated_records_lock = threading.RLock()
+            Logger.loggers_with_repetitions = {}
+            Logger.repetitions_timers = {}
+
+    @staticmethod
+    def _take_message_token(origin: str, rate_limit: float, burst: int) -> tuple[bool, int]:
+        """Take a token from the token bucket of the message sending of an
+        origin, which all loggers of this origin in the current process
+        share. The bucket holds up to `burst` tokens and is refilled with
+        `rate_limit` tokens per minute.
+
+        Returns:
+            Whether a token was available and, if so, the number of messages
+            of this origin that have been rate limited since the last token.
+        """
+
+        if Logger.message_token_pid != os.getpid():
+            Logger.message_token_pid = os.getpid()
+            Logger.message_token_lock = threading.Lock()
+        with Logger.message_token_lock:
+            now = time.time()
+            tokens, last_refill_time, rate_limited_messages = Logger.message_token_buckets.get(
+                origin, (burst, now, 0)
+            )
+            tokens = min(burst, tokens + (now - last_refill_time) * rate_limit / 60)
+            if tokens < 1:
+                Logger.message_token_buckets[origin] = (tokens, now, rate_limited_messages + 1)
+                return False, 0
+            Logger.message_token_buckets[origin] = (tokens - 1, now, 0)
+            return True, rate_limited_messages
+
+    def flush(self) -> None:
+        """Writes the pending repetition summaries of this origin (see
+        `flush_repetition_summaries`) and waits until the background writer
+        thread has written all queued log records."""
+
+        self.flush_repetition_summaries()
+        if self.config.async_logging is not None:
+            _AsyncLogWriter.get(self.config).flush()
+
+    @staticmethod
+    def _format_record(
+        origin: str,
+        level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"],
+        subject: str,
+        details: list[tuple[str, _Details]] = [],
+    ) -> _LogRecord:
+        """Formats the log line and the details block of a log record. The
+        record is not written to any output channel yet."""
+
         now = datetime.datetime.now(datetime.timezone.utc)
 
-        # Credits to https://stackoverflow.com/a/35058476/8255842"""
-        utc_offset = round((-time.timezone) / 3600, 3)
+        # the date, time and UTC offset only change once per second
+        second = int(now.timestamp())
+        timestamp_cache = Logger.timestamp_cache
+        if timestamp_cache[0] != second:
+            # Credits to https://stackoverflow.com/a/35058476/8255842"""
+            utc_offset = round((-time.timezone) / 3600, 3)
 
-        if round(utc_offset) == utc_offset:
-            utc_offset = round(utc_offset)
+            if round(utc_offset) == utc_offset:
+                utc_offset = round(utc_offset)
 
+            timestamp_cache = (
+                second,
+                now.strftime("%Y-%m-%d %H:%M:%S"),
+                f"+00 UTC{'' if utc_offset < 0 else '+'}{utc_offset} ",
+            )
+            Logger.timestamp_cache = timestamp_cache
+
+        # same as `str(now)[:-3]`, which omits the microseconds if they are zero
         log_string = (
-            f"{str(now)[:-3]} UTC{'' if utc_offset < 0 else '+'}{utc_offset} "
-            + f"- {_pad_str_right(self.origin, min_width=16)} "
+            timestamp_cache[1]
+            + (f".{now.microsecond:06d}" if now.microsecond > 0 else "")
+            + timestamp_cache[2]
+            + f"- {_pad_str_right(origin, min_width=16)} "
             + f"- {_pad_str_right(level, min_width=9)} "
             + f"- {subject}\n"
         )
-        filtered_details = [(k, v) for k, v in details if v is not None]
+        filtered_details: list[tuple[str, str]] = []
+        for key, value in details:
+            if callable(value):
+                value = value()
+            if value is not None:
+                filtered_details.append((key, value))
         body: str = ""
         for key, value in filtered_details:
             body += _pad_str_right(f"--- {key} ", min_width=40, fill_char="-") + f"\n{value}\n"
         if len(filtered_details) > 0:
             body += "-" * 40 + "\n"
 
+        return _LogRecord(
+            timestamp=now,
+            origin=origin,
+            level=level,
+            subject=subject,
+            log_string=log_string,
+            body=body,
+            details=filtered_details,
+            console=False,
+            file=False,
+            message=False,
+            structured=False,
+        )
+
+    @staticmethod
+    def _write_records(
+        records: list[_LogRecord],
+        messaging_agent: Optional[MessagingAgent],
+    ) -> None:
+        """Writes a batch of log records to their output channels: one print,
+        one lock acquisition for the file archives, and one call to
+        `MessagingAgent.add_messages`."""
+
         # optionally write logs to console
-        if log_level_is_visible(
-            min_log_level=self.config.logging_verbosity.console_prints, log_level=level
-        ):
-            print(log_string + body, end="")
+        console_output = "".join([r.log_string + r.body for r in records if r.console])
+        if len(console_output) > 0:
+            print(console_output, end="")
 
-        # optionally write logs to archive
-        if log_level_is_visible(
-            min_log_level=self.config.logging_verbosity.file_archive, log_level=level
-        ):
-            path = os.path.join(LOGS_ARCHIVE_DIR, now.strftime("%Y-%m-%d.log"))
-            with self.filelock:
-                with open(path, "a") as f1:
-                    f1.write(log_string + body)
+        # optionally write logs to archive and structured archive
+        file_outputs: dict[str, list[str]] = {}
+        for r in records:
+            if r.file:
+                path = os.path.join(LOGS_ARCHIVE_DIR, r.timestamp.strftime("%Y-%m-%d.log"))
+                file_outputs.setdefault(path, []).append(r.log_string + r.body)
+            if r.structured:
+                path = os.path.join(LOGS_ARCHIVE_DIR, r.timestamp.strftime("%Y-%m-%d.jsonl"))
+                file_outputs.setdefault(path, []).append(
+                    src.types.LogArchiveItem(
+                        timestamp=r.timestamp.timestamp(),
+                        origin=r.origin,
+                        level=r.level,
+                        subject=r.subject,
+                        details=dict(r.details),
+                    ).model_dump_json()
+                    + "\n"
+                )
+        if len(file_outputs) > 0:
+            with filelock.FileLock(FILELOCK_PATH, timeout=3):
+                for path, lines in file_outputs.items():
+                    append_to_archive_file(path, "".join(lines).encode())
 
         # optionally send logs via MessagingAgent
-        if log_level_is_visible(
-            min_log_level=self.config.logging_verbosity.message_sending, log_level=level
-        ) and (self.config.backend is not None):
-            self.messaging_agent.add_message(
-                src.types.LogMessageBody(
-                    level=level,
-                    subject=f"{self.origin} - {level} - {subject}",
-                    body=body.strip("\n"),
-                )
+        message_bodies: list[
+            src.types.DataMessageBody | src.types.LogMessageBody | src.types.ConfigMessageBody
+        ] = [
+            src.types.LogMessageBody(
+                level=r.level,
+                subject=f"{r.origin} - {r.level} - {r.subject}",
+                body=r.body.strip("\n"),
             )
+            for r in records
+            if r.message
+        ]
+        if (len(message_bodies) > 0) and (messaging_agent is not None):
+            messaging_agent.add_messages(message_bodies)
 
     @staticmethod
     def read_current_log_file() -> Optional[str]:
@@ -273,13 +719,353 @@ class Logger:
             The content of the current log file.
         """
 
+        return Logger.read_log_file(datetime.datetime.now(datetime.timezone.utc).date())
+
+    @staticmethod
+    def read_log_file(date: datetime.date) -> Optional[str]:
+        """Reads the log file of a specific date and returns its content.
+        Compressed log files (see `ArchiveRotation`) are decompressed
+        transparently.
+
+        Args:
+            date:  The (UTC) date of the log file.
+
+        Returns:
+            The content of the log file or `None` if there is no log file
+            for this date.
+        """
+
         try:
             with filelock.FileLock(FILELOCK_PATH, timeout=3):
-                return tum_esm_utils.files.load_file(
-                    os.path.join(
-                        LOGS_ARCHIVE_DIR,
-                        datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d.log"),
-                    )
-                )
+                with open_archive_file(
+                    os.path.join(LOGS_ARCHIVE_DIR, date.strftime("%Y-%m-%d.log"))
+                ) as f:
+                    return f.read()
         except FileNotFoundError:
             return None
+
+    @staticmethod
+    def iterate_log_archive(
+        start: datetime.datetime,
+        end: datetime.datetime,
+        min_level: Optional[Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"]] = None,
+        origins: Optional[list[str]] = None,
+    ) -> Generator[src.types.LogArchiveItem, None, None]:
+        """Stream the records of the structured log archive in a time range.
+        Only records written while `config.logging_verbosity.structured_archive`
+        was set are included. The index of each day (see `LogArchiveIndexer`)
+        is used to only read the blocks that can contain matching records.
+
+        Args:
+            start:      The start of the time range (inclusive). Naive datetimes
+                        are interpreted as UTC.
+            end:        The end of the time range (exclusive). Naive datetimes
+                        are interpreted as UTC.
+            min_level:  Only yield records of this level or more important ones.
+            origins:    Only yield records of these origins.
+
+        Returns:
+            A generator of log records.
+        """
+
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=datetime.timezone.utc)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=datetime.timezone.utc)
+        start_timestamp, end_timestamp = start.timestamp(), end.timestamp()
+        levels: Optional[list[Literal["DEBUG", "INFO", "WARNING", "ERROR", "EXCEPTION"]]] = (
+            None
+            if min_level is None
+            else [
+                level
+                for level in LOG_LEVELS
+                if log_level_is_visible(min_log_level=min_level, log_level=level)
+            ]
+        )
+
+        date = start.astimezone(datetime.timezone.utc).date()
+        while date <= end.astimezone(datetime.timezone.utc).date():
+            path = os.path.join(LOGS_ARCHIVE_DIR, date.strftime("%Y-%m-%d.jsonl"))
+            index = LogArchiveIndexer.get_index(path)
+            date += datetime.timedelta(days=1)
+            if index is None:
+                continue
+            blocks = LogArchiveIndexer.select_blocks(
+                index,
+                start_timestamp=start_timestamp,
+                end_timestamp=end_timestamp,
+                levels=None if levels is None else list(levels),
+                origins=origins,
+            )
+            for record in LogArchiveIndexer.iterate_blocks(path, blocks):
+                if not (start_timestamp <= record.timestamp < end_timestamp):
+                    continue
+                if (levels is not None) and (record.level not in levels):
+                    continue
+                if (origins is not None) and (record.origin not in origins):
+                    continue
+                yield record
+
+    @staticmethod
+    def tail_log_file(
+        n: int,
+        date: Optional[datetime.date] = None,
+    ) -> list[str]:
+        """Returns the last `n` records of a log file. The file is read
+        backwards from its end in chunks until `n` records have been found,
+        so the time does not depend on the size of the file. The log file
+        lock is not acquired - a record that is still being written is only
+        included up to its last complete line.
+
+        Args:
+            n:     The number of records to return.
+            date:  The (UTC) date of the log file. Defaults to today.
+
+        Returns:
+            The last `n` records including their details blocks, oldest first.
+        """
+
+        if date is None:
+            date = datetime.datetime.now(datetime.timezone.utc).date()
+        path = os.path.join(LOGS_ARCHIVE_DIR, date.strftime("%Y-%m-%d.log"))
+        try:
+            archive_file_path = get_archive_file_path(path)
+        except FileNotFoundError:
+            return []
+        if n <= 0:
+            return []
+
+        # compressed files cannot be read backwards
+        if archive_file_path != path:
+            with open_binary_archive_file(path) as f:
+                return _split_log_records(f.read())[-n:]
+
+        return _split_log_records(Logger._read_log_file_end(path, n)[0])[-n:]
+
+    @staticmethod
+    def _read_log_file_end(path: str, n: int) -> tuple[bytes, int]:
+        """Reads a plain log file backwards in chunks until the content
+        contains at least `n` complete records or the start of the file
+        is reached. Returns the content, which starts at a line boundary
+        and ends after the last complete line, and the file offset at
+        which the content ends."""
+
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return b"", 0
+        with f:
+            position = f.seek(0, os.SEEK_END)
+            content = b""
+            while position > 0:
+                chunk_size = min(65536, position)
+                position -= chunk_size
+                f.seek(position)
+                content = f.read(chunk_size) + content
+                if len(_LOG_RECORD_START.findall(content)) > n:
+                    break
+
+        # drop the possibly cut first line and the incomplete last line
+        if position > 0:
+            first_line_length = content.find(b"\n") + 1
+            position += first_line_length
+            content = content[first_line_length:]
+        content = content[: content.rfind(b"\n") + 1]
+        return content, position + len(content)
+
+    @staticmethod
+    def follow_log_file(
+        n: int = 10,
+        poll_interval: float = 0.5,
+    ) -> Generator[str, None, None]:
+        """Yields the last `n` records of the current log file and then
+        every new record as it is written, like `tail -f`. New records are
+        detected by polling the size of the file every `poll_interval`
+        seconds. At the end of a UTC day, the generator continues with the
+        log file of the new day.
+
+        The log file lock is never acquired, so following the logs does
+        not slow down the writing processes. Only complete lines are read.
+        A record is yielded once the next record has started or once the
+        file has not grown for one `poll_interval`, so records are not cut
+        off in the middle of their details block.
+
+        Args:
+            n:              The number of existing records to yield first.
+            poll_interval:  How many seconds to wait between checking the
+                            file for new records.
+
+        Returns:
+            A generator of records including their details blocks. It only
+            stops when it is closed.
+        """
+
+        date = datetime.datetime.now(datetime.timezone.utc).date()
+        path = os.path.join(LOGS_ARCHIVE_DIR, date.strftime("%Y-%m-%d.log"))
+
+        # complete lines that have not been yielded yet, starting at a record
+        pending, offset = Logger._read_log_file_end(path, n)
+        starts = [match.start() for match in _LOG_RECORD_START.finditer(pending)]
+        pending = pending[starts[max(0, len(starts) - n)] :] if min(n, len(starts)) > 0 else b""
+
+        while True:
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                size = 0
+            if size < offset:
+                # the file has been replaced or truncated
+                offset = 0
+            content = b""
+            if size > offset:
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    content = f.read(size - offset)
+                content = content[: content.rfind(b"\n") + 1]
+                offset += len(content)
+
+            # the last record might still be continued by more detail lines
+            if len(content) > 0:
+                pending += content
+                starts = [match.start() for match in _LOG_RECORD_START.finditer(pending)]
+                if len(starts) > 1:
+                    for record in _split_log_records(pending[: starts[-1]]):
+                        yield record
+                    pending = pending[starts[-1] :]
+                continue
+
+            for record in _split_log_records(pending):
+                yield record
+            pending = b""
+
+            today = datetime.datetime.now(datetime.timezone.utc).date()
+            next_path = os.path.join(LOGS_ARCHIVE_DIR, today.strftime("%Y-%m-%d.log"))
+            if (today != date) and os.path.isfile(next_path):
+                date, path, offset = today, next_path, 0
+                continue
+
+            time.sleep(poll_interval)
+
+
+class _AsyncLogWriter:
+    """The background thread that writes the log records of all `Logger`
+    instances of a process if `config.async_logging` is set.
+
+    Records are put into a bounded queue by the logging threads. The writer
+    thread takes all records that are waiting and writes them in one batch
+    (see `Logger._write_records`). When the queue is full, the records are
+    handled according to `config.async_logging.overflow_policy`.
+
+    There is one writer per process. A process created with `fork` starts
+    its own writer on the first log record instead of using the writer of
+    its parent. When the process exits - also via `sys.exit` in a SIGTERM
+    handler - the writer writes all remaining records before it stops."""
+
+    instance: Optional[_AsyncLogWriter] = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, config: src.types.Config) -> None:
+        assert config.async_logging is not None
+        self.config = config
+        self.pid = os.getpid()
+        self.queue: queue.Queue[Optional[_LogRecord]] = queue.Queue(
+            maxsize=config.async_logging.max_queue_size
+        )
+        self.dropped_records = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name="async-log-writer", daemon=True)
+        self.thread.start()
+
+        # atexit handlers are not run in processes started by multiprocessing
+        atexit.register(self.stop)
+        multiprocessing.util.Finalize(None, self.stop, exitpriority=100)
+
+    @staticmethod
+    def get(config: src.types.Config) -> _AsyncLogWriter:
+        """Get the writer of the current process, start it if necessary."""
+
+        with _AsyncLogWriter.instance_lock:
+            if (
+                (_AsyncLogWriter.instance is None)
+                or (_AsyncLogWriter.instance.pid != os.getpid())
+                or _AsyncLogWriter.instance.stopped
+            ):
+                _AsyncLogWriter.instance = _AsyncLogWriter(config)
+            return _AsyncLogWriter.instance
+
+    def enqueue(
+        self,
+        record: _LogRecord,
+        overflow_policy: Literal["block", "drop_new", "drop_debug"],
+    ) -> None:
+        """Put a record into the queue, apply the overflow policy if it is full."""
+
+        if self.stopped:
+            Logger._write_records(
+                [record], MessagingAgent.get_shared(self.config) if record.message else None
+            )
+            return
+        block = (overflow_policy == "block") or (
+            (overflow_policy == "drop_debug") and (record.level not in ["DEBUG", "INFO"])
+        )
+        try:
+            self.queue.put(record, block=block)
+        except queue.Full:
+            self.dropped_records += 1
+
+    def flush(self) -> None:
+        """Wait until all queued records have been written."""
+
+        if not self.stopped:
+            self.queue.join()
+
+    def stop(self) -> None:
+        """Write all queued records and stop the writer thread."""
+
+        if self.stopped or (self.pid != os.getpid()):
+            return
+        self.stopped = True
+        self.queue.put(None)
+        self.thread.join(timeout=10)
+
+    def _run(self) -> None:
+        while True:
+            records: list[Optional[_LogRecord]] = [self.queue.get()]
+            while len(records) < 1000:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = [r for r in records if r is not None]
+            if self.dropped_records > 0:
+                dropped_records, self.dropped_records = self.dropped_records, 0
+                batch.append(
+                    Logger._format_record(
+                        "async-log-writer",
+                        "WARNING",
+                        f"Dropped {dropped_records} log records because the log queue was full",
+                    )._replace(
+                        console=log_level_is_visible(
+                            self.config.logging_verbosity.console_prints, "WARNING"
+                        ),
+                        file=log_level_is_visible(
+                            self.config.logging_verbosity.file_archive, "WARNING"
+                        ),
+                    )
+                )
+            try:
+                Logger._write_records(
+                    batch,
+                    (
+                        MessagingAgent.get_shared(self.config)
+                        if any([r.message for r in batch])
+                        else None
+                    ),
+                )
+            except Exception:
+                traceback.print_exc()
+            for _ in records:
+                self.queue.task_done()
+            if None in records:
+                return
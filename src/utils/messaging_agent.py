@@ -1,10 +1,18 @@
+from __future__ import annotations
+import atexit
 import json
-from typing import Union, Annotated
+from typing import Generator, Literal, Optional, Union, Annotated
 import datetime
+import multiprocessing.util
 import os
+import time
 import sqlite3
-import filelock
+import threading
 import src
+from .archive_index import MessageArchiveIndexer
+from .archive_rotation import open_archive_file
+from .archive_writer import MessageArchiveWriter
+from .columnar_archive import ColumnarMessageArchive
 
 ACTIVE_QUEUE_FILE: Annotated[
     str,
@@ -27,33 +35,337 @@ MESSAGE_ARCHIVE_DIR_LOCK: Annotated[
     str,
     "The absolute path of the lock file that is used to lock the message archive "
     + "directory (`data/messages.lock`). This is used to make sure that only one "
-    + "process can write to the message archive at a time.",
+    + "process creates a new archive file and writes its header at a time.",
 ] = os.path.join(
     src.constants.DATA_DIR,
     "messages.lock",
 )
 
+ACTIVE_QUEUE_BUSY_TIMEOUT: Annotated[
+    int,
+    "How many milliseconds a connection to the active message queue waits for a lock held "
+    + "by another process before raising a `database is locked` error",
+] = 15_000
+
+ACTIVE_QUEUE_CHECKPOINT_INTERVAL: Annotated[
+    int,
+    "How many seconds to wait between two explicit WAL checkpoints of the active message "
+    + "queue. Checkpoints are run by the process that removes messages from the queue.",
+] = 60
+
+ACTIVE_QUEUE_JOURNAL_SIZE_LIMIT: Annotated[
+    int,
+    "The size in bytes the write-ahead log of the active message queue is truncated to "
+    + "after a checkpoint",
+] = 16 * 1024 * 1024
+
+DEFAULT_MESSAGE_LEASE_DURATION: Annotated[
+    int,
+    "How many seconds a message claimed from the active message queue stays claimed before "
+    + "it can be claimed again, unless the lease is renewed or released",
+] = 120
+
+MESSAGE_CATEGORIES: Annotated[
+    list[Literal["control", "error", "data", "info", "debug"]],
+    "The categories messages in the active queue are grouped into, ordered from the most "
+    + "to the least important: config messages, ERROR/EXCEPTION logs, data messages, "
+    + "INFO/WARNING logs, and DEBUG logs",
+] = ["control", "error", "data", "info", "debug"]
+
+MESSAGE_CATEGORY_WEIGHTS: Annotated[
+    dict[Literal["control", "error", "data", "info", "debug"], int],
+    "How many messages of each category are claimed per round of the fair-share scheduler "
+    + "in `claim_prioritized_messages`. Config messages (`control`) are not part of the "
+    + "rotation, they are always claimed first.",
+] = {"error": 8, "data": 4, "info": 2, "debug": 1}
+
+
+_shared_agent_lock = threading.Lock()
+
+
+def get_message_category(
+    message_body: Union[
+        src.types.DataMessageBody,
+        src.types.LogMessageBody,
+        src.types.ConfigMessageBody,
+    ],
+) -> Literal["control", "error", "data", "info", "debug"]:
+    """Determine the category of a message (see `MESSAGE_CATEGORIES`).
+
+    Args:
+        message_body: The message body.
+
+    Returns:
+        The category of the message.
+    """
+
+    if message_body.variant == "config":
+        return "control"
+    if message_body.variant == "data":
+        return "data"
+    if message_body.level in ["ERROR", "EXCEPTION"]:
+        return "error"
+    if message_body.level in ["INFO", "WARNING"]:
+        return "info"
+    return "debug"
+
 
 class MessagingAgent:
-    def __init__(self) -> None:
+    shared_instance: Optional[MessagingAgent] = None
+
+    def __init__(
+        self,
+        config: Optional[src.types.Config] = None,
+        group_commit_size: Optional[int] = None,
+        group_commit_interval_ms: Optional[int] = None,
+        synchronous: Optional[Literal["OFF", "NORMAL", "FULL", "EXTRA"]] = None,
+    ) -> None:
         """Create a new messaging agent.
 
-        Sets up a connection to the SQLite database that stores the active
-        message queue. Creates the SQL tables if they don't exist yet.
+        The connection to the SQLite database that stores the active message
+        queue is only opened when it is first used (see `connection`). The
+        SQL tables are created then if they don't exist yet. Most code should
+        use the agent shared by the whole process (see `get_shared`) instead
+        of creating a new one.
+
+        The database is written to by all procedures and read from by the
+        backend at the same time. Hence, it uses the write-ahead log (WAL)
+        journal mode so that writers don't block readers and vice versa, and
+        a busy timeout of `ACTIVE_QUEUE_BUSY_TIMEOUT` milliseconds so that
+        concurrent writers wait for each other instead of failing.
+
+        By default, every call to `add_message` writes the message to the
+        archive and the active queue right away. If `group_commit_size` or
+        `group_commit_interval_ms` is set, the agent runs in buffered mode:
+        `add_message` only queues the message in memory, and the queued
+        messages are written in a single batch (one archive write, one SQLite
+        transaction) once `group_commit_size` messages have been queued or
+        the oldest queued message is older than `group_commit_interval_ms`.
+        The size is checked on every call to `add_message`, the interval by
+        a timer thread, so messages of a quiet process are written as well.
+        Call `flush` or `teardown` to write out the remaining messages -
+        this is also done automatically when the process exits, including
+        processes started by `multiprocessing`.
+
+        The message archive is written by a long-lived `MessageArchiveWriter`
+        that keeps the file of the current day open. Its flush interval and
+        durability are configured in `config.message_archive`.
+
+        If `config.message_archive.columnar` is set, data messages are also
+        written to the `ColumnarMessageArchive`.
+
+        Args:
+            config:                    The config object. If this is `None`, the
+                                       default archive settings are used.
+            group_commit_size:         Write the buffered messages once this many
+                                       messages have been queued.
+            group_commit_interval_ms:  Write the buffered messages once the oldest
+                                       queued message is older than this.
+            synchronous:               The SQLite `synchronous` level. "NORMAL" is
+                                       durable across application crashes in WAL mode
+                                       but the last commits might be lost on power
+                                       loss. Use "FULL" to prevent this at the cost
+                                       of one fsync per transaction. If this is `None`,
+                                       `config.message_queue.synchronous` is used.
         """
 
-        self.connection = sqlite3.connect(ACTIVE_QUEUE_FILE, check_same_thread=True)
-        self.message_archive_lock = filelock.FileLock(
+        if synchronous is None:
+            synchronous = "NORMAL" if config is None else config.message_queue.synchronous
+        self.synchronous = synchronous
+        self.pid = os.getpid()
+        self.thread_connections = threading.local()
+        self.open_connections: list[sqlite3.Connection] = []
+        self.open_connections_lock = threading.Lock()
+        self.last_checkpoint_time = time.time()
+        self.archive_writer = MessageArchiveWriter(
+            MESSAGE_ARCHIVE_DIR,
             MESSAGE_ARCHIVE_DIR_LOCK,
-            timeout=5,
+            flush_interval=0 if config is None else config.message_archive.flush_interval,
+            fsync=(config is not None) and config.message_archive.fsync,
+        )
+
+        self.group_commit_size = group_commit_size
+        self.group_commit_interval_ms = group_commit_interval_ms
+        self.columnar_archive = (config is not None) and config.message_archive.columnar
+        self.buffered_messages: list[
+            tuple[
+                float,
+                Union[
+                    src.types.DataMessageBody,
+                    src.types.LogMessageBody,
+                    src.types.ConfigMessageBody,
+                ],
+            ]
+        ] = []
+        self.buffered_mode = (group_commit_size is not None) or (
+            group_commit_interval_ms is not None
         )
+        self.buffer_pid = os.getpid()
+        self.buffer_lock = threading.Lock()
+        self.flush_timer: Optional[threading.Timer] = None
+        if self.buffered_mode:
+            # atexit handlers are not run in processes started by multiprocessing
+            atexit.register(self.flush)
+            multiprocessing.util.Finalize(None, self.flush, exitpriority=100)
+
+    @staticmethod
+    def get_shared(config: Optional[src.types.Config] = None) -> MessagingAgent:
+        """Get the messaging agent shared by all loggers, procedures and
+        backends of the current process. The agent is created on the first
+        call with the given config; later calls return the same agent.
+
+        The agent is safe to use from multiple threads and after a `fork`
+        (see `connection`), so a process created by `multiprocessing`
+        can keep using the agent it inherited from its parent.
+
+        Args:
+            config:  The config object used to create the shared agent.
+
+        Returns:
+            The shared messaging agent.
+        """
+
+        with _shared_agent_lock:
+            if MessagingAgent.shared_instance is None:
+                MessagingAgent.shared_instance = MessagingAgent(config=config)
+            return MessagingAgent.shared_instance
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection to the active message queue of the current thread.
+
+        Connections are opened lazily on first use, one per thread. After a
+        `fork`, the connections of the parent process are dropped without
+        using them, and the child opens its own connections."""
+
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.thread_connections = threading.local()
+            self.open_connections = []
+            self.open_connections_lock = threading.Lock()
+
+        connection: Optional[sqlite3.Connection] = getattr(
+            self.thread_connections, "connection", None
+        )
+        if connection is None:
+            connection = sqlite3.connect(
+                ACTIVE_QUEUE_FILE,
+                check_same_thread=False,
+                timeout=ACTIVE_QUEUE_BUSY_TIMEOUT / 1000,
+            )
+            connection.execute(f"PRAGMA busy_timeout = {ACTIVE_QUEUE_BUSY_TIMEOUT};")
+            connection.execute("PRAGMA journal_mode = WAL;")
+            connection.execute(f"PRAGMA synchronous = {self.synchronous};")
+            connection.execute(f"PRAGMA journal_size_limit = {ACTIVE_QUEUE_JOURNAL_SIZE_LIMIT};")
+            self.thread_connections.connection = connection
+            with self.open_connections_lock:
+                self.open_connections.append(connection)
+            self._setup_schema()
+        return connection
+
+    def _setup_schema(self) -> None:
+        """Create the `QUEUE` table and its indices if they don't exist yet.
+
+        Queues created by older versions of this software don't have the
+        `lease_expiry` and `category` columns yet; they are added in place.
+        The migration runs in an exclusive transaction so that concurrently
+        starting processes don't try to add the columns twice."""
+
         with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE;")
             self.connection.execute(
                 """
                     CREATE TABLE IF NOT EXISTS QUEUE (
                         internal_id INTEGER PRIMARY KEY,
                         timestamp DOUBLE NOT NULL,
-                        message_body TEXT NOT NULL
+                        message_body TEXT NOT NULL,
+                        lease_expiry DOUBLE NOT NULL DEFAULT 0,
+                        category TEXT NOT NULL DEFAULT 'data'
+                    );
+                """
+            )
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(QUEUE);")]
+            if "lease_expiry" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE QUEUE ADD COLUMN lease_expiry DOUBLE NOT NULL DEFAULT 0;"
+                )
+            if "category" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE QUEUE ADD COLUMN category TEXT NOT NULL DEFAULT 'data';"
+                )
+                self.connection.executemany(
+                    "UPDATE QUEUE SET category = ? WHERE internal_id = ?;",
+                    [
+                        (
+                            get_message_category(
+                                src.types.MessageArchiveItem.model_validate(
+                                    {"timestamp": 0, "message_body": json.loads(row[1])}
+                                ).message_body
+                            ),
+                            row[0],
+                        )
+                        for row in self.connection.execute(
+                            "SELECT internal_id, message_body FROM QUEUE;"
+                        ).fetchall()
+                    ],
+                )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS QUEUE_TIMESTAMP_INDEX ON QUEUE (timestamp);"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS QUEUE_CATEGORY_INDEX ON QUEUE (category, timestamp);"
+            )
+
+            # the size of the queue is kept up to date by triggers so that it
+            # does not have to be computed by scanning the whole table
+            self.connection.execute(
+                """
+                    CREATE TABLE IF NOT EXISTS QUEUE_STATISTICS (
+                        id INTEGER PRIMARY KEY CHECK (id = 0),
+                        message_count INTEGER NOT NULL,
+                        message_bytes INTEGER NOT NULL
+                    );
+                """
+            )
+            # the initial size is only computed once, when the table has just been created
+            if (
+                self.connection.execute("SELECT 1 FROM QUEUE_STATISTICS WHERE id = 0;").fetchone()
+                is None
+            ):
+                self.connection.execute(
+                    """
+                        INSERT INTO QUEUE_STATISTICS (id, message_count, message_bytes)
+                        SELECT 0, COUNT(*), COALESCE(SUM(LENGTH(CAST(message_body AS BLOB))), 0)
+                        FROM QUEUE;
+                    """
+                )
+            self.connection.execute(
+                """
+                    CREATE TRIGGER IF NOT EXISTS QUEUE_INSERT_TRIGGER AFTER INSERT ON QUEUE
+                    BEGIN
+                        UPDATE QUEUE_STATISTICS SET
+                            message_count = message_count + 1,
+                            message_bytes = message_bytes + LENGTH(CAST(NEW.message_body AS BLOB))
+                        WHERE id = 0;
+                    END;
+                """
+            )
+            self.connection.execute(
+                """
+                    CREATE TRIGGER IF NOT EXISTS QUEUE_DELETE_TRIGGER AFTER DELETE ON QUEUE
+                    BEGIN
+                        UPDATE QUEUE_STATISTICS SET
+                            message_count = message_count - 1,
+                            message_bytes = message_bytes - LENGTH(CAST(OLD.message_body AS BLOB))
+                        WHERE id = 0;
+                    END;
+                """
+            )
+            self.connection.execute(
+                """
+                    CREATE TABLE IF NOT EXISTS QUEUE_DROPS (
+                        category TEXT PRIMARY KEY,
+                        count INTEGER NOT NULL
                     );
                 """
             )
@@ -70,31 +382,138 @@ class MessagingAgent:
         Messages are written to the archive right away so they don't get lost
         if the backend process fails to send them out.
 
+        In buffered mode, the message is only queued in memory and written
+        together with other messages (see `__init__`).
+
         Args:
             message_body: The message body.
         """
 
-        timestamp = datetime.datetime.now(datetime.timezone.utc).timestamp()
-        message_body_string = message_body.model_dump_json()
+        if not self.buffered_mode:
+            self.add_messages([message_body])
+            return
 
-        # write message to archive
-        archive_file = MessagingAgent.get_message_archive_file()
-        with self.message_archive_lock:
-            if not os.path.isfile(archive_file):
-                with open(archive_file, "w") as f:
-                    f.write("timestamp,message_body\n")
-            with open(archive_file, "a") as f:
-                csv_message_body_string = message_body_string.replace('"', '""')
-                f.write(f'{timestamp},"{csv_message_body_string}"\n')
+        self._reset_buffer_after_fork()
+        with self.buffer_lock:
+            self.buffered_messages.append(
+                (datetime.datetime.now(datetime.timezone.utc).timestamp(), message_body)
+            )
+            if (self.group_commit_size is not None) and (
+                len(self.buffered_messages) >= self.group_commit_size
+            ):
+                self._flush()
+            elif (self.group_commit_interval_ms is not None) and (self.flush_timer is None):
+                self.flush_timer = threading.Timer(self.group_commit_interval_ms / 1000, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def add_messages(
+        self,
+        message_bodies: list[
+            Union[
+                src.types.DataMessageBody,
+                src.types.LogMessageBody,
+                src.types.ConfigMessageBody,
+            ]
+        ],
+    ) -> None:
+        """Add multiple messages to the active message queue and the message
+        archive at once. All messages are written with a single write to the
+        archive file and a single SQLite transaction.
+
+        Args:
+            message_bodies: The message bodies.
+        """
 
-        # add message to active message queue
+        self._write_messages(
+            [
+                (datetime.datetime.now(datetime.timezone.utc).timestamp(), message_body)
+                for message_body in message_bodies
+            ]
+        )
+
+    def flush(self) -> None:
+        """Write all messages that are buffered in memory to the message
+        archive and the active message queue. Does nothing if the agent
+        does not run in buffered mode or no messages are buffered."""
+
+        self._reset_buffer_after_fork()
+        with self.buffer_lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        """Write the buffered messages, the caller has to hold `buffer_lock`.
+        The messages are written within the lock, so concurrent flushes
+        cannot reorder them."""
+
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        messages = self.buffered_messages
+        self.buffered_messages = []
+        self._write_messages(messages)
+
+    def _reset_buffer_after_fork(self) -> None:
+        """Reset the message buffer in a process created by `fork`. The
+        messages buffered in the parent are left to the parent to write,
+        and the inherited lock and timer are replaced. Finalizers of the
+        parent are not run in the child, so the exit flush is registered
+        again."""
+
+        if self.buffer_pid != os.getpid():
+            self.buffer_pid = os.getpid()
+            self.buffer_lock = threading.Lock()
+            self.buffered_messages = []
+            self.flush_timer = None
+            if self.buffered_mode:
+                multiprocessing.util.Finalize(None, self.flush, exitpriority=100)
+
+    def _write_messages(
+        self,
+        messages: list[
+            tuple[
+                float,
+                Union[
+                    src.types.DataMessageBody,
+                    src.types.LogMessageBody,
+                    src.types.ConfigMessageBody,
+                ],
+            ]
+        ],
+    ) -> None:
+        """Write a batch of messages to the archive(s) and the queue.
+
+        Args:
+            messages: A list of `(timestamp, message_body)` tuples.
+        """
+
+        if len(messages) == 0:
+            return
+        rows = [
+            (timestamp, message_body.model_dump_json(), get_message_category(message_body))
+            for timestamp, message_body in messages
+        ]
+
+        # write messages to archive
+        self.archive_writer.write([(timestamp, body) for timestamp, body, _ in rows])
+
+        # add messages to active message queue
         with self.connection:
-            self.connection.execute(
+            self.connection.executemany(
                 """
-                    INSERT INTO QUEUE (timestamp, message_body)
-                    VALUES (?, ?);
+                    INSERT INTO QUEUE (timestamp, message_body, category)
+                    VALUES (?, ?, ?);
                 """,
-                (timestamp, message_body_string),
+                rows,
+            )
+
+        if self.columnar_archive:
+            ColumnarMessageArchive.append(
+                [
+                    (timestamp, message_body)
+                    for timestamp, message_body in messages
+                    if message_body.variant == "data"
+                ]
             )
 
     def get_n_latest_messages(
@@ -104,6 +523,10 @@ class MessagingAgent:
     ) -> list[src.types.MessageQueueItem]:
         """Get the `n` latest messages from the active message queue.
 
+        This does not claim the messages and the cost of excluding message
+        IDs grows with the number of excluded IDs. Consumers that process
+        messages should use `claim_n_latest_messages` instead.
+
         Args:
             n:                    The number of messages to get.
             excluded_message_ids: The message IDs to exclude from the result. Can be
@@ -137,6 +560,180 @@ class MessagingAgent:
             for result in results
         ]
 
+    def claim_n_latest_messages(
+        self,
+        n: int,
+        lease_duration: float = DEFAULT_MESSAGE_LEASE_DURATION,
+    ) -> list[src.types.MessageQueueItem]:
+        """Claim the `n` latest messages from the active message queue that
+        are not claimed by anyone else.
+
+        A claimed message is not returned by this function again until its
+        lease expires or it is released with `release_messages`. Use
+        `renew_message_leases` to keep messages claimed that are still
+        being processed. Selecting and claiming the messages happens in a
+        single transaction, so two concurrent calls never return the same
+        message. Because the queue is indexed by timestamp, the cost of this
+        function only depends on `n` and the number of currently claimed
+        messages, not on the total size of the queue.
+
+        Args:
+            n:               The number of messages to claim.
+            lease_duration:  How many seconds the messages stay claimed.
+
+        Returns:
+            A list of messages from the active queue.
+        """
+
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE;")
+            results = self.connection.execute(
+                """
+                    SELECT internal_id, timestamp, message_body
+                    FROM QUEUE
+                    WHERE lease_expiry < ?
+                    ORDER BY timestamp ASC
+                    LIMIT ?;
+                """,
+                (now, n),
+            ).fetchall()
+            mids_placeholder = ",".join(["?"] * len(results))
+            self.connection.execute(
+                f"""
+                    UPDATE QUEUE
+                    SET lease_expiry = ?
+                    WHERE internal_id IN ({mids_placeholder});
+                """,
+                (now + lease_duration, *[result[0] for result in results]),
+            )
+        return [
+            src.types.MessageQueueItem(
+                identifier=result[0],
+                timestamp=result[1],
+                message_body=json.loads(result[2]),
+            )
+            for result in results
+        ]
+
+    def claim_prioritized_messages(
+        self,
+        n: int,
+        lease_duration: float = DEFAULT_MESSAGE_LEASE_DURATION,
+    ) -> list[src.types.MessageQueueItem]:
+        """Claim up to `n` unclaimed messages from the active message queue,
+        prioritized by their category (see `MESSAGE_CATEGORIES`).
+
+        Each category is a separate lane that is served oldest-first. Config
+        messages are always claimed first. The remaining slots are shared
+        between the other lanes by a weighted round-robin: in each round,
+        every lane gets to claim up to `MESSAGE_CATEGORY_WEIGHTS[category]`
+        messages, starting with the most important lane. Slots that a lane
+        cannot fill are passed on to the other lanes. Hence, config messages
+        and error logs are sent out right away even when there is a backlog
+        of hours of data, but no lane is starved completely.
+
+        Like `claim_n_latest_messages`, selecting and claiming the messages
+        happens in a single transaction and the cost only depends on `n`.
+
+        Args:
+            n:               The number of messages to claim.
+            lease_duration:  How many seconds the messages stay claimed.
+
+        Returns:
+            A list of messages from the active queue, ordered by priority.
+        """
+
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE;")
+            lanes: dict[str, list[tuple[int, float, str]]] = {}
+            for lane in MESSAGE_CATEGORIES:
+                lanes[lane] = self.connection.execute(
+                    """
+                        SELECT internal_id, timestamp, message_body
+                        FROM QUEUE
+                        WHERE category = ? AND lease_expiry < ?
+                        ORDER BY timestamp ASC
+                        LIMIT ?;
+                    """,
+                    (lane, now, n),
+                ).fetchall()
+
+            results = lanes["control"][:n]
+            lane_positions = {lane: 0 for lane in MESSAGE_CATEGORY_WEIGHTS.keys()}
+            while len(results) < n:
+                claimed_in_round = 0
+                for lane, weight in MESSAGE_CATEGORY_WEIGHTS.items():
+                    position = lane_positions[lane]
+                    batch = lanes[lane][position : position + min(weight, n - len(results))]
+                    results += batch
+                    lane_positions[lane] += len(batch)
+                    claimed_in_round += len(batch)
+                if claimed_in_round == 0:
+                    break
+
+            mids_placeholder = ",".join(["?"] * len(results))
+            self.connection.execute(
+                f"""
+                    UPDATE QUEUE
+                    SET lease_expiry = ?
+                    WHERE internal_id IN ({mids_placeholder});
+                """,
+                (now + lease_duration, *[result[0] for result in results]),
+            )
+        return [
+            src.types.MessageQueueItem(
+                identifier=result[0],
+                timestamp=result[1],
+                message_body=json.loads(result[2]),
+            )
+            for result in results
+        ]
+
+    def renew_message_leases(
+        self,
+        message_ids: set[int] | list[int],
+        lease_duration: float = DEFAULT_MESSAGE_LEASE_DURATION,
+    ) -> None:
+        """Extend the lease of claimed messages that are still being processed.
+
+        Args:
+            message_ids:     The message IDs to renew the lease for.
+            lease_duration:  How many seconds from now the messages stay claimed.
+        """
+
+        with self.connection:
+            mids_placeholder = ",".join(["?"] * len(message_ids))
+            self.connection.execute(
+                f"""
+                    UPDATE QUEUE
+                    SET lease_expiry = ?
+                    WHERE internal_id IN ({mids_placeholder});
+                """,
+                (time.time() + lease_duration, *message_ids),
+            )
+
+    def release_messages(self, message_ids: set[int] | list[int]) -> None:
+        """Release claimed messages so that they can be claimed again right
+        away, e.g. when the connection to the backend was lost before they
+        have been sent out.
+
+        Args:
+            message_ids: The message IDs to be released.
+        """
+
+        with self.connection:
+            mids_placeholder = ",".join(["?"] * len(message_ids))
+            self.connection.execute(
+                f"""
+                    UPDATE QUEUE
+                    SET lease_expiry = 0
+                    WHERE internal_id IN ({mids_placeholder});
+                """,
+                (*message_ids,),
+            )
+
     def remove_messages(self, message_ids: set[int] | list[int]) -> None:
         """Remove messages from the active message queue.
 
@@ -154,6 +751,141 @@ class MessagingAgent:
                 (*message_ids,),
             )
 
+        if (time.time() - self.last_checkpoint_time) > ACTIVE_QUEUE_CHECKPOINT_INTERVAL:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """Copy the content of the write-ahead log back into the database.
+
+        SQLite runs these checkpoints automatically when the WAL grows
+        beyond 1000 pages. Running them periodically from the consuming
+        process keeps the WAL small between bursts. The checkpoint is
+        passive, i.e. it never blocks concurrent readers or writers."""
+
+        self.connection.execute("PRAGMA wal_checkpoint(PASSIVE);")
+        self.last_checkpoint_time = time.time()
+
+    def get_queue_statistics(self) -> src.types.MessageQueueStatistics:
+        """Get the current size of the active message queue and the number
+        of messages that have been dropped from it because of its size limits.
+
+        Returns:
+            The statistics of the active message queue.
+        """
+
+        with self.connection:
+            message_count, message_bytes = self.connection.execute(
+                "SELECT message_count, message_bytes FROM QUEUE_STATISTICS WHERE id = 0;"
+            ).fetchone()
+            dropped_messages = dict(
+                self.connection.execute("SELECT category, count FROM QUEUE_DROPS;").fetchall()
+            )
+        return src.types.MessageQueueStatistics(
+            message_count=message_count,
+            message_bytes=message_bytes,
+            dropped_messages=dropped_messages,
+        )
+
+    def enforce_queue_limits(
+        self,
+        max_messages: Optional[int],
+        max_bytes: Optional[int],
+        policy: Literal["drop_oldest", "drop_by_category", "downsample_data"],
+    ) -> dict[str, int]:
+        """Drop messages from the active message queue until it holds at most
+        `max_messages` messages and `max_bytes` bytes of message bodies.
+
+        Dropped messages are only removed from the active queue, they are
+        still in the message archive. Messages that are currently claimed by
+        a backend are never dropped.
+
+        Policies:
+
+        * `drop_oldest`: Drop the oldest messages first.
+        * `drop_by_category`: Drop the oldest messages of the least important
+          category first (see `MESSAGE_CATEGORIES`), i.e., DEBUG logs before
+          INFO/WARNING logs before data messages, etc.
+        * `downsample_data`: Remove every second message of the oldest data
+          messages, i.e., reduce the time resolution of the backlog. Drops the
+          oldest messages when there is no data to downsample anymore.
+
+        Args:
+            max_messages:  The maximum number of messages in the queue.
+            max_bytes:     The maximum size of all message bodies in the queue.
+            policy:        Which messages to drop first.
+
+        Returns:
+            The number of dropped messages per category.
+        """
+
+        dropped_messages: dict[str, int] = {}
+        now = time.time()
+
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE;")
+            while True:
+                message_count, message_bytes = self.connection.execute(
+                    "SELECT message_count, message_bytes FROM QUEUE_STATISTICS WHERE id = 0;"
+                ).fetchone()
+                excess_messages = 0 if max_messages is None else message_count - max_messages
+                excess_bytes = 0 if max_bytes is None else message_bytes - max_bytes
+                if (excess_messages <= 0) and (excess_bytes <= 0):
+                    break
+
+                # candidates are (internal_id, category, size) tuples in the order of dropping
+                candidates: list[tuple[int, str, int]] = []
+                chunk_size = max(excess_messages, 1000)
+                query = """
+                    SELECT internal_id, category, LENGTH(CAST(message_body AS BLOB))
+                    FROM QUEUE
+                    WHERE lease_expiry < ? {}
+                    ORDER BY timestamp ASC
+                    LIMIT ?;
+                """
+                if policy == "drop_by_category":
+                    for dropped_category in reversed(MESSAGE_CATEGORIES):
+                        candidates = self.connection.execute(
+                            query.format("AND category = ?"),
+                            (now, dropped_category, chunk_size),
+                        ).fetchall()
+                        if len(candidates) > 0:
+                            break
+                if policy == "downsample_data":
+                    candidates = self.connection.execute(
+                        query.format("AND category = 'data'"), (now, 2 * chunk_size)
+                    ).fetchall()[1::2]
+                if len(candidates) == 0:
+                    candidates = self.connection.execute(
+                        query.format(""), (now, chunk_size)
+                    ).fetchall()
+                if len(candidates) == 0:
+                    break
+
+                dropped_ids: list[int] = []
+                for internal_id, category, size in candidates:
+                    if (excess_messages <= 0) and (excess_bytes <= 0):
+                        break
+                    dropped_ids.append(internal_id)
+                    dropped_messages[category] = dropped_messages.get(category, 0) + 1
+                    excess_messages -= 1
+                    excess_bytes -= size
+
+                mids_placeholder = ",".join(["?"] * len(dropped_ids))
+                self.connection.execute(
+                    f"DELETE FROM QUEUE WHERE internal_id IN ({mids_placeholder});",
+                    dropped_ids,
+                )
+
+            self.connection.executemany(
+                """
+                    INSERT INTO QUEUE_DROPS (category, count) VALUES (?, ?)
+                    ON CONFLICT (category) DO UPDATE SET count = count + excluded.count;
+                """,
+                list(dropped_messages.items()),
+            )
+
+        return dropped_messages
+
     @staticmethod
     def get_message_archive_file() -> str:
         """Get the file path of the message archive file for the current date."""
@@ -164,14 +896,29 @@ class MessagingAgent:
         )
 
     def teardown(self) -> None:
-        """Close the connection to the active message queue database."""
+        """Write out all buffered messages and close the message archive
+        file and all connections to the active message queue database. The
+        agent can still be used afterwards, it reopens them on demand."""
 
-        self.connection.close()
+        if self.buffered_mode:
+            self.flush()
+            atexit.unregister(self.flush)
+        self.archive_writer.close()
+        with self.open_connections_lock:
+            if self.pid == os.getpid():
+                for connection in self.open_connections:
+                    connection.close()
+            self.open_connections = []
+        self.thread_connections = threading.local()
 
     @staticmethod
     def load_message_archive(date: datetime.date) -> list[src.types.MessageArchiveItem]:
         """Load the message archive for a specific date.
 
+        This loads the whole day into memory. Use `iterate_message_archive`
+        to process large archives or multiple days in constant memory. Compressed
+        archive files (see `ArchiveRotation`) are decompressed transparently.
+
         Args:
             date: The date for which to load the message archive.
 
@@ -179,22 +926,152 @@ class MessagingAgent:
             A list of messages from the message archive.
         """
 
-        path = os.path.join(MESSAGE_ARCHIVE_DIR, date.strftime("%Y-%m-%d.csv"))
-        results: list[src.types.MessageArchiveItem] = []
-        if os.path.isfile(path):
-            with open(path, "r") as f:
-                lines = f.read().strip(" \n").split("\n")[1:]
-
-            for line in lines:
-                line_parts = line.split(",")
-                assert len(line_parts) >= 2
-                timestamp = line_parts[0]
-                message_body = ",".join(line_parts[1:]).replace('""', '"')[1:-1]
-                results.append(
-                    src.types.MessageArchiveItem(
-                        timestamp=float(timestamp),
-                        message_body=json.loads(message_body),
-                    )
-                )
+        return [
+            src.types.MessageArchiveItem(
+                timestamp=timestamp,
+                message_body=json.loads(message_body),
+            )
+            for timestamp, message_body in MessagingAgent._iterate_archive_file(date)
+        ]
+
+    @staticmethod
+    def _iterate_archive_file(date: datetime.date) -> Generator[tuple[float, str], None, None]:
+        """Yield the `(timestamp, message_body_string)` tuples of one archive file line by line."""
+
+        try:
+            f = open_archive_file(os.path.join(MESSAGE_ARCHIVE_DIR, date.strftime("%Y-%m-%d.csv")))
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                line = line.strip(" \n")
+                # compressed files can contain multiple headers (see `ArchiveRotation`)
+                if (len(line) == 0) or line.startswith("timestamp,"):
+                    continue
+                timestamp, message_body = line.split(",", 1)
+                yield float(timestamp), message_body[1:-1].replace('""', '"')
+
+    @staticmethod
+    def iterate_raw_message_archive(
+        start: datetime.datetime,
+        end: datetime.datetime,
+        variants: Optional[list[Literal["data", "log", "config"]]] = None,
+    ) -> Generator[tuple[float, str], None, None]:
+        """Stream the messages from the message archive in a time range without
+        parsing them. Messages are read block by block across day boundaries,
+        so the memory usage does not depend on the size of the archive. Only
+        the blocks whose index entry matches the query are read (see
+        `MessageArchiveIndexer`).
+
+        Args:
+            start:     The start of the time range (inclusive). Naive datetimes
+                       are interpreted as UTC.
+            end:       The end of the time range (exclusive). Naive datetimes
+                       are interpreted as UTC.
+            variants:  Only yield messages of these variants. If this is `None`,
+                       messages of all variants are yielded.
+
+        Returns:
+            A generator of `(timestamp, message_body_json_string)` tuples.
+        """
 
-        return results
+        return MessagingAgent._iterate_indexed_archive(start, end, variants)
+
+    @staticmethod
+    def _iterate_indexed_archive(
+        start: datetime.datetime,
+        end: datetime.datetime,
+        variants: Optional[list[Literal["data", "log", "config"]]] = None,
+        data_keys: Optional[list[str]] = None,
+    ) -> Generator[tuple[float, str], None, None]:
+        """Implementation of `iterate_raw_message_archive` that only reads the
+        blocks of each day that can contain matching messages, according to
+        the day's index (see `MessageArchiveIndexer`). If `data_keys` is given,
+        blocks without any of these keys are skipped as well."""
+
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=datetime.timezone.utc)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=datetime.timezone.utc)
+        start_timestamp, end_timestamp = start.timestamp(), end.timestamp()
+        variant_snippets = [f'"variant":"{variant}"' for variant in (variants or [])]
+
+        date = start.astimezone(datetime.timezone.utc).date()
+        while date <= end.astimezone(datetime.timezone.utc).date():
+            path = os.path.join(MESSAGE_ARCHIVE_DIR, date.strftime("%Y-%m-%d.csv"))
+            index = MessageArchiveIndexer.get_index(path)
+            date += datetime.timedelta(days=1)
+            if index is None:
+                continue
+            blocks = MessageArchiveIndexer.select_blocks(
+                index,
+                start_timestamp=start_timestamp,
+                end_timestamp=end_timestamp,
+                variants=None if variants is None else list(variants),
+                data_keys=data_keys,
+            )
+            for timestamp, message_body in MessageArchiveIndexer.iterate_blocks(path, blocks):
+                if not (start_timestamp <= timestamp < end_timestamp):
+                    continue
+                if variants is not None:
+                    # the snippet is a cheap pre-filter, but it can also occur inside
+                    # the body of a message of another variant (e.g. a log message)
+                    if not any([snippet in message_body for snippet in variant_snippets]):
+                        continue
+                    if json.loads(message_body).get("variant") not in variants:
+                        continue
+                yield timestamp, message_body
+
+    @staticmethod
+    def iterate_message_archive(
+        start: datetime.datetime,
+        end: datetime.datetime,
+        variants: Optional[list[Literal["data", "log", "config"]]] = None,
+        data_keys: Optional[list[str]] = None,
+    ) -> Generator[src.types.MessageArchiveItem, None, None]:
+        """Stream the messages from the message archive in a time range. Messages
+        are read block by block across day boundaries, so the memory usage does
+        not depend on the size of the archive. Blocks that contain no messages
+        of the requested variants and data keys are skipped using the index of
+        each day (see `MessageArchiveIndexer`).
+
+        Usage:
+
+        ```python
+        for message in MessagingAgent.iterate_message_archive(
+            start=datetime.datetime(2024, 1, 1),
+            end=datetime.datetime(2024, 2, 1),
+            variants=["data"],
+            data_keys=["temperature"],
+        ):
+            print(message.timestamp, message.message_body.data["temperature"])
+        ```
+
+        Args:
+            start:      The start of the time range (inclusive). Naive datetimes
+                        are interpreted as UTC.
+            end:        The end of the time range (exclusive). Naive datetimes
+                        are interpreted as UTC.
+            variants:   Only yield messages of these variants. If this is `None`,
+                        messages of all variants are yielded.
+            data_keys:  Only keep these keys in the data of data messages. Data
+                        messages that contain none of these keys are skipped. If
+                        this is `None`, data messages are not filtered.
+
+        Returns:
+            A generator of messages from the message archive.
+        """
+
+        for timestamp, message_body in MessagingAgent._iterate_indexed_archive(
+            start, end, variants, data_keys
+        ):
+            message = src.types.MessageArchiveItem(
+                timestamp=timestamp,
+                message_body=json.loads(message_body),
+            )
+            if (data_keys is not None) and (message.message_body.variant == "data"):
+                data = {k: v for k, v in message.message_body.data.items() if k in data_keys}
+                if len(data) == 0:
+                    continue
+                message.message_body.data = data
+            yield message
@@ -0,0 +1,264 @@
+from __future__ import annotations
+from typing import Annotated, Optional
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import src
+
+STATE_HISTORY_DIR: Annotated[
+    str,
+    "The absolute path of the directory that stores the history of state fields "
+    + "(`data/state-history/`)",
+] = os.path.join(src.constants.DATA_DIR, "state-history")
+
+STATE_HISTORY_TIERS: Annotated[
+    list[tuple[str, Optional[int], int]],
+    "The tiers of the state history: `(name, bucket size in seconds, number of records)`. "
+    + "The first tier stores every value, the other tiers one aggregate per bucket. "
+    + "By default, the last 10000 values, 7 days of minutes and one year of hours are kept.",
+] = [("raw", None, 10000), ("1m", 60, 7 * 24 * 60), ("1h", 3600, 365 * 24)]
+
+# magic, capacity, number of written records, sequence number (odd while writing)
+_HEADER = struct.Struct("<8sQQQ")
+_MAGIC = b"IVYHIST1"
+
+# bucket start (or timestamp), sum, min, max, count
+_RECORD = struct.Struct("<ddddd")
+
+
+class _HistoryTier:
+    """One ring file of fixed-width records of a `StateHistory`."""
+
+    def __init__(self, path: str, bucket_size: Optional[int], capacity: int) -> None:
+        self.path = path
+        self.bucket_size = bucket_size
+        self.capacity = capacity
+        file_size = _HEADER.size + capacity * _RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, _HEADER.size, 0)
+            if (
+                (len(header) != _HEADER.size)
+                or (_HEADER.unpack(header)[:2] != (_MAGIC, capacity))
+                or (os.fstat(fd).st_size != file_size)
+            ):
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, file_size)
+                os.pwrite(fd, _HEADER.pack(_MAGIC, capacity, 0, 0), 0)
+            self.buffer = mmap.mmap(fd, file_size)
+        finally:
+            os.close(fd)
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Add a value. In aggregated tiers, the value is added to the last
+        record if it belongs to the same bucket, otherwise a new record is
+        started. The caller has to make sure that there is only one writer."""
+
+        _, _, count, sequence_number = _HEADER.unpack_from(self.buffer, 0)
+        record: tuple[float, float, float, float, float] = (timestamp, value, value, value, 1)
+        index = count
+        if self.bucket_size is not None:
+            bucket_start = math.floor(timestamp / self.bucket_size) * self.bucket_size
+            record = (bucket_start, value, value, value, 1)
+            if count > 0:
+                last = _RECORD.unpack_from(self.buffer, self._offset(count - 1))
+                if last[0] == bucket_start:
+                    index = count - 1
+                    record = (
+                        bucket_start,
+                        last[1] + value,
+                        min(last[2], value),
+                        max(last[3], value),
+                        last[4] + 1,
+                    )
+
+        _HEADER.pack_into(self.buffer, 0, _MAGIC, self.capacity, count, sequence_number + 1)
+        _RECORD.pack_into(self.buffer, self._offset(index), *record)
+        _HEADER.pack_into(
+            self.buffer, 0, _MAGIC, self.capacity, max(count, index + 1), sequence_number + 2
+        )
+
+    def read(
+        self,
+        start: float = -math.inf,
+        end: float = math.inf,
+    ) -> list[tuple[float, float, float, float, float]]:
+        """Read the records with `start <= timestamp < end` that are still
+        in the ring, oldest first, without acquiring a lock. The first
+        record is found with a binary search, so the time only depends on
+        the number of returned records."""
+
+        deadline = time.monotonic() + 1
+        while True:
+            _, _, count, sequence_number = _HEADER.unpack_from(self.buffer, 0)
+            if sequence_number % 2 == 0:
+                low, high = max(count - self.capacity, 0), count
+                while low < high:
+                    middle = (low + high) // 2
+                    if _RECORD.unpack_from(self.buffer, self._offset(middle))[0] < start:
+                        low = middle + 1
+                    else:
+                        high = middle
+                records: list[tuple[float, float, float, float, float]] = []
+                for i in range(low, count):
+                    record = _RECORD.unpack_from(self.buffer, self._offset(i))
+                    if record[0] >= end:
+                        break
+                    records.append(record)
+                if _HEADER.unpack_from(self.buffer, 0)[3] == sequence_number:
+                    return records
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Could not read a consistent history from {self.path}")
+            time.sleep(0.0001)
+
+    def covers(self, start: float) -> bool:
+        """Returns whether the ring has not overwritten any record newer than `start`."""
+
+        _, _, count, _ = _HEADER.unpack_from(self.buffer, 0)
+        if count <= self.capacity:
+            return True
+        oldest_record = _RECORD.unpack_from(self.buffer, self._offset(count - self.capacity))
+        return float(oldest_record[0]) <= start
+
+    def _offset(self, index: int) -> int:
+        return _HEADER.size + (index % self.capacity) * _RECORD.size
+
+
+class StateHistory:
+    """The recorded values of one numeric state field (see
+    `config.state_history`).
+
+    Every value is stored in fixed-width records of five little-endian
+    64 bit floats in memory-mapped ring files, one per tier of
+    `STATE_HISTORY_TIERS`: `data/state-history/<field>.<tier>.bin`. The
+    first tier stores each value with its timestamp, the other tiers the
+    sum, minimum, maximum and count per minute and per hour. The files
+    have a fixed size, so the oldest records are overwritten.
+
+    Queries read the finest tier that still covers the requested time
+    range, so statistics over long ranges only read a few hundred records.
+    Reads are lock-free like in the `StateStore`, writes happen within
+    the state lock of the `StateInterface`."""
+
+    instances: dict[str, StateHistory] = {}
+    instances_lock = threading.Lock()
+    instances_pid = os.getpid()
+
+    def __init__(self, field: str) -> None:
+        """Open or create the history files of a state field.
+
+        Args:
+            field:  The path of the state field, e.g. `system.last_5_min_load`.
+        """
+
+        self.field = field
+        os.makedirs(STATE_HISTORY_DIR, exist_ok=True)
+        self.tiers = [
+            _HistoryTier(
+                os.path.join(STATE_HISTORY_DIR, f"{field}.{name}.bin"), bucket_size, capacity
+            )
+            for name, bucket_size, capacity in STATE_HISTORY_TIERS
+        ]
+
+    @staticmethod
+    def get(field: str) -> StateHistory:
+        """Get the history of a state field. There is one instance per field and process."""
+
+        with StateHistory.instances_lock:
+            if StateHistory.instances_pid != os.getpid():
+                StateHistory.instances_pid = os.getpid()
+                StateHistory.instances = {}
+            if field not in StateHistory.instances:
+                StateHistory.instances[field] = StateHistory(field)
+            return StateHistory.instances[field]
+
+    @staticmethod
+    def close() -> None:
+        """Close the history files of this process. They are opened again on the next access."""
+
+        with StateHistory.instances_lock:
+            for history in StateHistory.instances.values():
+                for tier in history.tiers:
+                    tier.buffer.close()
+            StateHistory.instances = {}
+
+    def append(self, value: float, timestamp: Optional[float] = None) -> None:
+        """Record a value in all tiers.
+
+        Args:
+            value:      The value of the field.
+            timestamp:  The unix timestamp of the value. Defaults to now.
+        """
+
+        if timestamp is None:
+            timestamp = time.time()
+        for tier in self.tiers:
+            tier.append(timestamp, value)
+
+    def _select_tier(self, start: float) -> _HistoryTier:
+        """Select the finest tier that still covers `start`."""
+
+        for tier in self.tiers:
+            if tier.covers(start):
+                return tier
+        return self.tiers[-1]
+
+    def get_values(
+        self,
+        start: float,
+        end: float,
+    ) -> list[tuple[float, float]]:
+        """Get the recorded values in a time range. If the range is not
+        covered by the individual values anymore, the means of the
+        buckets of the finest tier that covers it are returned.
+
+        Args:
+            start:  The start of the time range as a unix timestamp (inclusive).
+            end:    The end of the time range as a unix timestamp (exclusive).
+
+        Returns:
+            A list of `(timestamp, value)` tuples, oldest first.
+        """
+
+        return [
+            (record[0], record[1] / record[4])
+            for record in self._select_tier(start).read(start, end)
+            if record[4] > 0
+        ]
+
+    def get_statistics(
+        self,
+        start: float,
+        end: float,
+    ) -> Optional[src.types.StateHistoryStatistics]:
+        """Compute the count, mean, minimum and maximum of the recorded
+        values in a time range. Aggregated tiers are used when the range
+        is not covered by the individual values anymore; the range is then
+        rounded to whole buckets.
+
+        Args:
+            start:  The start of the time range as a unix timestamp (inclusive).
+            end:    The end of the time range as a unix timestamp (exclusive).
+
+        Returns:
+            The statistics or `None` if there are no values in the range.
+        """
+
+        tier = self._select_tier(start)
+        bucket_start = start
+        if tier.bucket_size is not None:
+            bucket_start = math.floor(start / tier.bucket_size) * tier.bucket_size
+        records = [r for r in tier.read(bucket_start, end) if r[4] > 0]
+        if len(records) == 0:
+            return None
+        count = sum([r[4] for r in records])
+        return src.types.StateHistoryStatistics(
+            count=round(count),
+            mean=sum([r[1] for r in records]) / count,
+            min=min([r[2] for r in records]),
+            max=max([r[3] for r in records]),
+            resolution=tier.bucket_size,
+        )
@@ -1,13 +1,21 @@
 from __future__ import annotations
 import contextlib
-from typing import Annotated, Generator
+import datetime
+import json
+from typing import Annotated, Any, Callable, Generator, Optional
 import os
+import threading
+import time
+import filelock
 import pydantic
 import src
-import tum_esm_utils
+from .state_history import StateHistory
+from .state_store import StateStore
 
 STATE_FILE: Annotated[
-    str, "Points to `data/state.json` where the state is communicated with all threads"
+    str,
+    "Points to `data/state.json`, a JSON snapshot of the state for debugging. The state "
+    + "is imported from this file when the state store does not exist yet.",
 ] = os.path.join(
     src.constants.DATA_DIR,
     "state.json",
@@ -21,20 +29,207 @@ STATE_FILE_LOCK: Annotated[
     "state.lock",
 )
 
+STATE_STORE_FILE: Annotated[
+    str,
+    "Points to `data/state.mmap`, the memory-mapped file in which the state is shared "
+    + "between all processes (see `StateStore`)",
+] = os.path.join(
+    src.constants.DATA_DIR,
+    "state.mmap",
+)
+
+STATE_SNAPSHOT_INTERVAL: Annotated[
+    Optional[float],
+    "How many seconds may pass between two updates of the JSON snapshot `data/state.json`. "
+    + "With `None`, no snapshot is written.",
+] = 60
+
 
 class StateInterface:
-    @tum_esm_utils.decorators.with_filelock(STATE_FILE_LOCK, timeout=6)
+    """Shares the `State` between the main loop, the procedures and the backends.
+
+    The state is stored in a memory-mapped file (see `StateStore`) with
+    one section per top-level field of the `State`. `load` does not
+    acquire any lock, and `update` only writes the sections that have
+    changed. The JSON file `data/state.json` is written as a snapshot for
+    debugging at most every `STATE_SNAPSHOT_INTERVAL` seconds; it is only
+    read when the memory-mapped file does not exist yet, or to restore the
+    top-level fields that a crashed writer has left corrupted.
+
+    Single fields can be read and written by their path with `get`, `set`
+    and `compare_and_set`, which only parse the top-level field that
+    contains them. `wait_for_change` and `subscribe` let a procedure react
+    to changes of a field without repeatedly loading the state.
+
+    If `enable_history` has been called in a process, the numeric fields
+    given there are recorded on every write from that process (see
+    `StateHistory`) and can be queried with `get_history` and
+    `get_history_statistics`."""
+
+    store: Optional[StateStore] = None
+    store_lock = threading.Lock()
+
+    # (store, sequence number, parsed state) of the last `load`
+    load_cache: Optional[tuple[StateStore, int, src.types.State]] = None
+
+    # the fields whose values are recorded in the state history
+    history_fields: list[str] = []
+
     @staticmethod
-    def load() -> src.types.State:
-        """Load the state file from the path `project_dir/data/state.json`"""
+    def _get_store() -> StateStore:
+        """Open the state store, creating it from the JSON snapshot if it does not exist."""
+
+        with StateInterface.store_lock:
+            if StateInterface.store is None:
+                if not StateStore.is_valid(STATE_STORE_FILE):
+                    with filelock.FileLock(STATE_FILE_LOCK, timeout=6):
+                        if not StateStore.is_valid(STATE_STORE_FILE):
+                            StateStore.create(
+                                STATE_STORE_FILE,
+                                StateInterface._serialize_sections(
+                                    StateInterface._import_snapshot()
+                                ),
+                            )
+                StateInterface.store = StateStore(STATE_STORE_FILE)
+            return StateInterface.store
+
+    @staticmethod
+    def _import_snapshot() -> src.types.State:
+        """Load the state from the JSON snapshot. Top-level fields that
+        are invalid fall back to their default values. An invalid snapshot
+        is kept as `data/state.json.invalid` for debugging."""
 
         try:
-            with open(STATE_FILE, "r") as f:
-                return src.types.State.model_validate_json(f.read())
-        except (FileNotFoundError, pydantic.ValidationError):
+            with open(STATE_FILE, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
             return src.types.State()
+        try:
+            state_dict = json.loads(content)
+            assert isinstance(state_dict, dict)
+            return StateInterface._parse_sections(
+                {
+                    name: (json.dumps({name: value}).encode()[1:-1], 0)
+                    for name, value in state_dict.items()
+                    if name in src.types.State.model_fields
+                }
+            )
+        except (ValueError, AssertionError):
+            os.replace(STATE_FILE, STATE_FILE + ".invalid")
+            return src.types.State()
+
+    @staticmethod
+    def close() -> None:
+        """Close the state store and the state history of this process. They
+        are opened again on the next access, e.g. after the files have been
+        replaced."""
+
+        with StateInterface.store_lock:
+            if StateInterface.store is not None:
+                StateInterface.store.close()
+                StateInterface.store = None
+            StateInterface.load_cache = None
+        StateHistory.close()
+
+    @staticmethod
+    def _serialize_sections(state: src.types.State) -> dict[str, bytes]:
+        """Serialize each top-level field of the state to `"<field>":<json>`."""
+
+        return {
+            name: state.model_dump_json(include={name}).encode()[1:-1]
+            for name in src.types.State.model_fields.keys()
+        }
+
+    @staticmethod
+    def _parse_sections(sections: dict[str, tuple[bytes, int]]) -> src.types.State:
+        """Parse the sections of the state store. If the sections do not
+        match the current `State` model, only the invalid top-level fields
+        fall back to their default values."""
+
+        payloads = [p for p, _ in sections.values() if len(p) > 0]
+        try:
+            return src.types.State.model_validate_json(b"{" + b",".join(payloads) + b"}")
+        except pydantic.ValidationError:
+            valid_payloads: list[bytes] = []
+            for payload in payloads:
+                try:
+                    src.types.State.model_validate_json(b"{" + payload + b"}")
+                    valid_payloads.append(payload)
+                except pydantic.ValidationError:
+                    pass
+            return src.types.State.model_validate_json(b"{" + b",".join(valid_payloads) + b"}")
+
+    @staticmethod
+    def _recover(store: StateStore) -> None:
+        """Recover the state store from a writer that has crashed in the
+        middle of a write (see `StateStore.recover`). The top-level fields
+        that have been cleared are restored from the JSON snapshot, which is
+        at most `STATE_SNAPSHOT_INTERVAL` seconds old. The caller has to hold
+        the state lock."""
+
+        cleared_sections = store.recover()
+        if len(cleared_sections) > 0:
+            snapshot_sections = StateInterface._serialize_sections(
+                StateInterface._import_snapshot()
+            )
+            store.write(
+                {
+                    name: snapshot_sections[name]
+                    for name in cleared_sections
+                    if name in snapshot_sections
+                }
+            )
+
+    @staticmethod
+    def _read_sections() -> dict[str, tuple[bytes, int]]:
+        """Read all sections of the state store. If a writer has crashed in
+        the middle of a write, the store is recovered first."""
+
+        store = StateInterface._get_store()
+        try:
+            return store.read()[1]
+        except TimeoutError:
+            with filelock.FileLock(STATE_FILE_LOCK, timeout=6):
+                StateInterface._recover(store)
+            return store.read()[1]
+
+    @staticmethod
+    def _get_cached_state() -> Optional[src.types.State]:
+        """Return the state parsed by the last `load` if the state store has
+        not been written since then."""
+
+        cache = StateInterface.load_cache
+        if cache is None:
+            return None
+        store, sequence_number, state = cache
+        if (store is not StateInterface.store) or (store.get_sequence_number() != sequence_number):
+            return None
+        return state
+
+    @staticmethod
+    def load() -> src.types.State:
+        """Load the state from the state store without acquiring a lock.
+
+        The parsed state is cached until the state store is written again,
+        so repeated calls without an update in between do not parse or
+        validate anything. The cached state is shared by all these calls,
+        so it must not be modified - use `update` or `set` instead, which
+        parse their own copy of the state."""
+
+        state = StateInterface._get_cached_state()
+        if state is not None:
+            return state
+        store = StateInterface._get_store()
+        try:
+            sequence_number, sections = store.read()
+        except TimeoutError:
+            with filelock.FileLock(STATE_FILE_LOCK, timeout=6):
+                StateInterface._recover(store)
+            sequence_number, sections = store.read()
+        state = StateInterface._parse_sections(sections)
+        StateInterface.load_cache = (store, sequence_number, state)
+        return state
 
-    @tum_esm_utils.decorators.with_filelock(STATE_FILE_LOCK, timeout=6)
     @staticmethod
     @contextlib.contextmanager
     def update() -> Generator[src.types.State, None, None]:
@@ -44,6 +239,9 @@ class StateInterface:
         If you would do 1. load, 2. modify, 3. save in separate calls, you might
         overwrite the changes by another process.
 
+        Only the top-level fields of the state that have been changed are
+        written back to the state store.
+
         Usage:
 
         ```python
@@ -55,15 +253,402 @@ class StateInterface:
             A generator that yields the state object.
         """
 
-        state: src.types.State
+        # open the store before locking, creating it acquires the lock itself
+        store = StateInterface._get_store()
+        with filelock.FileLock(STATE_FILE_LOCK, timeout=6):
+            StateInterface._recover(store)
+            sections = store.read()[1]
+            state = StateInterface._parse_sections(sections)
+
+            yield state
+
+            new_sections = StateInterface._serialize_sections(state)
+            changed_sections = {
+                name: payload
+                for name, payload in new_sections.items()
+                if (name not in sections) or (sections[name][0] != payload)
+            }
+            store.write(changed_sections)
+            StateInterface._record_history(state, list(changed_sections.keys()))
+            if StateInterface._snapshot_is_due():
+                StateInterface.write_snapshot(state)
+
+    @staticmethod
+    def _split_path(path: str) -> list[str]:
+        """Split a field path like `system.last_5_min_load` or `pending_configs.0`.
+
+        Raises:
+            ValueError: If the first part is not a top-level field of the `State`.
+        """
+
+        parts = path.split(".")
+        if parts[0] not in src.types.State.model_fields:
+            raise ValueError(f"'{parts[0]}' is not a field of the state")
+        return parts
+
+    @staticmethod
+    def _resolve(state: src.types.State, parts: list[str]) -> Any:
+        """Get the value at a field path. Numeric parts index into lists.
 
+        Raises:
+            KeyError: If the path does not exist.
+        """
+
+        value: Any = state
+        for part in parts:
+            try:
+                if isinstance(value, list):
+                    value = value[int(part)]
+                else:
+                    value = getattr(value, part)
+            except (AttributeError, IndexError, ValueError):
+                raise KeyError(f"Field path '{'.'.join(parts)}' does not exist in the state")
+        return value
+
+    @staticmethod
+    def _load_section(name: str) -> src.types.State:
+        """Load a state in which only one top-level field has been read
+        from the state store, all other fields have their default values."""
+
+        store = StateInterface._get_store()
         try:
-            with open(STATE_FILE, "r") as f:
-                state = src.types.State.model_validate_json(f.read())
-        except (FileNotFoundError, pydantic.ValidationError):
-            state = src.types.State()
+            sections = store.read([name])[1]
+        except TimeoutError:
+            sections = {name: StateInterface._read_sections()[name]}
+        return StateInterface._parse_sections(sections)
+
+    @staticmethod
+    def get(path: str) -> Any:
+        """Get the value of a single field of the state without acquiring
+        a lock. Only the top-level field that contains it is read and
+        parsed, e.g. `system` for `system.last_5_min_load`. If the state
+        parsed by `load` is still current, the value is taken from it and
+        must not be modified either.
+
+        Args:
+            path:  The path of the field, e.g. `system.last_5_min_load` or
+                   `pending_configs.0`.
+
+        Returns:
+            The value of the field.
+
+        Raises:
+            ValueError: If the path does not start with a field of the state.
+            KeyError:   If the path does not exist in the state.
+        """
+
+        parts = StateInterface._split_path(path)
+        state = StateInterface._get_cached_state()
+        if state is None:
+            return StateInterface._resolve(StateInterface._load_section(parts[0]), parts)
+        return StateInterface._resolve(state, parts)
+
+    @staticmethod
+    def set(path: str, value: Any) -> None:
+        """Set the value of a single field of the state. Only the top-level
+        field that contains it is read and written.
+
+        Args:
+            path:   The path of the field, e.g. `system.last_5_min_load`.
+            value:  The new value. It is validated against the `State` model.
+
+        Raises:
+            ValueError: If the path does not start with a field of the state.
+            KeyError:   If the path does not exist in the state.
+            pydantic.ValidationError: If the value does not match the field type.
+        """
 
-        yield state
+        StateInterface._set_field(path, value, None)
 
-        with open(STATE_FILE, "w") as f:
+    @staticmethod
+    def compare_and_set(path: str, expected: Any, value: Any) -> bool:
+        """Atomically set a field of the state if it currently has the expected value.
+
+        Args:
+            path:      The path of the field, e.g. `system.last_5_min_load`.
+            expected:  The value the field must have for the update to happen.
+            value:     The new value. It is validated against the `State` model.
+
+        Returns:
+            Whether the field has been set.
+
+        Raises:
+            ValueError: If the path does not start with a field of the state.
+            KeyError:   If the path does not exist in the state.
+            pydantic.ValidationError: If the value does not match the field type.
+        """
+
+        return StateInterface._set_field(path, value, lambda current: current == expected)
+
+    @staticmethod
+    def _set_field(
+        path: str,
+        value: Any,
+        condition: Optional[Callable[[Any], bool]],
+    ) -> bool:
+        """Set a field of the state within the state lock if the condition
+        holds for its current value. Returns whether the field has been set."""
+
+        parts = StateInterface._split_path(path)
+        # open the store before locking, creating it acquires the lock itself
+        store = StateInterface._get_store()
+        with filelock.FileLock(STATE_FILE_LOCK, timeout=6):
+            StateInterface._recover(store)
+            state = StateInterface._parse_sections(store.read([parts[0]])[1])
+            current_value = StateInterface._resolve(state, parts)
+            if (condition is not None) and (not condition(current_value)):
+                return False
+
+            # set the value on a plain copy and validate the whole top-level field again
+            section = state.model_dump(include={parts[0]})
+            parent: Any = section
+            for part in parts[:-1]:
+                parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+            if isinstance(parent, list):
+                parent[int(parts[-1])] = value
+            else:
+                parent[parts[-1]] = value
+            new_state = src.types.State.model_validate(section)
+
+            store.write({parts[0]: StateInterface._serialize_sections(new_state)[parts[0]]})
+            StateInterface._record_history(new_state, [parts[0]])
+            if StateInterface._snapshot_is_due():
+                StateInterface.write_snapshot(StateInterface.load())
+            return True
+
+    @staticmethod
+    def wait_for_change(
+        path: str,
+        timeout: Optional[float] = None,
+        poll_interval: float = 0.05,
+    ) -> Any:
+        """Block until the value of a field differs from its value at the
+        time of the call. Only the version counter of the top-level field
+        is checked while waiting, the field is only parsed when it has
+        been written.
+
+        Args:
+            path:           The path of the field, e.g. `system.last_5_min_load`.
+            timeout:        The maximum number of seconds to wait.
+            poll_interval:  How many seconds to wait between checking the version.
+
+        Returns:
+            The new value of the field.
+
+        Raises:
+            TimeoutError: If the value has not changed within `timeout` seconds.
+        """
+
+        parts = StateInterface._split_path(path)
+        store = StateInterface._get_store()
+        version = store.get_version(parts[0])
+        value = StateInterface.get(path)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            new_version = store.get_version(parts[0])
+            if new_version != version:
+                version = new_version
+                new_value = StateInterface.get(path)
+                if new_value != value:
+                    return new_value
+            if (deadline is not None) and (time.monotonic() >= deadline):
+                raise TimeoutError(f"The state field '{path}' has not changed in {timeout} seconds")
+            time.sleep(poll_interval)
+
+    @staticmethod
+    def subscribe(
+        path: str,
+        callback: Callable[[Any, Any], None],
+        poll_interval: float = 0.5,
+    ) -> StateSubscription:
+        """Call a function in a background thread whenever the value of a
+        field changes (see `StateInterface.wait_for_change`).
+
+        Args:
+            path:           The path of the field, e.g. `system.last_5_min_load`.
+            callback:       A function that is called with the old and the new value.
+            poll_interval:  How many seconds to wait between checking the version.
+
+        Returns:
+            The subscription, use `StateSubscription.cancel` to end it.
+        """
+
+        StateInterface._split_path(path)
+        return StateSubscription(path, callback, poll_interval)
+
+    @staticmethod
+    def enable_history(fields: list[str]) -> None:
+        """Record the values of some numeric fields in the state history
+        whenever their top-level field is written by this process.
+
+        Args:
+            fields:  The paths of the fields, e.g. `system.last_5_min_load`.
+
+        Raises:
+            ValueError: If a path does not start with a field of the state.
+        """
+
+        for field in fields:
+            StateInterface._split_path(field)
+        StateInterface.history_fields = list(fields)
+
+    @staticmethod
+    def _record_history(state: src.types.State, written_sections: list[str]) -> None:
+        """Append the current values of the history fields within the
+        written top-level fields. Missing and non-numeric values are skipped."""
+
+        for field in StateInterface.history_fields:
+            parts = field.split(".")
+            if parts[0] not in written_sections:
+                continue
+            try:
+                value = StateInterface._resolve(state, parts)
+            except KeyError:
+                continue
+            if isinstance(value, (int, float)) and (not isinstance(value, bool)):
+                StateHistory.get(field).append(float(value))
+
+    @staticmethod
+    def get_history(
+        path: str,
+        start: datetime.datetime,
+        end: Optional[datetime.datetime] = None,
+    ) -> list[tuple[datetime.datetime, float]]:
+        """Get the recorded values of a field in a time range. Older
+        ranges are returned as per-minute or per-hour means (see
+        `StateHistory.get_values`).
+
+        Args:
+            path:   The path of the field, e.g. `system.last_5_min_load`.
+            start:  The start of the time range (inclusive). Naive datetimes are in UTC.
+            end:    The end of the time range (exclusive). Defaults to now.
+
+        Returns:
+            A list of `(time, value)` tuples in UTC, oldest first.
+        """
+
+        StateInterface._split_path(path)
+        return [
+            (datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc), value)
+            for timestamp, value in StateHistory.get(path).get_values(
+                StateInterface._to_timestamp(start), StateInterface._to_timestamp(end)
+            )
+        ]
+
+    @staticmethod
+    def get_history_statistics(
+        path: str,
+        start: datetime.datetime,
+        end: Optional[datetime.datetime] = None,
+    ) -> Optional[src.types.StateHistoryStatistics]:
+        """Compute the count, mean, minimum and maximum of the recorded
+        values of a field in a time range, e.g. the mean load over the last
+        hour. Only the aggregates of the finest tier that covers the range
+        are read (see `StateHistory.get_statistics`).
+
+        Args:
+            path:   The path of the field, e.g. `system.last_5_min_load`.
+            start:  The start of the time range (inclusive). Naive datetimes are in UTC.
+            end:    The end of the time range (exclusive). Defaults to now.
+
+        Returns:
+            The statistics or `None` if no values have been recorded in the range.
+        """
+
+        StateInterface._split_path(path)
+        return StateHistory.get(path).get_statistics(
+            StateInterface._to_timestamp(start), StateInterface._to_timestamp(end)
+        )
+
+    @staticmethod
+    def _to_timestamp(dt: Optional[datetime.datetime]) -> float:
+        """Convert a datetime to a unix timestamp. Naive datetimes are in
+        UTC, `None` is now."""
+
+        if dt is None:
+            return time.time()
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return dt.timestamp()
+
+    @staticmethod
+    def _snapshot_is_due() -> bool:
+        """Returns whether the JSON snapshot is older than `STATE_SNAPSHOT_INTERVAL`."""
+
+        if STATE_SNAPSHOT_INTERVAL is None:
+            return False
+        try:
+            return (time.time() - os.path.getmtime(STATE_FILE)) >= STATE_SNAPSHOT_INTERVAL
+        except FileNotFoundError:
+            return True
+
+    @staticmethod
+    def write_snapshot(state: Optional[src.types.State] = None) -> None:
+        """Write the state to the JSON snapshot `data/state.json`.
+
+        Args:
+            state:  The state to write. If this is `None`, the current state is loaded.
+        """
+
+        if state is None:
+            state = StateInterface.load()
+
+        # write to a temporary file first, so a crash never leaves a truncated snapshot
+        tmp_path = f"{STATE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
             f.write(state.model_dump_json(indent=4))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, STATE_FILE)
+
+
+class StateSubscription:
+    """A background thread that calls a function whenever a field of the
+    state changes. Created by `StateInterface.subscribe`."""
+
+    def __init__(
+        self,
+        path: str,
+        callback: Callable[[Any, Any], None],
+        poll_interval: float,
+    ) -> None:
+        """Start the subscription thread.
+
+        Args:
+            path:           The path of the field.
+            callback:       A function that is called with the old and the new value.
+            poll_interval:  How many seconds to wait between checking the version.
+        """
+
+        self.path = path
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.cancelled = threading.Event()
+        self.field = StateInterface._split_path(path)[0]
+        self.version = StateInterface._get_store().get_version(self.field)
+        self.value = StateInterface.get(path)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        """Compare the field with the last value passed to the callback
+        whenever its version has changed. Changes made while the callback
+        is running are therefore passed in the next iteration."""
+
+        while not self.cancelled.wait(self.poll_interval):
+            version = StateInterface._get_store().get_version(self.field)
+            if version == self.version:
+                continue
+            self.version = version
+            new_value = StateInterface.get(self.path)
+            if new_value == self.value:
+                continue
+            old_value, self.value = self.value, new_value
+            self.callback(old_value, new_value)
+
+    def cancel(self) -> None:
+        """Stop the subscription. The callback is not called afterwards."""
+
+        self.cancelled.set()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
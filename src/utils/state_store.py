@@ -0,0 +1,402 @@
+from __future__ import annotations
+from typing import Optional
+import mmap
+import os
+import struct
+import time
+import zlib
+
+# magic, sequence number (odd while a write is in progress), file size, number of sections, flags
+_HEADER = struct.Struct("<8sQQII")
+_MAGIC = b"IVYSTAT1"
+
+# set in the header of a store file that has been replaced by a new file at the same path
+_FLAG_REPLACED = 1
+
+# name, offset, capacity, length, version, crc32 of the payload
+_SECTION = struct.Struct("<32sQQQQI4x")
+_MAX_SECTIONS = 32
+_PAYLOADS_OFFSET = _HEADER.size + _MAX_SECTIONS * _SECTION.size
+
+
+class StateStore:
+    """A memory-mapped file that stores named byte strings ("sections"),
+    e.g. the JSON of each top-level field of the `State`.
+
+    Reads are lock-free and do not perform any system call unless the
+    file has grown: the header contains a sequence number that is odd
+    while a write is in progress. A reader copies the sections and retries
+    if the sequence number was odd or has changed in the meantime (a
+    "seqlock"). Each section additionally has a CRC32 checksum, so a torn
+    read is also detected on CPUs that reorder memory accesses.
+
+    Writes only copy the sections that have changed. Each section has
+    some spare capacity; only when a section outgrows it, all sections
+    are laid out again in a new file, which atomically replaces the store
+    file. The old file is marked as replaced, so readers map the new file
+    on their next read. A crash during a relayout therefore never affects
+    the content of the store; a crash during an in-place write can only
+    corrupt the sections that were being written (see `recover`). Writers
+    have to be serialized by the caller, e.g. with a file lock.
+
+    Each section has a version that is incremented on every write, so
+    readers can detect changes of a section without comparing its content."""
+
+    def __init__(self, path: str) -> None:
+        """Open an existing store file. Use `StateStore.create` to create one.
+
+        Args:
+            path:  The path of the store file.
+
+        Raises:
+            ValueError: If the file is not a valid store file.
+        """
+
+        self.path = path
+        self.buffer = self._map()
+
+    @staticmethod
+    def create(path: str, sections: dict[str, bytes]) -> None:
+        """Create a new store file, replacing an existing file atomically.
+
+        Args:
+            path:      The path of the store file.
+            sections:  The initial content of the store.
+        """
+
+        table, payloads, size = StateStore._layout(
+            {name: (payload, 0) for name, payload in sections.items()}
+        )
+        StateStore._write_file(path, table, payloads, size, sequence_number=0)
+
+    @staticmethod
+    def _write_file(
+        path: str,
+        table: list[tuple[str, int, int, int]],
+        payloads: dict[str, bytes],
+        size: int,
+        sequence_number: int,
+    ) -> None:
+        """Write a complete store file to a temporary file and move it
+        to `path` atomically once it has been written to the disk."""
+
+        content = bytearray(size)
+        _HEADER.pack_into(content, 0, _MAGIC, sequence_number, size, len(table), 0)
+        StateStore._write_sections(content, table, payloads)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def is_valid(path: str) -> bool:
+        """Returns whether there is a valid store file at `path`."""
+
+        try:
+            with open(path, "rb") as f:
+                header = f.read(_HEADER.size)
+        except FileNotFoundError:
+            return False
+        return (len(header) == _HEADER.size) and (_HEADER.unpack(header)[0] == _MAGIC)
+
+    def _map(self) -> mmap.mmap:
+        """Map the whole store file into memory."""
+
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            stat = os.fstat(fd)
+            if stat.st_size < _PAYLOADS_OFFSET:
+                raise ValueError(f"{self.path} is not a valid state store file")
+            buffer = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        if _HEADER.unpack_from(buffer, 0)[0] != _MAGIC:
+            raise ValueError(f"{self.path} is not a valid state store file")
+        self.inode = stat.st_ino
+        return buffer
+
+    def _check_size(self) -> mmap.mmap:
+        """Return the current mapping. The file is mapped again if it has
+        been enlarged or replaced by another process. The old mapping is
+        left to the garbage collector because other threads might still
+        read from it."""
+
+        buffer = self.buffer
+        _, _, size, _, flags = _HEADER.unpack_from(buffer, 0)
+        if (size > len(buffer)) or (flags & _FLAG_REPLACED):
+            buffer = self._map()
+            self.buffer = buffer
+        return buffer
+
+    def _check_file(self) -> mmap.mmap:
+        """Like `_check_size`, but also compares the inode of the file at
+        the path, which costs a system call. Used by writers, so a writer
+        that has crashed between replacing the file and marking the old
+        file as replaced does not leave other processes on the old file."""
+
+        buffer = self._check_size()
+        if os.stat(self.path).st_ino != self.inode:
+            StateStore._mark_replaced(buffer)
+            buffer = self._map()
+            self.buffer = buffer
+        return buffer
+
+    def read(self, names: Optional[list[str]] = None) -> tuple[int, dict[str, tuple[bytes, int]]]:
+        """Read a consistent copy of some or all sections without acquiring a lock.
+
+        Args:
+            names:  The names of the sections to read. If this is `None`,
+                    all sections are read.
+
+        Returns:
+            The sequence number of the store and a dictionary mapping each
+            section name to its content and version. Sections that do not
+            exist are omitted.
+
+        Raises:
+            TimeoutError: If no consistent copy could be read within one
+                          second, e.g. because a writer has crashed in the
+                          middle of a write.
+        """
+
+        deadline = time.monotonic() + 1
+        while True:
+            buffer = self._check_size()
+            sequence_number = _HEADER.unpack_from(buffer, 0)[1]
+            if sequence_number % 2 == 0:
+                sections = StateStore._read_sections(buffer, names)
+                if (sections is not None) and (
+                    _HEADER.unpack_from(buffer, 0)[1] == sequence_number
+                ):
+                    return sequence_number, sections
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Could not read a consistent state from {self.path}")
+            time.sleep(0.0001)
+
+    @staticmethod
+    def _read_sections(
+        buffer: mmap.mmap, names: Optional[list[str]]
+    ) -> Optional[dict[str, tuple[bytes, int]]]:
+        """Copy the sections out of the buffer. Returns `None` if the
+        content is inconsistent because it is being written."""
+
+        section_count = _HEADER.unpack_from(buffer, 0)[3]
+        if section_count > _MAX_SECTIONS:
+            return None
+        sections: dict[str, tuple[bytes, int]] = {}
+        for i in range(section_count):
+            raw_name, offset, _, length, version, crc = _SECTION.unpack_from(
+                buffer, _HEADER.size + i * _SECTION.size
+            )
+            name = raw_name.rstrip(b"\0").decode(errors="replace")
+            if (names is not None) and (name not in names):
+                continue
+            if offset + length > len(buffer):
+                return None
+            payload = buffer[offset : offset + length]
+            if zlib.crc32(payload) != crc:
+                return None
+            sections[name] = (payload, version)
+        return sections
+
+    def get_version(self, name: str) -> Optional[int]:
+        """Get the version of a section without copying its content. The
+        version is incremented on every write of the section.
+
+        Args:
+            name:  The name of the section.
+
+        Returns:
+            The version or `None` if the section does not exist.
+        """
+
+        for section_name, _, _, version in StateStore._read_table(self._check_size()):
+            if section_name == name:
+                return version
+        return None
+
+    def get_sequence_number(self) -> int:
+        """Get the current sequence number of the store. It changes
+        whenever any section is written."""
+
+        return int(_HEADER.unpack_from(self.buffer, 0)[1])
+
+    def write(self, sections: dict[str, bytes]) -> None:
+        """Write some sections. Sections that are not given keep their
+        content. The caller has to make sure that there is only one
+        writer at a time. If the previous writer has crashed, the store
+        is recovered first (see `StateStore.recover`).
+
+        Args:
+            sections:  The new content of the sections to write.
+        """
+
+        if len(sections) == 0:
+            return
+        self.recover()
+        buffer = self._check_file()
+        size = _HEADER.unpack_from(buffer, 0)[2]
+        table = StateStore._read_table(buffer)
+        capacities = {name: capacity for name, _, capacity, _ in table}
+
+        if all([len(p) <= capacities.get(name, -1) for name, p in sections.items()]):
+            # only overwrite the changed sections in place
+            new_table = [
+                (name, offset, capacity, version + int(name in sections))
+                for name, offset, capacity, version in table
+            ]
+            self._begin_write(buffer)
+            StateStore._write_sections(buffer, new_table, sections)
+            self._end_write(buffer, size, len(new_table))
+            return
+
+        # lay out all sections again in a new file, keeping the content of the unchanged ones
+        current_sections = StateStore._read_sections(buffer, None)
+        assert current_sections is not None, "the state store is corrupted"
+        new_sections = {
+            name: (sections.get(name, payload), version + int(name in sections))
+            for name, (payload, version) in current_sections.items()
+        }
+        for name, payload in sections.items():
+            if name not in new_sections:
+                new_sections[name] = (payload, 1)
+        new_table, payloads, size = StateStore._layout(new_sections)
+        StateStore._write_file(
+            self.path,
+            new_table,
+            payloads,
+            size,
+            sequence_number=_HEADER.unpack_from(buffer, 0)[1] + 2,
+        )
+        StateStore._mark_replaced(buffer)
+        self.buffer = self._map()
+
+    @staticmethod
+    def _read_table(buffer: mmap.mmap) -> list[tuple[str, int, int, int]]:
+        """Read the section table: `(name, offset, capacity, version)` per section."""
+
+        section_count = min(_HEADER.unpack_from(buffer, 0)[3], _MAX_SECTIONS)
+        table: list[tuple[str, int, int, int]] = []
+        for i in range(section_count):
+            raw_name, offset, capacity, _, version, _ = _SECTION.unpack_from(
+                buffer, _HEADER.size + i * _SECTION.size
+            )
+            name = raw_name.rstrip(b"\0").decode(errors="replace")
+            table.append((name, offset, capacity, version))
+        return table
+
+    @staticmethod
+    def _layout(
+        sections: dict[str, tuple[bytes, int]],
+    ) -> tuple[list[tuple[str, int, int, int]], dict[str, bytes], int]:
+        """Place the sections one after another, each with twice its size
+        as capacity. Returns the section table, the payloads and the size
+        of the file."""
+
+        assert len(sections) <= _MAX_SECTIONS, f"at most {_MAX_SECTIONS} sections are supported"
+        table: list[tuple[str, int, int, int]] = []
+        offset = _PAYLOADS_OFFSET
+        for name, (payload, version) in sections.items():
+            assert len(name.encode()) <= 32, f"section name {name} is too long"
+            capacity = max(2 * len(payload), 1024)
+            table.append((name, offset, capacity, version))
+            offset += capacity
+        return table, {name: payload for name, (payload, _) in sections.items()}, offset
+
+    @staticmethod
+    def _write_sections(
+        buffer: mmap.mmap | bytearray,
+        table: list[tuple[str, int, int, int]],
+        payloads: dict[str, bytes],
+    ) -> None:
+        """Write the section table and the given payloads. Sections
+        without a payload only get their table entry written."""
+
+        for i, (name, offset, capacity, version) in enumerate(table):
+            if name not in payloads:
+                continue
+            payload = payloads[name]
+            buffer[offset : offset + len(payload)] = payload
+            _SECTION.pack_into(
+                buffer,
+                _HEADER.size + i * _SECTION.size,
+                name.encode(),
+                offset,
+                capacity,
+                len(payload),
+                version,
+                zlib.crc32(payload),
+            )
+
+    def recover(self) -> list[str]:
+        """Recover from a writer that has crashed in the middle of an in-place
+        write, which leaves the sequence number odd. Sections whose checksum
+        does not match are cleared, the caller should restore their content
+        from a backup, e.g. the JSON snapshot of the state. The caller has
+        to hold the writer lock.
+
+        Returns:
+            The names of the cleared sections.
+        """
+
+        buffer = self._check_file()
+        _, sequence_number, size, section_count, _ = _HEADER.unpack_from(buffer, 0)
+        if sequence_number % 2 == 0:
+            return []
+        cleared_sections: list[str] = []
+        for i in range(min(section_count, _MAX_SECTIONS)):
+            raw_name, offset, capacity, length, version, crc = _SECTION.unpack_from(
+                buffer, _HEADER.size + i * _SECTION.size
+            )
+            if (offset + length > len(buffer)) or (
+                zlib.crc32(buffer[offset : offset + length]) != crc
+            ):
+                cleared_sections.append(raw_name.rstrip(b"\0").decode(errors="replace"))
+                _SECTION.pack_into(
+                    buffer,
+                    _HEADER.size + i * _SECTION.size,
+                    raw_name,
+                    offset,
+                    capacity,
+                    0,
+                    version + 1,
+                    zlib.crc32(b""),
+                )
+        self._end_write(buffer, size, min(section_count, _MAX_SECTIONS))
+        return cleared_sections
+
+    @staticmethod
+    def _begin_write(buffer: mmap.mmap) -> None:
+        """Make the sequence number odd, so readers wait for the write."""
+
+        _, sequence_number, size, section_count, flags = _HEADER.unpack_from(buffer, 0)
+        if sequence_number % 2 == 0:
+            _HEADER.pack_into(buffer, 0, _MAGIC, sequence_number + 1, size, section_count, flags)
+
+    @staticmethod
+    def _end_write(buffer: mmap.mmap, size: int, section_count: int) -> None:
+        """Make the sequence number even again and publish the new size and table."""
+
+        _, sequence_number, _, _, flags = _HEADER.unpack_from(buffer, 0)
+        _HEADER.pack_into(buffer, 0, _MAGIC, sequence_number + 1, size, section_count, flags)
+
+    @staticmethod
+    def _mark_replaced(buffer: mmap.mmap) -> None:
+        """Mark a store file as replaced by a new file, so readers map the
+        new file. The sequence number is advanced as for a write, so
+        readers that cache the state of the old file notice the change."""
+
+        _, sequence_number, size, section_count, flags = _HEADER.unpack_from(buffer, 0)
+        if flags & _FLAG_REPLACED:
+            return
+        sequence_number += sequence_number % 2
+        _HEADER.pack_into(
+            buffer, 0, _MAGIC, sequence_number + 2, size, section_count, flags | _FLAG_REPLACED
+        )
+
+    def close(self) -> None:
+        """Close the mapping of the store file."""
+
+        self.buffer.close()
@@ -0,0 +1,135 @@
+from __future__ import annotations
+from typing import Optional
+import multiprocessing
+import multiprocessing.connection
+import time
+from .lifecycle_manager import LifecycleManager
+
+
+class Supervisor:
+    """Keeps the processes of a list of lifecycle managers running.
+
+    Instead of polling each process, the supervisor blocks on the
+    sentinels of all running processes and on a control pipe
+    (`multiprocessing.connection.wait`). It wakes up as soon as a process
+    dies, when `Supervisor.wake_up` is called, when the restart backoff of
+    a crashed process has passed, when the resource usage of a process
+    should be sampled (see `LifecycleManager.check_resources`), when a
+    process misses its heartbeat deadline (see
+    `LifecycleManager.check_heartbeat`), or after the given timeout. In
+    between, it does not use any CPU time.
+
+    ```python
+    supervisor = src.utils.Supervisor(lifecycle_managers)
+    while True:
+        supervisor.start_procedures()
+        supervisor.wait(timeout=10)
+    ```"""
+
+    def __init__(self, lifecycle_managers: list[LifecycleManager]) -> None:
+        """Initializes a new supervisor.
+
+        Args:
+            lifecycle_managers:  The lifecycle managers of the procedures and backends.
+        """
+
+        self.lifecycle_managers = lifecycle_managers
+        self.control_receiver, self.control_sender = multiprocessing.Pipe(duplex=False)
+
+    def start_procedures(self) -> None:
+        """Start every procedure/backend that is not running and whose
+        restart is not delayed by its restart backoff anymore."""
+
+        for lm in self.lifecycle_managers:
+            if (not lm.procedure_is_running()) and (lm.get_seconds_until_restart() == 0):
+                lm.start_procedure()
+
+    def wait(self, timeout: float) -> None:
+        """Block until a process dies, `wake_up` is called, a delayed
+        restart, a resource sample or a heartbeat deadline is due or
+        `timeout` seconds have passed. The status of each process that has
+        died is checked, so the crash is logged and the process can be
+        started again with `start_procedures`. Afterwards, due resource
+        samples are taken and stalled processes are killed.
+
+        Args:
+            timeout:  The maximum number of seconds to wait.
+        """
+
+        sentinels: dict[int, LifecycleManager] = {}
+        for lm in self.lifecycle_managers:
+            if lm.process is not None:
+                sentinels[lm.process.sentinel] = lm
+                for seconds in [
+                    lm.get_seconds_until_resource_sample(),
+                    lm.get_seconds_until_heartbeat_deadline(),
+                ]:
+                    if seconds is not None:
+                        timeout = min(timeout, seconds)
+            else:
+                timeout = min(timeout, lm.get_seconds_until_restart())
+
+        ready = multiprocessing.connection.wait(
+            [*sentinels.keys(), self.control_receiver], timeout=max(timeout, 0)
+        )
+        for item in ready:
+            if item is self.control_receiver:
+                while self.control_receiver.poll():
+                    self.control_receiver.recv_bytes()
+            elif isinstance(item, int):
+                # the sentinel can become ready shortly before the process can be reaped
+                lm = sentinels[item]
+                if lm.process is not None:
+                    lm.process.join(1)
+                lm.check_procedure_status()
+
+        for lm in self.lifecycle_managers:
+            if lm.get_seconds_until_resource_sample() == 0:
+                lm.check_resources()
+            if lm.get_seconds_until_heartbeat_deadline() == 0:
+                lm.check_heartbeat()
+
+    def wake_up(self) -> None:
+        """Interrupt a running `wait`, e.g. from another thread. If no
+        `wait` is running, the next one returns immediately."""
+
+        self.control_sender.send_bytes(b"\0")
+
+    def teardown(self, timeout: Optional[float] = None) -> None:
+        """Tear down all processes concurrently: every process is signaled
+        first (see `LifecycleManager.initiate_teardown`), then the
+        supervisor waits on all of them at once. Each process is killed
+        when it passes its own teardown deadline or the global `timeout`,
+        so the teardown takes as long as the slowest process instead of
+        the sum of all processes.
+
+        Args:
+            timeout:  The maximum number of seconds for the whole teardown.
+                      If this is `None`, only the deadlines of the
+                      individual processes apply.
+        """
+
+        global_deadline = None if timeout is None else time.monotonic() + timeout
+        for lm in self.lifecycle_managers:
+            if lm.procedure_is_running():
+                lm.initiate_teardown()
+
+        # sentinel -> (lifecycle manager, time at which it is killed)
+        pending: dict[int, tuple[LifecycleManager, float]] = {}
+        for lm in self.lifecycle_managers:
+            if (lm.process is not None) and (lm.teardown_deadline is not None):
+                deadline = lm.teardown_deadline
+                if global_deadline is not None:
+                    deadline = min(deadline, global_deadline)
+                pending[lm.process.sentinel] = (lm, deadline)
+
+        while len(pending) > 0:
+            next_deadline = min([deadline for _, deadline in pending.values()])
+            ready = multiprocessing.connection.wait(
+                list(pending.keys()), timeout=max(next_deadline - time.monotonic(), 0)
+            )
+            now = time.monotonic()
+            for sentinel, (lm, deadline) in list(pending.items()):
+                if (sentinel in ready) or (deadline <= now):
+                    lm.await_teardown(global_deadline)
+                    del pending[sentinel]
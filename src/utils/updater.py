@@ -35,7 +35,7 @@ class Updater:
         self.config = config
         self.processed_config_revisions: set[int] = set()
         self.logger = Logger(config=config, origin="updater")
-        self.messaging_agent = MessagingAgent()
+        self.messaging_agent = MessagingAgent.get_shared(config=config)
 
     def perform_update(
         self,
@@ -92,7 +92,7 @@ class Updater:
         self.processed_config_revisions.add(foreign_config.general.config_revision)
         self.logger.info(
             f"Processing new config with revision {foreign_config.general.config_revision}",
-            details=f"config = {foreign_config.model_dump_json(indent=4)}",
+            details=lambda: f"config = {foreign_config.model_dump_json(indent=4)}",
         )
 
         if foreign_config.general.software_version == self.config.general.software_version:
@@ -1,6 +1,7 @@
 from typing import Generator
 import datetime
 import os
+import shutil
 import sys
 import dotenv
 import pytest
@@ -26,7 +27,8 @@ def restore_production_files() -> Generator[None, None, None]:
 
     I.e., the file `config/config.json` will be temporarily saved in
     `config/config.json.tmp`, so is the active message queue file and
-    today's message archive file.
+    the whole message archive directory `data/messages/`, which is
+    replaced by an empty directory during the test.
 
     It also acquires a mainlock so that the automation cannot run while
     the test is running and vice versa."""
@@ -44,27 +46,50 @@ def restore_production_files() -> Generator[None, None, None]:
                 "config.json",
             ),
             os.path.join(src.utils.logger.LOGS_ARCHIVE_DIR, utcnow.strftime("%Y-%m-%d.log")),
-            src.utils.MessagingAgent.get_message_archive_file(),
+            os.path.join(src.utils.logger.LOGS_ARCHIVE_DIR, utcnow.strftime("%Y-%m-%d.jsonl")),
+            os.path.join(
+                src.utils.logger.LOGS_ARCHIVE_DIR,
+                utcnow.strftime("%Y-%m-%d.jsonl") + src.utils.archive_rotation.ARCHIVE_INDEX_SUFFIX,
+            ),
+            src.utils.messaging_agent.MESSAGE_ARCHIVE_DIR,
             src.utils.messaging_agent.ACTIVE_QUEUE_FILE,
+            src.utils.messaging_agent.ACTIVE_QUEUE_FILE + "-wal",
+            src.utils.messaging_agent.ACTIVE_QUEUE_FILE + "-shm",
+            src.utils.ColumnarMessageArchive.get_day_directory(utcnow.date()),
+            src.utils.state_interface.STATE_FILE,
+            src.utils.state_interface.STATE_STORE_FILE,
+            src.utils.state_history.STATE_HISTORY_DIR,
         ]
 
+        # the shared messaging agent and the state store reopen their files on the next use
+        if src.utils.MessagingAgent.shared_instance is not None:
+            src.utils.MessagingAgent.shared_instance.teardown()
+        src.utils.StateInterface.close()
+
         # move production files to temporary files
         for path in paths:
             tmp_path = path + ".tmp"
-            assert not os.path.isfile(tmp_path), (
+            assert not os.path.exists(tmp_path), (
                 f"the temporary file {tmp_path} already exists, " + "please delete it manually"
             )
-            if os.path.isfile(path):
+            if os.path.exists(path):
                 os.rename(path, tmp_path)
+        os.makedirs(src.utils.messaging_agent.MESSAGE_ARCHIVE_DIR)
 
         yield
 
+        if src.utils.MessagingAgent.shared_instance is not None:
+            src.utils.MessagingAgent.shared_instance.teardown()
+        src.utils.StateInterface.close()
+
         # restore production files
         for path in paths:
             tmp_path = path + ".tmp"
-            if os.path.isfile(path):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.isfile(path):
                 os.remove(path)
-            if os.path.isfile(tmp_path):
+            if os.path.exists(tmp_path):
                 os.rename(tmp_path, path)
 
 
@@ -1,7 +1,10 @@
 import atexit
+import os
 import signal
+import threading
 import time
 from typing import Any
+import psutil
 import pytest
 import src
 from ..fixtures import provide_test_config, restore_production_files
@@ -23,6 +26,32 @@ def pytest_dummy_procedure(config: src.types.Config, name: str) -> None:
     time.sleep(8)
 
 
+def pytest_crashing_procedure(config: src.types.Config, name: str) -> None:
+    config.logging_verbosity.ring_buffer = "DEBUG"
+    logger = src.utils.Logger(config, origin=name)
+    logger.info("Pytest crashing procedure was started")
+    logger.debug("about to crash", details="some details")
+    os._exit(1)
+
+
+def pytest_stubborn_procedure(config: src.types.Config, name: str) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(20)
+
+
+def pytest_memory_procedure(config: src.types.Config, name: str) -> None:
+    data = b"x" * 200_000_000
+    time.sleep(20)
+    del data  # keeps the memory allocated while sleeping
+
+
+def pytest_stalling_procedure(config: src.types.Config, name: str) -> None:
+    for _ in range(5):
+        src.utils.Heartbeat.beat()
+        time.sleep(0.1)
+    time.sleep(20)
+
+
 def expected_log_entries(count: int) -> None:
     log_file_content = src.utils.Logger.read_current_log_file()
     if log_file_content is None:
@@ -82,3 +111,228 @@ def test_lifecycle_manager(
     except RuntimeError as e:
         pass
     expected_log_entries(2)
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_lifecycle_manager_crash_report(
+    provide_test_config: src.types.Config,
+    restore_production_files: None,
+) -> None:
+    buffer_path = src.utils.LogRingBuffer.get_path("pytest-crashing-procedure")
+    if os.path.isfile(buffer_path):
+        os.remove(buffer_path)
+
+    lm = src.utils.LifecycleManager(
+        config=provide_test_config,
+        entrypoint=pytest_crashing_procedure,
+        name="pytest-crashing-procedure",
+        variant="procedure",
+    )
+    try:
+        lm.start_procedure()
+        assert lm.process is not None
+        lm.process.join(5)
+        lm.check_procedure_status()
+        assert not lm.procedure_is_running()
+
+        log_file_content = src.utils.Logger.read_current_log_file()
+        assert log_file_content is not None
+        assert "Process died unexpectedly (exit code 1)" in log_file_content
+        crash_report = log_file_content.split("Process died unexpectedly")[1]
+        assert "Pytest crashing procedure was started" in crash_report
+        assert "about to crash\n--- details " in crash_report
+    finally:
+        os.remove(buffer_path)
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_supervisor(
+    provide_test_config: src.types.Config,
+    restore_production_files: None,
+) -> None:
+    buffer_path = src.utils.LogRingBuffer.get_path("pytest-crashing-procedure")
+    lm = src.utils.LifecycleManager(
+        config=provide_test_config,
+        entrypoint=pytest_crashing_procedure,
+        name="pytest-crashing-procedure",
+        variant="procedure",
+    )
+    supervisor = src.utils.Supervisor([lm])
+    try:
+        # the first crash is noticed right away and restarted without delay
+        supervisor.start_procedures()
+        assert lm.procedure_is_running()
+        t = time.time()
+        supervisor.wait(timeout=10)
+        assert time.time() - t < 5
+        assert not lm.procedure_is_running()
+        assert lm.get_seconds_until_restart() == 0
+
+        # the second crash in a row delays the restart
+        supervisor.start_procedures()
+        assert lm.procedure_is_running()
+        supervisor.wait(timeout=10)
+        assert not lm.procedure_is_running()
+        assert lm.get_seconds_until_restart() > 4
+        supervisor.start_procedures()
+        assert not lm.procedure_is_running()
+
+        # waiting can be interrupted through the control pipe
+        threading.Timer(0.2, supervisor.wake_up).start()
+        t = time.time()
+        supervisor.wait(timeout=10)
+        assert 0.1 < time.time() - t < 2
+
+        log_file_content = src.utils.Logger.read_current_log_file()
+        assert log_file_content is not None
+        assert log_file_content.count("Process died unexpectedly (exit code 1)") == 2
+        assert "Process crashed 2 times in a row, delaying its restart by 5 seconds" in (
+            log_file_content
+        )
+    finally:
+        if os.path.isfile(buffer_path):
+            os.remove(buffer_path)
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_supervisor_teardown(
+    provide_test_config: src.types.Config,
+    restore_production_files: None,
+) -> None:
+    lifecycle_managers = [
+        src.utils.LifecycleManager(
+            config=provide_test_config,
+            entrypoint=entrypoint,
+            name=f"pytest-teardown-procedure-{i}",
+            variant="procedure",
+        )
+        for i, entrypoint in enumerate(
+            [pytest_dummy_procedure, pytest_stubborn_procedure, pytest_stubborn_procedure]
+        )
+    ]
+    supervisor = src.utils.Supervisor(lifecycle_managers)
+    supervisor.start_procedures()
+    time.sleep(0.5)
+    processes = [lm.process for lm in lifecycle_managers]
+
+    # all processes are waited for at the same time until the global deadline
+    t = time.time()
+    supervisor.teardown(timeout=1)
+    assert 0.9 < time.time() - t < 1.9
+    assert not any([lm.procedure_is_running() for lm in lifecycle_managers])
+    for process in processes:
+        assert process is not None
+        process.join(1)
+        assert not process.is_alive()
+    assert processes[0] is not None and processes[0].exitcode == 0
+
+    log_file_content = src.utils.Logger.read_current_log_file()
+    assert log_file_content is not None
+    assert log_file_content.count("killing it forcefully") == 2
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_resource_accounting(
+    provide_test_config: src.types.Config,
+    restore_production_files: None,
+) -> None:
+    provide_test_config.resource_accounting = src.types.config._ResourceAccountingConfig(
+        seconds_between_samples=1,
+        limits={
+            "pytest-memory-procedure": src.types.config._ResourceLimitsConfig(
+                max_rss_mb=100, max_open_files=64, nice=5
+            )
+        },
+    )
+    lm = src.utils.LifecycleManager(
+        config=provide_test_config,
+        entrypoint=pytest_memory_procedure,
+        name="pytest-memory-procedure",
+        variant="procedure",
+    )
+    supervisor = src.utils.Supervisor([lm])
+    try:
+        supervisor.start_procedures()
+        assert lm.process is not None
+        process = psutil.Process(lm.process.pid)
+        assert process.nice() == 5
+        assert process.rlimit(psutil.RLIMIT_NOFILE) == (64, 64)
+
+        # the process is sampled after one second and killed for using too much memory
+        t = time.time()
+        while lm.procedure_is_running() and (time.time() - t < 10):
+            supervisor.wait(timeout=5)
+        assert not lm.procedure_is_running()
+        assert time.time() - t < 5
+
+        log_file_content = src.utils.Logger.read_current_log_file()
+        assert log_file_content is not None
+        assert "(limit: 100.0 MB), killing it" in log_file_content
+        assert "Process died unexpectedly (exit code -9)" in log_file_content
+
+        messages = src.utils.MessagingAgent.get_shared(provide_test_config).get_n_latest_messages(
+            100
+        )
+        usages = [
+            float(m.message_body.data["pytest-memory-procedure_rss_mb"])
+            for m in messages
+            if isinstance(m.message_body, src.types.DataMessageBody)
+            and "pytest-memory-procedure_rss_mb" in m.message_body.data
+        ]
+        assert any([usage > 100 for usage in usages])
+    finally:
+        if lm.procedure_is_running():
+            lm.teardown()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_heartbeat(
+    provide_test_config: src.types.Config,
+    restore_production_files: None,
+) -> None:
+    # beating outside of a lifecycle manager does nothing
+    src.utils.Heartbeat.beat()
+
+    provide_test_config.heartbeats = src.types.config._HeartbeatConfig(
+        timeouts={"pytest-stalling-procedure": 1}
+    )
+    lm = src.utils.LifecycleManager(
+        config=provide_test_config,
+        entrypoint=pytest_stalling_procedure,
+        name="pytest-stalling-procedure",
+        variant="procedure",
+    )
+    supervisor = src.utils.Supervisor([lm])
+    try:
+        supervisor.start_procedures()
+        time.sleep(0.7)
+        statistics = lm.get_heartbeat_statistics()
+        assert statistics is not None
+        assert statistics.iteration_count == 4
+        assert statistics.mean_seconds is not None and 0.09 < statistics.mean_seconds < 0.2
+        assert statistics.max_seconds is not None and statistics.max_seconds < 0.3
+        seconds_until_deadline = lm.get_seconds_until_heartbeat_deadline()
+        assert seconds_until_deadline is not None and 0.5 < seconds_until_deadline < 1
+
+        # the stalled process is killed shortly after its deadline, and it
+        # is not killed a second time while it is being reaped
+        t = time.time()
+        while lm.procedure_is_running() and (time.time() - t < 10):
+            supervisor.wait(timeout=5)
+        assert not lm.procedure_is_running()
+        assert time.time() - t < 1.5
+
+        log_file_content = src.utils.Logger.read_current_log_file()
+        assert log_file_content is not None
+        assert "Process has not sent a heartbeat for 1." in log_file_content
+        assert '"iteration_count": 4' in log_file_content
+        assert "Process died unexpectedly (exit code -9)" in log_file_content
+        assert log_file_content.count("Process has not sent a heartbeat") == 1
+    finally:
+        if lm.procedure_is_running():
+            lm.teardown()
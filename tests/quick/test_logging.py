@@ -1,5 +1,7 @@
 import datetime
 import os
+import time
+import filelock
 import pytest
 from ..fixtures import restore_production_files
 import src
@@ -84,6 +86,339 @@ def test_logging_to_messages(restore_production_files: None) -> None:
     assert len(messaging_agent.get_n_latest_messages(10)) == 0
 
 
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_async_logging(restore_production_files: None) -> None:
+    config = src.types.Config.load_template()
+    assert config.backend is not None
+    config.logging_verbosity.console_prints = None
+    config.logging_verbosity.file_archive = "DEBUG"
+    config.logging_verbosity.message_sending = "INFO"
+    config.async_logging = src.types.config._AsyncLoggingConfig(
+        max_queue_size=1, overflow_policy="drop_new"
+    )
+    dropping_logger = src.utils.Logger(config=config, origin="origin-1")
+    config = config.model_copy(deep=True)
+    assert config.async_logging is not None
+    config.async_logging.overflow_policy = "block"
+    logger_1 = src.utils.Logger(config=config, origin="origin-1")
+    logger_2 = src.utils.Logger(config=config, origin="origin-2")
+    messaging_agent = src.utils.MessagingAgent()
+    logging_file = os.path.join(
+        src.utils.logger.LOGS_ARCHIVE_DIR,
+        datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d.log"),
+    )
+
+    def read_lines() -> list[str]:
+        with open(logging_file, "r") as f:
+            return f.readlines()
+
+    try:
+        # records are written by the background thread
+        for i in range(50):
+            logger_1.debug(f"debug message {i}")
+            logger_2.info(f"info message {i}")
+        logger_1.flush()
+        lines = read_lines()
+        assert len(lines) == 100
+        assert "origin-1" in lines[0] and "debug message 0" in lines[0]
+        assert "origin-2" in lines[-1] and "info message 49" in lines[-1]
+        assert len(messaging_agent.get_n_latest_messages(200)) == 50
+
+        # logging does not block while the writer waits for the file lock
+        with filelock.FileLock(src.utils.logger.FILELOCK_PATH, timeout=3):
+            dropping_logger.info("first message")
+            time.sleep(0.2)
+            t = time.time()
+            for i in range(100):
+                dropping_logger.info(f"message {i}")
+            assert time.time() - t < 1
+        dropping_logger.flush()
+        lines = read_lines()[100:]
+        assert "first message" in lines[0]
+        assert len(lines) < 100
+        assert "log records because the log queue was full" in lines[-1]
+    finally:
+        src.utils.logger._AsyncLogWriter.get(config).stop()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_log_suppression(restore_production_files: None) -> None:
+    config = src.types.Config.load_template()
+    assert config.backend is not None
+    config.logging_verbosity.console_prints = None
+    config.logging_verbosity.file_archive = "DEBUG"
+    config.logging_verbosity.message_sending = "DEBUG"
+    config.log_suppression = src.types.config._LogSuppressionConfig(
+        deduplication_window=0.5, message_rate_limit=60, message_burst=3
+    )
+    logger = src.utils.Logger(config=config, origin="some-origin")
+    messaging_agent = src.utils.MessagingAgent()
+    logging_file = os.path.join(
+        src.utils.logger.LOGS_ARCHIVE_DIR,
+        datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d.log"),
+    )
+
+    def read_lines() -> list[str]:
+        with open(logging_file, "r") as f:
+            return [line for line in f.readlines() if line[0] == "2"]
+
+    # repeated records are collapsed, the summary is written after the window
+    # without waiting for another record
+    for _ in range(5):
+        try:
+            4 / 0
+        except Exception as e:
+            logger.exception(e)
+    assert len(read_lines()) == 1
+    time.sleep(0.7)
+    lines = read_lines()
+    assert len(lines) == 2
+    assert "ZeroDivisionError: division by zero (repeated 4 times in the last" in lines[1]
+    logger.info("other message")
+    assert "other message" in read_lines()[2]
+
+    # pending summaries are written on flush
+    for _ in range(3):
+        logger.info("repeated message")
+    logger.flush()
+    lines = read_lines()
+    assert len(lines) == 5
+    assert "repeated message (repeated 2 times in the last 0 seconds)" in lines[4]
+
+    # the message sending is rate limited, the file archive is not; the first
+    # three records above have used up the burst of three messages, and all
+    # loggers of the same origin share the limit
+    other_logger = src.utils.Logger(config=config, origin="some-origin")
+    for i in range(5):
+        other_logger.debug(f"message {i}")
+    assert len(read_lines()) == 10
+    messages = messaging_agent.get_n_latest_messages(20)
+    assert len(messages) == 3
+    time.sleep(1.1)
+    logger.debug("message after the rate limit")
+    messages = messaging_agent.get_n_latest_messages(20)
+    assert len(messages) == 4
+    assert messages[-1].message_body.variant == "log"
+    assert "message after the rate limit" in messages[-1].message_body.subject
+    assert "7 earlier log messages" in messages[-1].message_body.body
+
+    # loggers of the same origin share the deduplication, so the summary is
+    # written once, no matter which logger is flushed
+    logger_1 = src.utils.Logger(config=config, origin="shared-origin")
+    logger_2 = src.utils.Logger(config=config, origin="shared-origin")
+    line_count = len(read_lines())
+    logger_1.warning("shared message")
+    logger_2.warning("shared message")
+    logger_2.warning("shared message")
+    assert len(read_lines()) == line_count + 1
+    logger_2.flush()
+    logger_1.flush()
+    lines = read_lines()
+    assert len(lines) == line_count + 2
+    assert "shared message (repeated 2 times in the last 0 seconds)" in lines[-1]
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_structured_log_archive(restore_production_files: None) -> None:
+    config = src.types.Config.load_template()
+    config.logging_verbosity.console_prints = None
+    config.logging_verbosity.file_archive = None
+    config.logging_verbosity.message_sending = None
+    config.logging_verbosity.structured_archive = "INFO"
+    logger_1 = src.utils.Logger(config=config, origin="origin-1")
+    logger_2 = src.utils.Logger(config=config, origin="origin-2")
+    start = datetime.datetime.now(datetime.timezone.utc)
+
+    logger_1.debug("debug message")
+    logger_1.info("info message", details="some details")
+    logger_2.warning("warning message")
+    try:
+        4 / 0
+    except Exception as e:
+        logger_2.exception(e, label="label")
+    end = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=1)
+
+    records = list(src.utils.Logger.iterate_log_archive(start, end))
+    assert [r.subject for r in records] == [
+        "info message",
+        "warning message",
+        "label, ZeroDivisionError: division by zero",
+    ]
+    assert records[0].origin == "origin-1"
+    assert records[0].details == {"details": "some details"}
+    assert "Traceback" in records[2].details["traceback"]
+
+    records = list(src.utils.Logger.iterate_log_archive(start, end, min_level="WARNING"))
+    assert [r.level for r in records] == ["WARNING", "EXCEPTION"]
+    records = list(src.utils.Logger.iterate_log_archive(start, end, origins=["origin-1"]))
+    assert [r.subject for r in records] == ["info message"]
+    records = list(src.utils.Logger.iterate_log_archive(start, start))
+    assert len(records) == 0
+
+    index = src.utils.LogArchiveIndexer.get_index(
+        os.path.join(
+            src.utils.logger.LOGS_ARCHIVE_DIR,
+            start.strftime("%Y-%m-%d.jsonl"),
+        )
+    )
+    assert index is not None
+    assert index.blocks[0].levels == {"INFO": 1, "WARNING": 1, "EXCEPTION": 1}
+    assert index.blocks[0].origins == ["origin-1", "origin-2"]
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_log_tail_and_follow(restore_production_files: None) -> None:
+    config = src.types.Config.load_template()
+    config.logging_verbosity.console_prints = None
+    config.logging_verbosity.file_archive = "DEBUG"
+    config.logging_verbosity.message_sending = None
+    logger = src.utils.Logger(config=config, origin="pytests")
+    log_file = os.path.join(
+        src.utils.logger.LOGS_ARCHIVE_DIR,
+        datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d.log"),
+    )
+
+    assert src.utils.Logger.tail_log_file(3) == []
+    for i in range(500):
+        logger.debug(f"record {i} " + ("x" * 200))
+    logger.info("second to last record", details="line 1\nline 2")
+    logger.info("last record")
+
+    records = src.utils.Logger.tail_log_file(3)
+    assert "record 499 x" in records[0]
+    assert records[1].split("\n")[0].endswith("- second to last record")
+    assert "line 1\nline 2\n" in records[1]
+    assert records[2].split("\n")[0].endswith("- last record")
+    assert len(src.utils.Logger.tail_log_file(1000)) == 502
+
+    # a record that is still being written is excluded
+    with open(log_file, "a") as f:
+        f.write("2000-01-01 00:00:00.000 UTC+0 - pytests")
+    assert src.utils.Logger.tail_log_file(1)[0] == records[2]
+    with open(log_file, "a") as f:
+        f.write(" - INFO - partial record\n")
+
+    follower = src.utils.Logger.follow_log_file(n=2, poll_interval=0.01)
+    assert next(follower) == records[2]
+    assert next(follower).split("\n")[0].endswith("- partial record")
+    logger.info("new record 1", details="details 1")
+    logger.info("new record 2")
+    new_record = next(follower)
+    assert new_record.split("\n")[0].endswith("- new record 1")
+    assert "details 1" in new_record
+    assert next(follower).split("\n")[0].endswith("- new record 2")
+    follower.close()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_log_ring_buffer(restore_production_files: None) -> None:
+    config = src.types.Config.load_template()
+    config.logging_verbosity.console_prints = None
+    config.logging_verbosity.file_archive = None
+    config.logging_verbosity.message_sending = None
+    config.logging_verbosity.ring_buffer = "INFO"
+    buffer_path = src.utils.LogRingBuffer.get_path("pytests-ring-buffer")
+    small_buffer_path = os.path.join(
+        src.utils.log_ring_buffer.LOG_RING_BUFFER_DIR, "pytests.buffer"
+    )
+    for path in [buffer_path, small_buffer_path]:
+        if os.path.isfile(path):
+            os.remove(path)
+
+    try:
+        assert src.utils.LogRingBuffer.read("pytests-ring-buffer") == []
+        logger = src.utils.Logger(config=config, origin="pytests-ring-buffer")
+        logger.debug("debug message")
+        logger.info("info message 1", details="some details")
+        logger.info("info message 2")
+        logger.warning("warning message")
+
+        records = src.utils.LogRingBuffer.read("pytests-ring-buffer", n=2)
+        assert len(records) == 2
+        assert records[0].endswith("- info message 2\n")
+        assert records[1].endswith("- warning message\n")
+        records = src.utils.LogRingBuffer.read("pytests-ring-buffer")
+        assert len(records) == 3
+        assert "info message 1\n--- details " in records[0]
+        assert not os.path.isfile(
+            os.path.join(
+                src.utils.logger.LOGS_ARCHIVE_DIR,
+                datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d.log"),
+            )
+        )
+
+        # old records are overwritten and long records are truncated
+        small_buffer = src.utils.LogRingBuffer(small_buffer_path, slots=4, slot_size=32)
+        for i in range(10):
+            small_buffer.append(f"record {i}\n")
+        small_buffer.append("x" * 100)
+        assert src.utils.LogRingBuffer.read("pytests") == [
+            "record 7\n",
+            "record 8\n",
+            "record 9\n",
+            "x" * 20,
+        ]
+        assert "pytests" in src.utils.LogRingBuffer.list_origins()
+
+        # writing continues after the last record when the buffer is reopened
+        src.utils.LogRingBuffer(small_buffer_path, slots=4, slot_size=32).append("record 11\n")
+        assert src.utils.LogRingBuffer.read("pytests", n=2) == ["x" * 20, "record 11\n"]
+    finally:
+        for path in [buffer_path, small_buffer_path]:
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_lazy_log_details(restore_production_files: None) -> None:
+    config = src.types.Config.load_template()
+    config.logging_verbosity.console_prints = None
+    config.logging_verbosity.file_archive = "INFO"
+    config.logging_verbosity.message_sending = "DEBUG"
+    config.backend = None
+    logger = src.utils.Logger(config=config, origin="pytests")
+    assert logger.visible_levels == {"INFO", "WARNING", "ERROR", "EXCEPTION"}
+
+    calls: list[str] = []
+
+    def details(label: str) -> str:
+        calls.append(label)
+        return f"{label} details"
+
+    logger.debug("debug message", details=lambda: details("debug"))
+    logger.info("info message", details=lambda: details("info"))
+    logger.warning("warning message", details=lambda: None)
+    assert calls == ["info"]
+
+    log_file_content = src.utils.Logger.read_current_log_file()
+    assert log_file_content is not None
+    assert "debug message" not in log_file_content
+    assert "- info message\n--- details ---" in log_file_content
+    assert "info details\n" in log_file_content
+    assert "- warning message\n" in log_file_content
+    assert "--- details ---" not in log_file_content.split("warning message")[1]
+
+    # the cached timestamp matches the uncached formatting
+    timestamp = log_file_content.split(" UTC")[0]
+    assert datetime.datetime.fromisoformat(timestamp + ":00").tzinfo is not None
+
+    silent_config = config.model_copy(deep=True)
+    silent_config.logging_verbosity.file_archive = None
+    silent_logger = src.utils.Logger(config=silent_config, origin="pytests")
+    assert silent_logger.visible_levels == set()
+    try:
+        4 / 0
+    except Exception as e:
+        silent_logger.exception(e, details=lambda: details("exception"))
+    assert calls == ["info"]
+
+
 @pytest.mark.order(2)
 @pytest.mark.quick
 def test_log_level_visibiliy() -> None:
@@ -3,11 +3,16 @@ import os
 import time
 import pytest
 import itertools
+import sqlite3
+import pathlib
+import threading
+import multiprocessing
 
 import tum_esm_utils
 import src
 from ..fixtures import restore_production_files
-from src.utils.messaging_agent import MessagingAgent, ACTIVE_QUEUE_FILE
+from src.utils.messaging_agent import MessagingAgent, ACTIVE_QUEUE_FILE, MESSAGE_ARCHIVE_DIR
+from src.utils.archive_writer import MessageArchiveWriter
 from src.types import DataMessageBody, LogMessageBody, ConfigMessageBody
 
 
@@ -17,6 +22,8 @@ def test_simple_addition_and_deletion(restore_production_files: None) -> None:
     archive_file = MessagingAgent.get_message_archive_file()
 
     agent = MessagingAgent()
+    assert not os.path.isfile(ACTIVE_QUEUE_FILE), "the connection should be opened lazily"
+    assert agent.connection.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
     assert os.path.isfile(ACTIVE_QUEUE_FILE)
     assert not os.path.isfile(archive_file)
     assert len(agent.get_n_latest_messages(1)) == 0
@@ -52,6 +59,10 @@ def test_simple_addition_and_deletion(restore_production_files: None) -> None:
     agent.remove_messages(mids)
     assert len(agent.get_n_latest_messages(3)) == 0
 
+    # checkpointing does not change the queue
+    agent.checkpoint()
+    assert len(agent.get_n_latest_messages(3)) == 0
+
     # close SQLite connection
     agent.teardown()
 
@@ -144,3 +155,674 @@ def test_message_archive_integrity(restore_production_files: None) -> None:
     assert timestamps == list(sorted(timestamps)), "messages are not sorted by timestamp"
     for i in range(len(message_bodies)):
         assert message_bodies[i] == archive_messages[i].message_body
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_batch_insert_and_group_commit(restore_production_files: None) -> None:
+    archive_file = MessagingAgent.get_message_archive_file()
+    agent = MessagingAgent()
+
+    # batch insert
+    agent.add_messages([DataMessageBody(data={"test": i}) for i in range(5)])
+    assert len(agent.get_n_latest_messages(20)) == 5, "batch was not added"
+    with open(archive_file, "r") as f:
+        assert len(f.readlines()) == 6
+
+    # group commit by size
+    buffered_agent = MessagingAgent(group_commit_size=3)
+    buffered_agent.add_message(DataMessageBody(data={"test": "buffered-1"}))
+    buffered_agent.add_message(DataMessageBody(data={"test": "buffered-2"}))
+    assert len(agent.get_n_latest_messages(20)) == 5, "messages should still be buffered"
+    buffered_agent.add_message(DataMessageBody(data={"test": "buffered-3"}))
+    assert len(agent.get_n_latest_messages(20)) == 8, "buffer was not flushed"
+
+    # group commit by interval, also without any further message
+    buffered_agent = MessagingAgent(group_commit_interval_ms=100)
+    buffered_agent.add_message(DataMessageBody(data={"test": "buffered-4"}))
+    buffered_agent.add_message(DataMessageBody(data={"test": "buffered-5"}))
+    assert len(agent.get_n_latest_messages(20)) == 8, "message should still be buffered"
+    time.sleep(0.3)
+    assert len(agent.get_n_latest_messages(20)) == 10, "buffer was not flushed"
+
+    # a forked child does not write the messages buffered in its parent
+    buffered_agent.add_message(DataMessageBody(data={"test": "buffered-parent"}))
+    context = multiprocessing.get_context("fork")
+    process = context.Process(target=buffered_agent.flush)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert len(agent.get_n_latest_messages(20)) == 10, "parent messages written by the child"
+    buffered_agent.flush()
+    assert len(agent.get_n_latest_messages(20)) == 11, "buffer was not flushed"
+
+    # flush on teardown
+    buffered_agent.add_message(DataMessageBody(data={"test": "buffered-6"}))
+    buffered_agent.teardown()
+    assert len(agent.get_n_latest_messages(20)) == 12, "buffer was not flushed on teardown"
+
+    archive_messages = MessagingAgent.load_message_archive(
+        datetime.datetime.now(datetime.timezone.utc).date()
+    )
+    assert len(archive_messages) == 12, "message archive is wrong"
+    timestamps = [message.timestamp for message in archive_messages]
+    assert timestamps == list(sorted(timestamps)), "messages are not sorted by timestamp"
+
+    agent.teardown()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_shared_messaging_agent(restore_production_files: None) -> None:
+    agent = MessagingAgent.get_shared()
+    assert MessagingAgent.get_shared() is agent
+    agent.add_message(DataMessageBody(data={"test": "main thread"}))
+
+    # each thread uses its own connection
+    thread = threading.Thread(
+        target=lambda: agent.add_message(DataMessageBody(data={"test": "other thread"}))
+    )
+    thread.start()
+    thread.join()
+    assert len(agent.open_connections) == 2
+
+    # a forked process opens its own connections
+    process = multiprocessing.get_context("fork").Process(
+        target=lambda: MessagingAgent.get_shared().add_message(
+            DataMessageBody(data={"test": "forked process"})
+        )
+    )
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert len(agent.open_connections) == 2
+
+    messages = agent.get_n_latest_messages(10)
+    assert sorted([m.message_body.data["test"] for m in messages]) == [  # type: ignore
+        "forked process",
+        "main thread",
+        "other thread",
+    ]
+    archive_messages = MessagingAgent.load_message_archive(
+        datetime.datetime.now(datetime.timezone.utc).date()
+    )
+    assert len(archive_messages) == 3
+
+    # the agent can be used again after a teardown
+    agent.teardown()
+    assert len(agent.open_connections) == 0
+    assert len(agent.get_n_latest_messages(10)) == 3
+
+    # the durability level is taken from the config
+    config = src.types.Config.load_template()
+    config.message_queue.synchronous = "FULL"
+    durable_agent = MessagingAgent(config=config)
+    assert durable_agent.connection.execute("PRAGMA synchronous;").fetchone()[0] == 2
+    durable_agent.teardown()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_message_claiming(restore_production_files: None) -> None:
+    agent = MessagingAgent()
+    for i in range(3):
+        agent.add_message(DataMessageBody(data={"test": i}))
+        time.sleep(0.01)
+
+    # claimed messages are not claimed again
+    first_claim = agent.claim_n_latest_messages(2)
+    assert [m.message_body.data["test"] for m in first_claim] == [0, 1]  # type: ignore
+    second_claim = agent.claim_n_latest_messages(2)
+    assert [m.message_body.data["test"] for m in second_claim] == [2]  # type: ignore
+    assert len(agent.claim_n_latest_messages(2)) == 0
+
+    # claimed messages are still part of the queue
+    assert len(agent.get_n_latest_messages(5)) == 3
+
+    # released messages can be claimed again
+    agent.release_messages([first_claim[1].identifier])
+    third_claim = agent.claim_n_latest_messages(5)
+    assert [m.identifier for m in third_claim] == [first_claim[1].identifier]
+
+    # expired leases are reclaimed automatically, renewed ones are not
+    agent.release_messages([m.identifier for m in first_claim + second_claim])
+    short_claim = agent.claim_n_latest_messages(3, lease_duration=0.2)
+    assert len(short_claim) == 3
+    agent.renew_message_leases([short_claim[0].identifier], lease_duration=60)
+    time.sleep(0.3)
+    fourth_claim = agent.claim_n_latest_messages(5)
+    assert [m.identifier for m in fourth_claim] == [m.identifier for m in short_claim[1:]]
+
+    # removed messages are gone
+    agent.remove_messages([m.identifier for m in short_claim])
+    assert len(agent.get_n_latest_messages(5)) == 0
+
+    agent.teardown()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_queue_schema_migration(restore_production_files: None) -> None:
+    # active message queue as created by older versions
+    connection = sqlite3.connect(ACTIVE_QUEUE_FILE)
+    with connection:
+        connection.execute(
+            """
+                CREATE TABLE QUEUE (
+                    internal_id INTEGER PRIMARY KEY,
+                    timestamp DOUBLE NOT NULL,
+                    message_body TEXT NOT NULL
+                );
+            """
+        )
+        connection.execute(
+            "INSERT INTO QUEUE (timestamp, message_body) VALUES (?, ?);",
+            (time.time(), DataMessageBody(data={"test": "old"}).model_dump_json()),
+        )
+
+    agent = MessagingAgent()
+    messages = agent.claim_n_latest_messages(5)
+    assert len(messages) == 1
+    assert messages[0].message_body == DataMessageBody(data={"test": "old"})
+    assert agent.get_queue_statistics().message_count == 1
+    agent.teardown()
+
+    # the size of the queue is only computed when the statistics are created,
+    # later connections do not scan the queue again
+    with connection:
+        connection.execute("UPDATE QUEUE_STATISTICS SET message_count = 7 WHERE id = 0;")
+    connection.close()
+    agent = MessagingAgent()
+    assert agent.get_queue_statistics().message_count == 7
+    agent.teardown()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_queue_limits(restore_production_files: None) -> None:
+    agent = MessagingAgent()
+
+    def fill_queue() -> None:
+        agent.remove_messages([m.identifier for m in agent.get_n_latest_messages(100)])
+        for i in range(4):
+            agent.add_messages(
+                [
+                    DataMessageBody(data={"test": i}),
+                    LogMessageBody(level="DEBUG", subject="test", body="test"),
+                    LogMessageBody(level="ERROR", subject="test", body="test"),
+                ]
+            )
+        assert agent.get_queue_statistics().message_count == 12
+
+    # statistics are kept up to date
+    fill_queue()
+    statistics = agent.get_queue_statistics()
+    assert statistics.message_bytes == sum(
+        len(m.message_body.model_dump_json()) for m in agent.get_n_latest_messages(100)
+    )
+    assert statistics.dropped_messages == {}
+
+    # drop oldest
+    assert agent.enforce_queue_limits(12, None, "drop_oldest") == {}
+    assert agent.enforce_queue_limits(9, None, "drop_oldest") == {
+        "data": 1,
+        "debug": 1,
+        "error": 1,
+    }
+    assert agent.get_queue_statistics().message_count == 9
+
+    # drop by category
+    fill_queue()
+    assert agent.enforce_queue_limits(6, None, "drop_by_category") == {"debug": 4, "data": 2}
+    remaining = agent.get_n_latest_messages(100)
+    assert [m.message_body.data["test"] for m in remaining if m.message_body.variant == "data"] == [
+        2,
+        3,
+    ]
+
+    # downsample data
+    fill_queue()
+    assert agent.enforce_queue_limits(10, None, "downsample_data") == {"data": 2}
+    remaining = agent.get_n_latest_messages(100)
+    assert [m.message_body.data["test"] for m in remaining if m.message_body.variant == "data"] == [
+        0,
+        2,
+    ]
+
+    # limit by size, claimed messages are never dropped
+    fill_queue()
+    claimed = agent.claim_n_latest_messages(3)
+    max_bytes = agent.get_queue_statistics().message_bytes // 2
+    agent.enforce_queue_limits(None, max_bytes, "drop_oldest")
+    statistics = agent.get_queue_statistics()
+    assert statistics.message_bytes <= max_bytes
+    remaining_ids = {m.identifier for m in agent.get_n_latest_messages(100)}
+    assert {m.identifier for m in claimed}.issubset(remaining_ids)
+
+    # drop counters are persisted
+    assert MessagingAgent().get_queue_statistics().dropped_messages == statistics.dropped_messages
+    assert sum(statistics.dropped_messages.values()) > 13
+
+    agent.teardown()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_prioritized_claiming(restore_production_files: None) -> None:
+    config = src.types.Config.load_template().to_foreign_config()
+    agent = MessagingAgent()
+
+    # a backlog of data and debug logs with a few important messages at the end
+    agent.add_messages([DataMessageBody(data={"test": i}) for i in range(30)])
+    agent.add_messages(
+        [LogMessageBody(level="DEBUG", subject="test", body="test") for i in range(30)]
+    )
+    agent.add_message(LogMessageBody(level="EXCEPTION", subject="test", body="test"))
+    agent.add_message(ConfigMessageBody(status="accepted", config=config))
+
+    # important messages are claimed first
+    messages = agent.claim_prioritized_messages(4)
+    assert [m.message_body.variant for m in messages] == ["config", "log", "data", "data"]
+    assert messages[1].message_body.level == "EXCEPTION"  # type: ignore
+
+    # lanes with a lower priority are not starved
+    messages = agent.claim_prioritized_messages(10)
+    categories = [
+        "data" if m.message_body.variant == "data" else m.message_body.level  # type: ignore
+        for m in messages
+    ]
+    assert categories == (["data"] * 4 + ["DEBUG"]) * 2
+
+    # data messages are claimed oldest first
+    data_values = [
+        m.message_body.data["test"] for m in messages if m.message_body.variant == "data"
+    ]  # type: ignore
+    assert data_values == list(range(2, 10))
+
+    # leftover slots are passed on to other lanes
+    messages = agent.claim_prioritized_messages(100)
+    assert len(messages) == 62 - 14
+    assert len(agent.claim_prioritized_messages(100)) == 0
+
+    agent.teardown()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_columnar_archive(restore_production_files: None) -> None:
+    config = src.types.Config.load_template()
+    config.message_archive.columnar = True
+    agent = MessagingAgent(config=config)
+    start = datetime.datetime.now(datetime.timezone.utc)
+
+    agent.add_messages(
+        [
+            DataMessageBody(data={"temperature": 20.5, "humidity": 40, "label": "a"}),
+            DataMessageBody(data={"temperature": 21.5}),
+            LogMessageBody(level="INFO", subject="test", body="test"),
+        ]
+    )
+    time.sleep(0.05)
+    middle = datetime.datetime.now(datetime.timezone.utc)
+    agent.add_message(DataMessageBody(data={"temperature": 22.5, "wind/speed": 3.5}))
+    end = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=1)
+
+    # string values are only stored in the CSV archive
+    assert src.utils.ColumnarMessageArchive.list_keys(start.date()) == [
+        "humidity",
+        "temperature",
+        "wind/speed",
+    ]
+
+    # load all keys
+    columns = src.utils.ColumnarMessageArchive.load(start, end)
+    assert list(columns["temperature"][1]) == [20.5, 21.5, 22.5]
+    assert list(columns["humidity"][1]) == [40]
+    assert list(columns["wind/speed"][1]) == [3.5]
+    assert list(columns["temperature"][0]) == sorted(columns["temperature"][0])
+
+    # load a subset of keys in a subset of the time range
+    columns = src.utils.ColumnarMessageArchive.load(start, middle, ["temperature", "wind/speed"])
+    assert list(columns.keys()) == ["temperature"]
+    assert list(columns["temperature"][1]) == [20.5, 21.5]
+
+    agent.teardown()
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_message_archive_writer(tmp_path: pathlib.Path) -> None:
+    lock_path = str(tmp_path / "messages.lock")
+    day_1 = datetime.datetime(2000, 1, 1, 23, 59, 59, tzinfo=datetime.timezone.utc).timestamp()
+    day_2 = day_1 + 2
+    file_1, file_2 = str(tmp_path / "2000-01-01.csv"), str(tmp_path / "2000-01-02.csv")
+
+    def read_lines(path: str) -> list[str]:
+        with open(path, "r") as f:
+            return f.readlines()
+
+    # lines are buffered until the flush interval has passed
+    writer = MessageArchiveWriter(str(tmp_path), lock_path, flush_interval=60)
+    writer.write([(day_1, '{"variant":"data","data":{"a":1}}')])
+    assert not os.path.exists(file_1), "lines should still be buffered"
+    writer.flush()
+    assert read_lines(file_1) == [
+        "timestamp,message_body\n",
+        f'{day_1},"{{""variant"":""data"",""data"":{{""a"":1}}}}"\n',
+    ]
+
+    # lines are written to the file of their day
+    writer.write([(day_1, "{}"), (day_2, "{}")])
+    writer.close()
+    assert len(read_lines(file_1)) == 3
+    assert len(read_lines(file_2)) == 2
+
+    # buffered lines are written by a timer without another call to `write`
+    writer = MessageArchiveWriter(str(tmp_path), lock_path, flush_interval=0.5)
+    writer.write([(day_1, "{}")])
+    assert len(read_lines(file_1)) == 3
+    writer.write([(day_1, "{}")])
+    assert len(read_lines(file_1)) == 3, "lines should still be buffered"
+    time.sleep(1)
+    assert len(read_lines(file_1)) == 5
+
+    # a process started by multiprocessing writes its buffered lines when it exits
+    writer.flush()
+    process = multiprocessing.get_context("fork").Process(
+        target=writer.write, args=([(day_1, "{}")],)
+    )
+    process.start()
+    process.join()
+    assert len(read_lines(file_1)) == 6
+    writer.close()
+
+    # the file of the current day is kept open, late lines of past days
+    # are appended without closing it
+    writer = MessageArchiveWriter(str(tmp_path), lock_path, flush_interval=0, fsync=True)
+    now = time.time()
+    writer.write([(now, "{}")])
+    file_descriptor = writer.file_descriptor
+    assert file_descriptor is not None
+    writer.write([(now, "{}"), (day_2, "{}")])
+    assert writer.file_descriptor == file_descriptor, "file should be kept open"
+    assert len(read_lines(writer.get_file_path(now))) == 3
+    assert len(read_lines(file_2)) == 3
+    writer.close()
+    assert writer.file_descriptor is None
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_message_archive_iterator(restore_production_files: None) -> None:
+    days = [datetime.date(1999, 12, 31), datetime.date(2000, 1, 1)]
+    paths = [os.path.join(MESSAGE_ARCHIVE_DIR, day.strftime("%Y-%m-%d.csv")) for day in days]
+
+    # two days with one data and one log message every 6 hours
+    for day, path in zip(days, paths):
+        with open(path, "w") as f:
+            f.write("timestamp,message_body\n")
+            for hour in [0, 6, 12, 18]:
+                timestamp = datetime.datetime(
+                    day.year, day.month, day.day, hour, tzinfo=datetime.timezone.utc
+                ).timestamp()
+                for body in [
+                    DataMessageBody(data={"hour": hour, "day": day.day}),
+                    LogMessageBody(level="INFO", subject=f"hour {hour}", body="a, b"),
+                ]:
+                    body_string = body.model_dump_json().replace('"', '""')
+                    f.write(f'{timestamp},"{body_string}"\n')
+
+    start = datetime.datetime(1999, 12, 31, 12)
+    end = datetime.datetime(2000, 1, 1, 12)
+
+    messages = list(MessagingAgent.iterate_message_archive(start, end))
+    assert len(messages) == 8
+    assert messages[-1].message_body == LogMessageBody(level="INFO", subject="hour 6", body="a, b")
+
+    messages = list(
+        MessagingAgent.iterate_message_archive(start, end, variants=["data"], data_keys=["hour"])
+    )
+    assert [m.message_body.data for m in messages] == [  # type: ignore
+        {"hour": 12},
+        {"hour": 18},
+        {"hour": 0},
+        {"hour": 6},
+    ]
+    assert len(list(MessagingAgent.iterate_message_archive(start, end, data_keys=["x"]))) == 4
+
+    raw_messages = list(MessagingAgent.iterate_raw_message_archive(start, end, ["log"]))
+    assert len(raw_messages) == 4
+    assert all([isinstance(m[1], str) for m in raw_messages])
+
+    # the variant is checked on the parsed message, not only on the raw string
+    with open(os.path.join(MESSAGE_ARCHIVE_DIR, "2000-01-02.csv"), "w") as f:
+        f.write("timestamp,message_body\n")
+        body_string = '{"variant":"log","nested":{"variant":"data"}}'.replace('"', '""')
+        f.write(f'946771200.0,"{body_string}"\n')
+        body_string = DataMessageBody(data={"hour": 1}).model_dump_json().replace('"', '""')
+        f.write(f'946774800.0,"{body_string}"\n')
+    day_3 = datetime.datetime(2000, 1, 2), datetime.datetime(2000, 1, 3)
+    assert len(list(MessagingAgent.iterate_raw_message_archive(*day_3))) == 2
+    assert len(list(MessagingAgent.iterate_raw_message_archive(*day_3, ["data"]))) == 1
+
+    assert len(MessagingAgent.load_message_archive(days[0])) == 8
+
+    # the queries have created an index for each day
+    for day, path in zip(days, paths):
+        index = src.utils.MessageArchiveIndexer.get_index(path)
+        assert index is not None
+        assert os.path.isfile(path + ".index.json")
+        assert len(index.blocks) == 1
+        assert index.blocks[0].variants == {"data": 4, "log": 4}
+        assert index.blocks[0].data_keys == ["day", "hour"]
+
+    # compressed archive files are read transparently
+    src.utils.ArchiveRotation.compress_file(paths[0], "gzip")
+    assert not os.path.exists(paths[0])
+    assert len(MessagingAgent.load_message_archive(days[0])) == 8
+    assert len(list(MessagingAgent.iterate_message_archive(start, end))) == 8
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_message_archive_index(tmp_path: pathlib.Path) -> None:
+    path = str(tmp_path / "2000-01-01.csv")
+    block_size = src.utils.archive_index.ARCHIVE_INDEX_BLOCK_SIZE
+    start_timestamp = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+    def write_messages(first: int, count: int, partial_line: str = "") -> None:
+        with open(path, "a") as f:
+            if first == 0:
+                f.write("timestamp,message_body\n")
+            for i in range(first, first + count):
+                body: DataMessageBody | LogMessageBody = (
+                    LogMessageBody(level="INFO", subject=f"{i}", body="")
+                    if (i % 100 == 0)
+                    else DataMessageBody(data={f"key-{i // block_size}": i})
+                )
+                body_string = body.model_dump_json().replace('"', '""')
+                f.write(f'{start_timestamp + i},"{body_string}"\n')
+            f.write(partial_line)
+
+    assert src.utils.MessageArchiveIndexer.get_index(path) is None
+
+    write_messages(0, int(block_size * 1.5), partial_line='123.4,"{""var')
+    index = src.utils.MessageArchiveIndexer.get_index(path)
+    assert index is not None
+    assert [b.rows for b in index.blocks] == [block_size, block_size // 2]
+    assert index.blocks[0].variants == {"log": block_size // 100, "data": block_size * 99 // 100}
+    assert index.blocks[1].data_keys == ["key-1"]
+    assert index.indexed_bytes == os.path.getsize(path) - len('123.4,"{""var')
+
+    # the index is extended incrementally
+    with open(path, "r+") as f:
+        f.truncate(index.indexed_bytes)
+    write_messages(int(block_size * 1.5), block_size)
+    index = src.utils.MessageArchiveIndexer.get_index(path)
+    assert index is not None
+    assert [b.rows for b in index.blocks] == [block_size, block_size, block_size // 2]
+    assert [b.data_keys for b in index.blocks] == [["key-0"], ["key-1"], ["key-2"]]
+
+    # only the matching blocks are selected and read
+    blocks = src.utils.MessageArchiveIndexer.select_blocks(
+        index, start_timestamp=start_timestamp + block_size + 10
+    )
+    assert blocks == index.blocks[1:]
+    blocks = src.utils.MessageArchiveIndexer.select_blocks(index, data_keys=["key-0"])
+    assert blocks == index.blocks
+    blocks = src.utils.MessageArchiveIndexer.select_blocks(
+        index, variants=["data"], data_keys=["key-0"]
+    )
+    assert blocks == index.blocks[:1]
+    messages = list(src.utils.MessageArchiveIndexer.iterate_blocks(path, index.blocks[2:]))
+    assert len(messages) == block_size // 2
+    assert messages[0][0] == start_timestamp + (2 * block_size)
+
+    # the index is rebuilt from the compressed file and extended when lines are appended
+    src.utils.ArchiveRotation.compress_file(path, "gzip")
+    compressed_index = src.utils.MessageArchiveIndexer.get_index(path)
+    assert compressed_index is not None
+    assert compressed_index.source_file == "2000-01-01.csv.gz"
+    assert compressed_index.blocks == index.blocks
+    assert (
+        list(src.utils.MessageArchiveIndexer.iterate_blocks(path, compressed_index.blocks[2:]))
+        == messages
+    )
+    late_body = DataMessageBody(data={"late": 1}).model_dump_json().replace('"', '""')
+    src.utils.archive_rotation.append_to_archive_file(
+        path, f'{start_timestamp + 1},"{late_body}"\n'.encode()
+    )
+    compressed_index = src.utils.MessageArchiveIndexer.get_index(path)
+    assert compressed_index is not None
+    assert [b.rows for b in compressed_index.blocks] == [
+        block_size,
+        block_size,
+        block_size // 2 + 1,
+    ]
+    assert compressed_index.blocks[2].data_keys == ["key-2", "late"]
+    assert compressed_index.indexed_bytes > index.indexed_bytes
+
+    # the index is rebuilt when another file stores the day or when the file shrinks
+    write_messages(0, 10)
+    plain_index = src.utils.MessageArchiveIndexer.get_index(path)
+    assert plain_index is not None
+    assert plain_index.source_file == "2000-01-01.csv"
+    assert [b.rows for b in plain_index.blocks] == [10]
+    assert len(list(src.utils.MessageArchiveIndexer.iterate_blocks(path, plain_index.blocks))) == 10
+    with open(path, "w") as f:
+        f.write("timestamp,message_body\n")
+    plain_index = src.utils.MessageArchiveIndexer.get_index(path)
+    assert plain_index is not None
+    assert plain_index.blocks == []
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_late_write_after_archive_rotation(restore_production_files: None) -> None:
+    date = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=3)
+    timestamp = datetime.datetime(
+        date.year, date.month, date.day, 12, tzinfo=datetime.timezone.utc
+    ).timestamp()
+    path = os.path.join(MESSAGE_ARCHIVE_DIR, date.strftime("%Y-%m-%d.csv"))
+    writer = MessageArchiveWriter(
+        MESSAGE_ARCHIVE_DIR, src.utils.messaging_agent.MESSAGE_ARCHIVE_DIR_LOCK
+    )
+    writer.write(
+        [(timestamp + i, DataMessageBody(data={"i": i}).model_dump_json()) for i in range(5)]
+    )
+    compressed_files, _ = src.utils.ArchiveRotation.rotate(
+        MESSAGE_ARCHIVE_DIR,
+        ".csv",
+        compression="gzip",
+        lock_path=src.utils.messaging_agent.MESSAGE_ARCHIVE_DIR_LOCK,
+    )
+    assert compressed_files == [path + ".gz"]
+
+    # a late line of the compressed day is appended to the compressed file
+    writer.write([(timestamp + 5, DataMessageBody(data={"i": 5}).model_dump_json())])
+    writer.close()
+    assert not os.path.exists(path)
+    assert len(MessagingAgent.load_message_archive(date)) == 6
+    start = datetime.datetime(date.year, date.month, date.day)
+    end = start + datetime.timedelta(days=1)
+    messages = list(MessagingAgent.iterate_message_archive(start, end))
+    assert [m.message_body.data["i"] for m in messages] == [0, 1, 2, 3, 4, 5]  # type: ignore
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_archive_rotation(tmp_path: pathlib.Path) -> None:
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    dates = [today - datetime.timedelta(days=d) for d in [10, 5, 3, 0]]
+
+    def write_file(date: datetime.date, lines: list[str]) -> str:
+        path = str(tmp_path / date.strftime("%Y-%m-%d.log"))
+        with open(path, "a") as f:
+            f.write("".join(lines))
+        return path
+
+    def read_file(date: datetime.date) -> str:
+        path = str(tmp_path / date.strftime("%Y-%m-%d.log"))
+        with src.utils.archive_rotation.open_archive_file(path) as f:
+            return f.read()
+
+    for date in dates:
+        write_file(date, [f"{date} line {i}\n" for i in range(1000)])
+
+    # completed days are compressed, the current day is kept as it is
+    compressed_files, deleted_files = src.utils.ArchiveRotation.rotate(
+        str(tmp_path), ".log", compression="xz"
+    )
+    assert len(compressed_files) == 3
+    assert len(deleted_files) == 0
+    assert sorted(os.listdir(tmp_path)) == [
+        dates[0].strftime("%Y-%m-%d.log.xz"),
+        dates[1].strftime("%Y-%m-%d.log.xz"),
+        dates[2].strftime("%Y-%m-%d.log.xz"),
+        dates[3].strftime("%Y-%m-%d.log"),
+    ]
+    for date in dates:
+        assert read_file(date).splitlines()[999] == f"{date} line 999"
+
+    # lines written to a completed day later on are appended to the compressed file
+    write_file(dates[2], ["late line\n"])
+    src.utils.ArchiveRotation.rotate(str(tmp_path), ".log", compression="xz")
+    assert read_file(dates[2]).splitlines()[-2:] == [f"{dates[2]} line 999", "late line"]
+
+    # retention by age and by size
+    _, deleted_files = src.utils.ArchiveRotation.rotate(
+        str(tmp_path), ".log", compression=None, retention_days=7
+    )
+    assert deleted_files == [str(tmp_path / dates[0].strftime("%Y-%m-%d.log.xz"))]
+    _, deleted_files = src.utils.ArchiveRotation.rotate(
+        str(tmp_path), ".log", compression=None, retention_bytes=1
+    )
+    assert len(deleted_files) == 2
+    assert os.listdir(tmp_path) == [dates[3].strftime("%Y-%m-%d.log")]
+
+    # a day is deleted together with its index sidecar
+    for date in dates[:3]:
+        write_file(date, ["line\n"])
+        with open(str(tmp_path / date.strftime("%Y-%m-%d.log.index.json")), "w") as f:
+            f.write("{}")
+    _, deleted_files = src.utils.ArchiveRotation.rotate(
+        str(tmp_path), ".log", compression=None, retention_bytes=1
+    )
+    assert len(deleted_files) == 6
+    assert os.listdir(tmp_path) == [dates[3].strftime("%Y-%m-%d.log")]
+
+    # the day directories of the columnar archive are deleted by the same policy
+    columnar_dir = tmp_path / "columnar"
+    for date in dates:
+        os.makedirs(columnar_dir / date.isoformat())
+        with open(columnar_dir / date.isoformat() / "a.f64", "wb") as column_file:
+            column_file.write(b"\0" * 16)
+    deleted_directories = src.utils.ArchiveRotation.prune_day_directories(
+        str(columnar_dir), retention_days=7
+    )
+    assert deleted_directories == [str(columnar_dir / dates[0].isoformat())]
+    deleted_directories = src.utils.ArchiveRotation.prune_day_directories(
+        str(columnar_dir), retention_bytes=1
+    )
+    assert len(deleted_directories) == 2
+    assert sorted(os.listdir(columnar_dir)) == [dates[3].isoformat()]
@@ -0,0 +1,289 @@
+import datetime
+import json
+import multiprocessing
+import os
+import threading
+import time
+import pydantic
+import pytest
+from ..fixtures import restore_production_files
+import src
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_state_store(tmp_path: str) -> None:
+    path = os.path.join(tmp_path, "state.mmap")
+    assert not src.utils.StateStore.is_valid(path)
+    src.utils.StateStore.create(path, {"a": b"1", "b": b"2"})
+    assert src.utils.StateStore.is_valid(path)
+
+    writer = src.utils.StateStore(path)
+    reader = src.utils.StateStore(path)
+    sequence_number, sections = reader.read()
+    assert sections == {"a": (b"1", 0), "b": (b"2", 0)}
+
+    # small updates are written in place and only change their own version
+    writer.write({"a": b"3"})
+    new_sequence_number, sections = reader.read()
+    assert new_sequence_number == sequence_number + 2
+    assert sections == {"a": (b"3", 1), "b": (b"2", 0)}
+    assert reader.read(["b"])[1] == {"b": (b"2", 0)}
+
+    # large updates and new sections enlarge the file, readers map it again
+    size = os.path.getsize(path)
+    writer.write({"b": b"x" * 100_000, "c": b"4"})
+    assert os.path.getsize(path) > size
+    assert reader.read()[1] == {"a": (b"3", 1), "b": (b"x" * 100_000, 1), "c": (b"4", 1)}
+
+    # a writer that crashed in the middle of a write
+    src.utils.state_store.StateStore._begin_write(writer.buffer)
+    offset = [row[1] for row in writer._read_table(writer.buffer) if row[0] == "c"][0]
+    writer.buffer[offset : offset + 1] = b"5"
+    with pytest.raises(TimeoutError):
+        reader.read()
+    assert writer.recover() == ["c"]
+    assert reader.read()[1] == {"a": (b"3", 1), "b": (b"x" * 100_000, 1), "c": (b"", 2)}
+    assert writer.recover() == []
+
+    # a relayout replaces the file, the old file is left untouched apart from its header
+    old_buffer = reader.buffer
+    inode = os.stat(path).st_ino
+    writer.write({"a": b"y" * 100_000})
+    assert os.stat(path).st_ino != inode
+    assert old_buffer[:8] == b"IVYSTAT1"
+    assert reader.read(["a"])[1] == {"a": (b"y" * 100_000, 2)}
+    assert reader.buffer is not old_buffer
+
+    # a writer that crashed after replacing the file but before marking the old one
+    src.utils.StateStore.create(path, {"a": b"6"})
+    writer.write({"b": b"7"})
+    assert reader.read()[1] == {"a": (b"6", 0), "b": (b"7", 1)}
+
+
+def _increment_load(count: int) -> None:
+    for _ in range(count):
+        with src.utils.StateInterface.update() as state:
+            state.system.last_5_min_load = (state.system.last_5_min_load or 0) + 1
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_state_interface(restore_production_files: None) -> None:
+    # the state is imported from the JSON snapshot
+    with open(src.utils.state_interface.STATE_FILE, "w") as f:
+        json.dump({"system": {"last_5_min_load": 5}}, f)
+    assert src.utils.StateInterface.load().system.last_5_min_load == 5
+    assert os.path.isfile(src.utils.state_interface.STATE_STORE_FILE)
+    os.remove(src.utils.state_interface.STATE_FILE)
+
+    # only changed sections are written
+    store = src.utils.StateInterface._get_store()
+    versions = {name: version for name, (_, version) in store.read()[1].items()}
+    with src.utils.StateInterface.update() as state:
+        state.system.last_5_min_load = 10
+    new_versions = {name: version for name, (_, version) in store.read()[1].items()}
+    assert new_versions["system"] == versions["system"] + 1
+    assert new_versions["pending_configs"] == versions["pending_configs"]
+    assert src.utils.StateInterface.load().system.last_5_min_load == 10
+
+    # the snapshot is written after the update
+    with open(src.utils.state_interface.STATE_FILE, "r") as f:
+        assert json.load(f)["system"]["last_5_min_load"] == 10
+
+    # concurrent updates from multiple processes are not lost
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_increment_load, args=(20,)) for _ in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+        assert p.exitcode == 0
+    assert src.utils.StateInterface.load().system.last_5_min_load == 90
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_state_field_access(restore_production_files: None) -> None:
+    assert src.utils.StateInterface.get("system.last_5_min_load") is None
+    assert src.utils.StateInterface.get("pending_configs") == []
+
+    src.utils.StateInterface.set("system.last_5_min_load", 20)
+    assert src.utils.StateInterface.get("system.last_5_min_load") == 20
+    assert src.utils.StateInterface.load().system.last_5_min_load == 20
+
+    assert not src.utils.StateInterface.compare_and_set("system.last_5_min_load", 10, 30)
+    assert src.utils.StateInterface.compare_and_set("system.last_5_min_load", 20, 30)
+    assert src.utils.StateInterface.get("system.last_5_min_load") == 30
+
+    with pytest.raises(ValueError):
+        src.utils.StateInterface.get("unknown.field")
+    with pytest.raises(KeyError):
+        src.utils.StateInterface.get("system.unknown_field")
+    with pytest.raises(KeyError):
+        src.utils.StateInterface.set("pending_configs.0", None)
+    with pytest.raises(pydantic.ValidationError):
+        src.utils.StateInterface.set("system.last_5_min_load", "not a number")
+    assert src.utils.StateInterface.get("system.last_5_min_load") == 30
+
+    # waiting for a change of a field
+    with pytest.raises(TimeoutError):
+        src.utils.StateInterface.wait_for_change("system.last_5_min_load", timeout=0.1)
+    timer = threading.Timer(0.2, src.utils.StateInterface.set, ("system.last_5_min_load", 40))
+    timer.start()
+    assert src.utils.StateInterface.wait_for_change("system.last_5_min_load", timeout=5) == 40
+    timer.join()
+
+    # writing the same value is not a change
+    changes: list[tuple[object, object]] = []
+    subscription = src.utils.StateInterface.subscribe(
+        "system.last_5_min_load", lambda old, new: changes.append((old, new)), poll_interval=0.01
+    )
+    src.utils.StateInterface.set("system.last_5_min_load", 40)
+    src.utils.StateInterface.set("system.last_boot_time", "2021-01-01T00:00:00")
+    time.sleep(0.1)
+    src.utils.StateInterface.set("system.last_5_min_load", 50)
+    for _ in range(100):
+        if len(changes) > 0:
+            break
+        time.sleep(0.01)
+    subscription.cancel()
+    src.utils.StateInterface.set("system.last_5_min_load", 60)
+    time.sleep(0.05)
+    assert changes == [(40, 50)]
+
+    # changes made while the callback is running are passed afterwards
+    changes = []
+
+    def slow_callback(old: object, new: object) -> None:
+        changes.append((old, new))
+        time.sleep(0.3)
+
+    subscription = src.utils.StateInterface.subscribe(
+        "system.last_5_min_load", slow_callback, poll_interval=0.01
+    )
+    src.utils.StateInterface.set("system.last_5_min_load", 70)
+    for _ in range(100):
+        if len(changes) > 0:
+            break
+        time.sleep(0.01)
+    src.utils.StateInterface.set("system.last_5_min_load", 80)
+    for _ in range(100):
+        if len(changes) > 1:
+            break
+        time.sleep(0.01)
+    subscription.cancel()
+    assert changes == [(60, 70), (70, 80)]
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_state_snapshot_and_cache(restore_production_files: None) -> None:
+    # an invalid top-level field does not discard the other fields
+    config = src.types.Config.load_template().to_foreign_config()
+    with open(src.utils.state_interface.STATE_FILE, "w") as f:
+        f.write(
+            json.dumps(
+                {
+                    "system": {"last_5_min_load": "invalid"},
+                    "pending_configs": [json.loads(config.model_dump_json())],
+                }
+            )
+        )
+    state = src.utils.StateInterface.load()
+    assert state.system.last_5_min_load is None
+    assert len(state.pending_configs) == 1
+
+    # repeated loads return the cached state until the state is written,
+    # updates work on their own copy and leave the cached state unchanged
+    assert src.utils.StateInterface.load() is state
+    assert src.utils.StateInterface.get("pending_configs") is state.pending_configs
+    with src.utils.StateInterface.update() as updated_state:
+        assert updated_state is not state
+        updated_state.system.last_5_min_load = 4
+    assert state.system.last_5_min_load is None
+    src.utils.StateInterface.set("system.last_5_min_load", 5)
+    assert state.system.last_5_min_load is None
+    new_state = src.utils.StateInterface.load()
+    assert new_state is not state
+    assert new_state.system.last_5_min_load == 5
+    assert src.utils.StateInterface.get("system.last_5_min_load") == 5
+
+    # snapshots are replaced atomically
+    src.utils.StateInterface.write_snapshot()
+    with open(src.utils.state_interface.STATE_FILE, "r") as f:
+        assert json.load(f)["system"]["last_5_min_load"] == 5
+    assert not any(
+        [
+            filename.startswith("state.json.") and filename.endswith(".tmp")
+            for filename in os.listdir(src.constants.DATA_DIR)
+        ]
+    )
+
+    # fields left corrupted by a crashed writer are restored from the snapshot
+    src.utils.StateInterface.set("system.last_5_min_load", 6)
+    store = src.utils.StateInterface._get_store()
+    src.utils.state_store.StateStore._begin_write(store.buffer)
+    offset = [row[1] for row in store._read_table(store.buffer) if row[0] == "system"][0]
+    store.buffer[offset : offset + 1] = b"?"
+    state = src.utils.StateInterface.load()
+    assert state.system.last_5_min_load == 5
+    assert len(state.pending_configs) == 1
+
+    # an unreadable snapshot is kept for debugging
+    src.utils.StateInterface.close()
+    os.remove(src.utils.state_interface.STATE_STORE_FILE)
+    with open(src.utils.state_interface.STATE_FILE, "w") as f:
+        f.write('{"system": {"last_5_min_lo')
+    assert src.utils.StateInterface.load() == src.types.State()
+    invalid_snapshot = src.utils.state_interface.STATE_FILE + ".invalid"
+    assert os.path.isfile(invalid_snapshot)
+    os.remove(invalid_snapshot)
+
+
+@pytest.mark.order(2)
+@pytest.mark.quick
+def test_state_history(restore_production_files: None) -> None:
+    # values at known times, one every 10 seconds over 30 hours
+    history = src.utils.StateHistory.get("system.last_5_min_load")
+    now = time.time()
+    start = now - 30 * 3600
+    for i in range(30 * 360):
+        history.append(float(i % 10), start + i * 10)
+
+    # recent ranges are computed from the individual values
+    statistics = history.get_statistics(now - 300, now)
+    assert statistics is not None
+    assert statistics.resolution is None
+    assert statistics.count == 30
+    assert (statistics.min, statistics.max, statistics.mean) == (0, 9, 4.5)
+
+    # older ranges fall back to the per-minute aggregates
+    statistics = history.get_statistics(now - 29 * 3600, now)
+    assert statistics is not None
+    assert statistics.resolution == 60
+    assert 29 * 360 <= statistics.count <= 29 * 360 + 6
+    assert (statistics.min, statistics.max) == (0, 9)
+    assert len(history.get_values(now - 29 * 3600, now - 28 * 3600)) in [60, 61]
+    assert history.get_statistics(now + 60, now + 120) is None
+
+    # updates of the state record the enabled fields
+    src.utils.StateInterface.enable_history(["system.last_5_min_load"])
+    try:
+        query_start = datetime.datetime.now(datetime.timezone.utc)
+        src.utils.StateInterface.set("system.last_5_min_load", 20)
+        with src.utils.StateInterface.update() as state:
+            state.system.last_5_min_load = 30
+        with src.utils.StateInterface.update() as state:
+            state.system.last_boot_time = datetime.datetime(2021, 1, 1)
+        src.utils.StateInterface.set("pending_configs", [])
+        values = src.utils.StateInterface.get_history("system.last_5_min_load", query_start)
+        assert [value for _, value in values] == [20, 30, 30]
+        assert all([dt >= query_start for dt, _ in values])
+        statistics = src.utils.StateInterface.get_history_statistics(
+            "system.last_5_min_load", query_start.replace(tzinfo=None)
+        )
+        assert statistics is not None
+        assert (statistics.count, statistics.mean) == (3, 80 / 3)
+    finally:
+        src.utils.StateInterface.enable_history([])